@@ -1,11 +1,18 @@
 import importlib
 import pathlib
 import os
+import time
+from typing import Dict
 from beeprint import pp
-from .compiler.typechk import TyChecker
 from .compiler.nodegen import NodeGen
-from .compiler.Parser import parser_from_src, parser_from_file
+from .compiler.incremental import ModuleCache
+from .compiler.importer import import_graphs
+from .compiler import cache
+from .compiler.cache import Compiled, compile_cached, compile_file_cached, compile_lines_cached, compiled, open_disk_cache
+from .compiler.npgen import compile_fn
+from .compiler.bake import bake
 import bpy
+from bpy_extras.io_utils import ImportHelper
 from bpy.types import (
     Panel,
     Operator,
@@ -56,11 +63,27 @@ class BLSL_PT_Panel(Panel):
             row.prop(gc, "text_prop", text="")
         row = row.column()
         row.operator("blsl_compiler.compile")
+        row.operator("blsl_compiler.import_graph")
         row.operator("blsl_compiler.run_tests")
+        row.operator("blsl_compiler.bake")
+        layout.prop(gc, "inline_mode")
+        layout.prop(gc, "hoist_literals")
+        row = layout.row(align=True)
+        row.prop(gc, "cache_size")
+        row.prop(gc, "use_disk_cache")
+
+        col = layout.column(align=True)
+        col.prop(gc, "bake_function")
+        col.prop(gc, "bake_input")
+        col.prop(gc, "bake_attribute")
+        row = col.row(align=True)
+        row.prop(gc, "chunk_size")
+        row.prop(gc, "threads")
 
         row = layout.row(align=True)
         row.prop(gc, "debug_ast_output")
         row.prop(gc, "debug_token_output")
+        row.prop(gc, "debug_ir_output")
 
 
 class Context:
@@ -74,38 +97,97 @@ class Context:
         self.filenames.append(name)
 
 
+# per text datablock name
+module_caches: Dict[str, ModuleCache] = {}
+
+
+def configure_caches(gc):
+    compiled.resize(gc.cache_size)
+    # opened on first use, the settings aren't readable while registering
+    if gc.use_disk_cache and not cache.disk_cache:
+        open_disk_cache(bpy.utils.user_resource('DATAFILES', path='blsl_cache', create=True))
+    elif not gc.use_disk_cache and cache.disk_cache:
+        open_disk_cache(None)
+
+
+def compile_source(gc, tree_type: str) -> Compiled:
+    """Compiles the selected text datablock or file."""
+    if gc.source_type == "INTERNAL":
+        # text datablocks are edited in place, only recheck what changed
+        text = gc.text_prop
+        check = module_caches.setdefault(text.name, ModuleCache()).compile_lines
+        return compile_lines_cached(
+            lambda: (line.body for line in text.lines), tree_type, gc.inline_mode, gc.hoist_literals, check)
+    elif gc.source_type == "EXTERNAL":
+        return compile_file_cached(gc.filepath, tree_type, gc.inline_mode, gc.hoist_literals)
+    else:
+        assert False
+
+
+def has_source(gc) -> bool:
+    return bool(
+        (gc.source_type == "INTERNAL" and gc.text_prop) or
+        (gc.source_type == "EXTERNAL" and gc.filepath))
+
+
 class BLSL_OT_compile(Operator):
     bl_idname = "blsl_compiler.compile"
     bl_label = "Compile"
 
     @classmethod
     def poll(cls, context):
-        gc = context.window_manager.blsl_compiler
-        return \
-            (gc.source_type == "INTERNAL" and gc.text_prop) or \
-            (gc.source_type == "EXTERNAL" and gc.filepath)
+        return has_source(context.window_manager.blsl_compiler)
 
     def dump_ast(self, ast):
         print("======= AST dump start =======")
         pp(ast, max_depth=20)
         print("======== AST dump end ========")
 
+    def dump_ir(self, graphs):
+        print("======= IR dump start =======")
+        for graph in graphs:
+            print(graph.dump())
+        print("======== IR dump end ========")
+
     def execute(self, context):
         gc = context.window_manager.blsl_compiler
-        if gc.source_type == "INTERNAL":
-            parser = parser_from_src(gc.text_prop.as_string())
-        elif gc.source_type == "EXTERNAL":
-            parser = parser_from_file(gc.filepath)
-        else:
-            assert False
+        configure_caches(gc)
+        result = compile_source(gc, context.space_data.tree_type)
 
-        ast = parser.parse()
-        TyChecker(ast)
         if gc.debug_ast_output:
-            self.dump_ast(ast)
-        nodes = NodeGen(ast, context).emit(clear=True)
+            self.dump_ast(result.module)
+        if gc.debug_ir_output:
+            self.dump_ir(result.graphs)
+        gen = NodeGen(result.module, context)
+        trees = gen.emit(compiled=result)
+        dropped = sum(graph.stats.get('dce', 0) for graph in gen.graphs)
+        if dropped:
+            self.report({'INFO'}, f"{dropped} unused node(s) removed")
+        if 'added' in gen.stats:
+            self.report({'INFO'}, "{added} added, {removed} removed, {relinked} relinked, {reused} kept".format(**gen.stats))
+        self.report({'INFO'}, "compile cache: {hits} hit(s), {misses} miss(es)".format(**compiled.stats))
+        if 'node_align' in globals():
+            for nodes in trees:
+                node_align.operators.distribute_nodes(nodes, None, "HORIZONTAL")
+        return {'FINISHED'}
+
+
+class BLSL_OT_import_graph(Operator, ImportHelper):
+    """Instantiate a node graph written by `python -m compiler`"""
+    bl_idname = "blsl_compiler.import_graph"
+    bl_label = "Import Node Graph"
+
+    filter_glob: bpy.props.StringProperty(default="*.json;*.json.gz", options={'HIDDEN'})
+
+    @classmethod
+    def poll(cls, context):
+        return hasattr(context.space_data, 'node_tree') and context.space_data.node_tree
+
+    def execute(self, context):
+        trees = import_graphs(self.filepath, context.space_data.node_tree)
         if 'node_align' in globals():
-            node_align.operators.distribute_nodes(nodes, None, "HORIZONTAL")
+            for nodes in trees:
+                node_align.operators.distribute_nodes(nodes, None, "HORIZONTAL")
         return {'FINISHED'}
 
 
@@ -119,6 +201,7 @@ class BLSL_OT_run_tests(Operator):
         return hasattr(space, 'node_tree') and space.node_tree.bl_idname == 'GeometryNodeTree'
 
     def execute(self, context):
+        configure_caches(context.window_manager.blsl_compiler)
         addon_dir = pathlib.Path(__file__).absolute().parent
         tests_dir = os.path.join(addon_dir, 'tests')
         passed = 0
@@ -149,10 +232,8 @@ class BLSL_OT_run_tests(Operator):
                         f"\x1b[1;33m[WARN]\x1b[0m {file.stem}.py: \"{test['title']}\" skipped")
                     continue
 
-                parser = parser_from_src(test['src'])
-                ast = parser.parse()
-                TyChecker(ast)
-                NodeGen(ast, context).emit()
+                result = compile_cached(test['src'], context.space_data.tree_type)
+                NodeGen(result.module, context).emit(compiled=result)
                 nt = context.space_data.node_tree
                 obj = context.object
                 group_out = nt.nodes['Group Output']
@@ -222,6 +303,37 @@ class BLSL_OT_run_tests(Operator):
         return {'FINISHED'}
 
 
+class BLSL_OT_bake(Operator):
+    """Evaluate a function on the CPU for every point of the active mesh and store the results as attributes"""
+    bl_idname = "blsl_compiler.bake"
+    bl_label = "Bake Attribute"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    @classmethod
+    def poll(cls, context):
+        obj = context.object
+        return has_source(context.window_manager.blsl_compiler) and \
+            obj and obj.type == 'MESH' and obj.mode == 'OBJECT'
+
+    def execute(self, context):
+        gc = context.window_manager.blsl_compiler
+        configure_caches(gc)
+        result = compile_source(gc, 'GeometryNodeTree')
+        kernel = compile_fn(result.module, gc.bake_function or None)
+        mesh = context.object.data
+        start = time.perf_counter()
+        try:
+            bake(kernel, mesh, gc.bake_input, gc.bake_attribute, gc.chunk_size, gc.threads or os.cpu_count())
+        except AssertionError as e:
+            # attributes that don't fit the function's parameters
+            self.report({'ERROR'}, f"{kernel.name}: {e}")
+            return {'CANCELLED'}
+        elapsed = time.perf_counter() - start
+        mesh.update()
+        self.report({'INFO'}, f"{kernel.name}: baked {len(mesh.vertices)} points in {elapsed:.3f}s")
+        return {'FINISHED'}
+
+
 class BLSLCompiler(PropertyGroup):
     source_type: bpy.props.EnumProperty(name="Source Type", items=[
         ("INTERNAL", "Internal", ""),
@@ -235,13 +347,40 @@ class BLSLCompiler(PropertyGroup):
     debug_ast_output: bpy.props.BoolProperty(name="AST output", default=False)
     debug_token_output: bpy.props.BoolProperty(
         name="Token output", default=False)
+    debug_ir_output: bpy.props.BoolProperty(name="IR output", default=False)
+    inline_mode: bpy.props.EnumProperty(name="Inline", items=[
+        ("AUTO", "Auto", "Inline a function when that adds fewer nodes than a node group"),
+        ("ALWAYS", "Always", "Inline every function call"),
+        ("NEVER", "Never", "Instance a node group for every function call"),
+    ])
+    cache_size: bpy.props.IntProperty(
+        name="Cache Size", description="Compiles kept for unchanged sources", default=64, min=0)
+    use_disk_cache: bpy.props.BoolProperty(
+        name="Disk Cache", description="Keep compiles across sessions", default=True)
+    hoist_literals: bpy.props.EnumProperty(name="Literals as Inputs", items=[
+        ("NONE", "None", "Bake literals into the nodes"),
+        ("CONST", "Const", "Expose const locals initialized with a literal as group inputs"),
+        ("ALL", "All", "Expose every literal as a group input"),
+    ])
+    bake_function: bpy.props.StringProperty(
+        name="Function", description="Function to bake, the last one if empty", default="")
+    bake_input: bpy.props.StringProperty(
+        name="Input", description="Point attribute passed as the first parameter", default="position")
+    bake_attribute: bpy.props.StringProperty(
+        name="Output", description="Point attribute the return value is stored in", default="blsl")
+    chunk_size: bpy.props.IntProperty(
+        name="Chunk Size", description="Points evaluated at once by a thread", default=65536, min=1)
+    threads: bpy.props.IntProperty(
+        name="Threads", description="Threads baking chunks, one per core if 0", default=0, min=0)
 
 
 classes = [
     BLSL_PT_Panel,
     BLSLCompiler,
     BLSL_OT_compile,
+    BLSL_OT_import_graph,
     BLSL_OT_run_tests,
+    BLSL_OT_bake,
 ]
 
 
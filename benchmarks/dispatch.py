@@ -0,0 +1,103 @@
+"""
+Per-node cost of dispatching on AST node classes, a structural `match`
+chain against a `Visitor` dispatch table, with a plain method call as the
+baseline.
+
+    python benchmarks/dispatch.py
+"""
+import pathlib
+import sys
+import timeit
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from compiler.Ast import *  # noqa: E402
+from compiler.visitor import Visitor, handles  # noqa: E402
+
+
+class Matching:
+    def kind(self, expr):
+        match expr:
+            case Assign(left, init):
+                return 0
+            case Int():
+                return 1
+            case Float():
+                return 2
+            case Ident(name):
+                return 3
+            case Binary(left, right, op):
+                return 4
+            case Call(name, args):
+                return 5
+            case Field(Ident(name), Ident(field)):
+                return 6
+            case Unary(_, expr):
+                return 7
+            case _:
+                assert False
+
+
+class Dispatching(Visitor):
+    @handles('kind', Assign)
+    def kind_assign(self, expr):
+        return 0
+
+    @handles('kind', Int)
+    def kind_int(self, expr):
+        return 1
+
+    @handles('kind', Float)
+    def kind_float(self, expr):
+        return 2
+
+    @handles('kind', Ident)
+    def kind_ident(self, expr):
+        return 3
+
+    @handles('kind', Binary)
+    def kind_binary(self, expr):
+        return 4
+
+    @handles('kind', Call)
+    def kind_call(self, expr):
+        return 5
+
+    @handles('kind', Field)
+    def kind_field(self, expr):
+        return 6
+
+    @handles('kind', Unary)
+    def kind_unary(self, expr):
+        return 7
+
+
+class Direct:
+    def kind(self, expr):
+        return 0
+
+
+def main():
+    x = Ident('x')
+    samples = {
+        'Assign': Assign(x, x),
+        'Int': Int('1'),
+        'Float': Float('1.0'),
+        'Ident': x,
+        'Binary': Binary(x, x, BinaryKind.Add),
+        'Call': Call('f', []),
+        'Field': Field(x, Ident('y')),
+        'Unary': Unary(UnaryKind.Negative, x),
+    }
+    n = 200_000
+    print(f"{'node':8} {'match':>8} {'visitor':>8} {'call':>8}  ns/node")
+    for name, node in samples.items():
+        row = []
+        for passes in (Matching(), Dispatching(), Direct()):
+            kind = passes.kind
+            row.append(min(timeit.repeat(lambda: kind(node), number=n, repeat=5)) / n * 1e9)
+        print(f"{name:8} {row[0]:8.0f} {row[1]:8.0f} {row[2]:8.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""
+Parse and type check time and AST memory on a generated multi-megabyte
+source, built the same way as the tokenizer benchmark.
+
+    python benchmarks/frontend.py [megabytes]
+"""
+import pathlib
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+from benchmarks.tokenizer import source  # noqa: E402
+from compiler.Parser import parser_from_src  # noqa: E402
+from compiler.typechk import TyChecker  # noqa: E402
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 4.0
+    src = source(megabytes)
+    parse = check = None
+    for _ in range(3):
+        start = time.perf_counter()
+        module = parser_from_src(src).parse()
+        parsed = time.perf_counter()
+        TyChecker(module)
+        checked = time.perf_counter()
+        parse = min(parse or parsed - start, parsed - start)
+        check = min(check or checked - parsed, checked - parsed)
+        del module
+
+    tracemalloc.start()
+    module = parser_from_src(src).parse()
+    TyChecker(module)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{len(src) / 1e6:.1f} MB, {len(module.defs)} functions: "
+          f"parse {parse:.3f}s, check {check:.3f}s, AST {size / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
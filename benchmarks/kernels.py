@@ -0,0 +1,56 @@
+"""
+Samples per second of evaluating a box SDF on the CPU, walking the AST
+with `npeval` against calling the kernel `npgen` generates, over one large
+array and over the small chunks a bake processes.
+
+    python benchmarks/kernels.py [samples] [chunk]
+"""
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+
+import numpy as np  # noqa: E402
+from compiler.npeval import evaluate  # noqa: E402
+from compiler.npgen import compile_fn  # noqa: E402
+from compiler.Parser import parser_from_src  # noqa: E402
+from compiler.typechk import TyChecker  # noqa: E402
+
+src = """
+float sdf(vec3 p, vec3 size, float r) {
+    vec3 q = abs(p) - size;
+    float inside = min(max(q.x, max(q.y, q.z)), 0.0);
+    return length(max(q, 0.0)) + inside - r;
+}
+"""
+
+
+def rate(fn, p: np.ndarray, chunk: int) -> float:
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for i in range(0, len(p), chunk):
+            fn({'p': p[i:i + chunk], 'size': (1.0, 0.5, 0.25), 'r': 0.1})
+        elapsed = time.perf_counter() - start
+        best = min(best or elapsed, elapsed)
+    return len(p) / best
+
+
+def main():
+    samples = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    chunk = int(sys.argv[2]) if len(sys.argv) > 2 else 4096
+    module = parser_from_src(src).parse()
+    TyChecker(module)
+    kernel = compile_fn(module)
+    p = np.random.default_rng(0).standard_normal((samples, 3)).astype(np.float32)
+
+    assert np.array_equal(evaluate(module, {'p': p[:chunk], 'size': (1.0, 0.5, 0.25), 'r': 0.1})['ret'],
+                          kernel({'p': p[:chunk], 'size': (1.0, 0.5, 0.25), 'r': 0.1})['ret'])
+    for name, fn in (('npeval', lambda inputs: evaluate(module, inputs)), ('npgen', kernel)):
+        print(f"{name}: {rate(fn, p, samples):,.0f} samples/s, "
+              f"{rate(fn, p, chunk):,.0f} samples/s in chunks of {chunk}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Tokenizer throughput on a generated multi-megabyte source, built by
+repeating the programs of the test tables.
+
+    python benchmarks/tokenizer.py [megabytes]
+"""
+import importlib
+import pathlib
+import re
+import sys
+import time
+
+root = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(root))
+
+from compiler.tokenizer import tokenize, TokenBuffer  # noqa: E402
+
+
+fn_re = re.compile(r"\b(?:void|int|float|vec2|vec3|vec4)\s+(\w+)\s*\(")
+
+
+def source(megabytes: float) -> str:
+    srcs = []
+    for path in sorted((root / 'tests').glob('*.py')):
+        srcs += [case['src'] for case in importlib.import_module(f'tests.{path.stem}')._]
+    out = []
+    size = 0
+    i = 0
+    while size < megabytes * 1e6:
+        # every copy defines its own functions
+        src = re.sub(r"\b(%s)\b" % "|".join(fn_re.findall(srcs[i % len(srcs)])),
+                     rf"\g<0>_{i}", srcs[i % len(srcs)]) + f"\n// helper {i}\n"
+        out.append(src)
+        size += len(src)
+        i += 1
+    return "\n".join(out)
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 4.0
+    src = source(megabytes)
+    for name, scan in (('list', tokenize), ('buffer', TokenBuffer)):
+        best = None
+        for _ in range(3):
+            start = time.perf_counter()
+            tokens = scan(src)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        print(f"{name}: {len(src) / 1e6:.1f} MB, {len(tokens)} tokens in {best:.3f}s: "
+              f"{len(tokens) / best / 1e6:.2f} M tokens/s, {len(src) / 1e6 / best:.2f} MB/s")
+        del tokens
+
+
+if __name__ == '__main__':
+    main()
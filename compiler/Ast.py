@@ -1,9 +1,10 @@
 from __future__ import annotations
-from typing import List
+from typing import Dict, List
 from enum import Enum, auto
 
 
 class Def:
+    __slots__ = ('kind', )
     __match_args__ = ('kind', )
 
     def __init__(self, kind):
@@ -34,10 +35,24 @@ class TypeKind(Enum):
 
 
 class Ty:
+    """
+    Types are interned, there is one `Ty` per `TypeKind` so that equality is
+    identity.
+    """
+    __slots__ = ('kind', )
     __match_args__ = ('kind', )
+    _interned: Dict[TypeKind, Ty] = {}
 
-    def __init__(self, kind: TypeKind):
-        self.kind = kind
+    def __new__(cls, kind: TypeKind) -> Ty:
+        ty = cls._interned.get(kind)
+        if ty is None:
+            ty = super().__new__(cls)
+            ty.kind = kind
+            cls._interned[kind] = ty
+        return ty
+
+    def __reduce__(self):
+        return (Ty, (self.kind, ))
 
     def display_name(self) -> str:
         return self.kind.display_name()
@@ -48,27 +63,39 @@ class Ty:
     def get_size(self) -> int:
         return self.kind.get_size()
 
-    def __eq__(self, __o: Ty) -> bool:
-        if __o == None:
-            return False
-        return self.kind == __o.kind
 
-    def __ne__(self, __o: Ty) -> bool:
-        return not self.__eq__(__o)
+class Expr:
+    """
+    Base of the expression nodes, which are used directly as expressions
+    without a wrapper.
+    """
+    __slots__ = ('ty', )
+
+    def __init__(self):
+        # inferred type, cached by `TyChecker.infer`
+        self.ty: Ty | None = None
 
 
-class Ident:
+class Ident(Expr):
+    __slots__ = ('name', 'slot', )
     __match_args__ = ('name', )
 
     def __init__(self, name: str):
+        super().__init__()
         self.name = name
-        self.ty: Ty | None = None
+        # index of the variable in its function, assigned by `resolve_locals`
+        self.slot: int | None = None
 
 
 class TyQualifier:
+    __slots__ = ()
+
     def is_output(self) -> bool:
         raise NotImplementedError()
 
+    def is_const(self) -> bool:
+        raise NotImplementedError()
+
 
 class StorageQualifier(Enum):
     Const = auto()
@@ -85,6 +112,7 @@ class StorageQualifier(Enum):
 
 
 class Storage(TyQualifier):
+    __slots__ = ('kind', )
     __match_args__ = ('kind', )
 
     def __init__(self, kind: StorageQualifier):
@@ -93,8 +121,12 @@ class Storage(TyQualifier):
     def is_output(self) -> bool:
         return self.kind.is_output()
 
+    def is_const(self) -> bool:
+        return self.kind == StorageQualifier.Const
+
 
 class FnArg:
+    __slots__ = ('name', 'ty', 'ty_qualifiers', )
     __match_args__ = ('name', 'ty', 'ty_qualifiers', )
 
     def __init__(self, name: Ident, ty: Ty, ty_qualifiers: List[TyQualifier]):
@@ -103,13 +135,6 @@ class FnArg:
         self.ty_qualifiers = ty_qualifiers
 
 
-class Expr:
-    __match_args__ = ('kind', )
-
-    def __init__(self, kind):
-        self.kind = kind
-
-
 class BinaryKind(Enum):
     Add = auto()
     Sub = auto()
@@ -128,76 +153,95 @@ class BinaryKind(Enum):
             case _: assert False, f"{self}"
 
 
-class Binary:
-    __match_args__ = ('left', 'right', 'kind', )
+class Binary(Expr):
+    __slots__ = ('left', 'right', 'op', )
+    __match_args__ = ('left', 'right', 'op', )
 
-    def __init__(self, left: Expr, right: Expr, kind: BinaryKind):
+    def __init__(self, left: Expr, right: Expr, op: BinaryKind):
+        super().__init__()
         self.left = left
         self.right = right
-        self.kind = kind
-        self.ty: Ty | None = None
+        self.op = op
 
 
 class UnaryKind(Enum):
     Negative = auto()
 
 
-class Unary:
-    __match_args__ = ('kind', 'expr', )
+class Unary(Expr):
+    __slots__ = ('op', 'expr', )
+    __match_args__ = ('op', 'expr', )
 
-    def __init__(self, kind: UnaryKind, expr: Expr):
-        self.kind = kind
+    def __init__(self, op: UnaryKind, expr: Expr):
+        super().__init__()
+        self.op = op
         self.expr = expr
 
 
-class Assign:
+class Assign(Expr):
+    __slots__ = ('left', 'init', )
     __match_args__ = ('left', 'init', )
 
     def __init__(self, left: Expr, init: Expr):
+        super().__init__()
         self.left = left
         self.init = init
 
 
-class Int:
+class Int(Expr):
+    __slots__ = ('value', )
     __match_args__ = ('value', )
 
     def __init__(self, value: str):
+        super().__init__()
         self.value = value
 
 
-class Float:
+class Float(Expr):
+    __slots__ = ('value', )
     __match_args__ = ('value', )
 
     def __init__(self, value: str):
+        super().__init__()
         self.value = value
 
 
-class Call:
+class Call(Expr):
+    __slots__ = ('name', 'args', 'sig', )
     __match_args__ = ('name', 'args', )
 
     def __init__(self, name: str, args: List[Expr]):
+        super().__init__()
         self.name = name
         self.args = args
         self.sig: int | None = None
 
 
-class Field:
+class Field(Expr):
+    __slots__ = ('name', 'field', )
     __match_args__ = ('name', 'field', )
 
     def __init__(self, name: Ident, field: Ident):
+        super().__init__()
         self.name = name
         self.field = field
 
 
 class Decl:
-    __match_args__ = ('ty', 'decls', )
+    __slots__ = ('ty', 'decls', 'ty_qualifiers', )
+    __match_args__ = ('ty', 'decls', 'ty_qualifiers', )
 
-    def __init__(self, ty: Ty, decls: ExprStmt):
+    def __init__(self, ty: Ty, decls: ExprStmt, ty_qualifiers: List[TyQualifier] | None = None):
         self.ty = ty
         self.decls = decls
+        self.ty_qualifiers = ty_qualifiers or []
+
+    def is_const(self) -> bool:
+        return any(qual.is_const() for qual in self.ty_qualifiers)
 
 
 class ExprStmt:
+    __slots__ = ("exprs", )
     __match_args__ = ("exprs", )
 
     def __init__(self, exprs: List[Expr]):
@@ -205,6 +249,7 @@ class ExprStmt:
 
 
 class Return:
+    __slots__ = ('expr', )
     __match_args__ = ('expr', )
 
     def __init__(self, expr: Expr):
@@ -212,6 +257,8 @@ class Return:
 
 
 class Stmt:
+    __slots__ = ('kind', )
+
     def __init__(self, kind: ExprStmt
                  | Decl
                  | Return):
@@ -219,11 +266,14 @@ class Stmt:
 
 
 class Block:
+    __slots__ = ('stmts', )
+
     def __init__(self, stmts: List[Stmt]):
         self.stmts = stmts
 
 
 class FnSig:
+    __slots__ = ('args', 'ret_ty', )
     __match_args__ = ('args', 'ret_ty', )
 
     def __init__(self, args: List[FnArg], ret_ty: Ty):
@@ -232,14 +282,21 @@ class FnSig:
 
 
 class Fn:
+    __slots__ = ('name', 'sig', 'body', 'locals', 'calls', )
     __match_args__ = ('name', 'sig', 'body', )
 
     def __init__(self, name: Ident, sig: FnSig, body: Block):
         self.name = name
         self.sig = sig
         self.body = body
+        # variable names by slot, assigned by `resolve_locals`
+        self.locals: List[str] = []
+        # names of the functions called, one per call site, by `resolve_locals`
+        self.calls: List[str] = []
 
 
 class Module:
+    __slots__ = ('defs', )
+
     def __init__(self, defs: List[Def]):
         self.defs = defs
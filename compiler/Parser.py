@@ -1,6 +1,6 @@
-from typing import List, Dict
+from typing import Iterable, List, Dict, Tuple
 from .Ast import *
-from .tokenizer import Token, TokenKind, tokenize
+from .tokenizer import TokenKind, TokenBuffer, TokenStream, scan_file, scan_lines
 
 
 storage_qualifiers: Dict[TokenKind, StorageQualifier] = {
@@ -21,34 +21,44 @@ binary_op: Dict[TokenKind, BinaryKind] = {
 }
 
 
+# binding strength of the binary operators, all of them are left associative
+binary_precedence: Dict[TokenKind, int] = {
+    TokenKind.EqEq: 1,
+    TokenKind.NotEq: 1,
+    TokenKind.Plus: 2,
+    TokenKind.Minus: 2,
+    TokenKind.Asterisk: 3,
+    TokenKind.Slash: 3,
+}
+
+
 class Parser:
-    def __init__(self, tokens: List[Token]):
+    def __init__(self, tokens: TokenBuffer | TokenStream):
         self.tokens = tokens
         self.i = 0
-        self.tokens_len = len(self.tokens)
-        self.t: Token = self.tokens[self.i]
+        # kind of the current token, `None` past the end
+        self.t: TokenKind | None = tokens.kind(0)
 
     def eat(self):
-        if self.i < self.tokens_len - 1:
-            self.i += 1
-            self.t = self.tokens[self.i]
-        else:
-            self.t = None  # type: ignore
+        self.i += 1
+        self.t = self.tokens.kind(self.i)
+
+    def peek(self) -> TokenKind | None:
+        return self.tokens.kind(self.i + 1)
 
-    def peek(self) -> Token | None:
-        if self.i < self.tokens_len - 2:
-            return self.tokens[self.i + 1]
+    def text(self) -> str:
+        return self.tokens.text(self.i)
 
-    def expect(self, kind: TokenKind) -> Token:
-        if self.t.kind == kind:
-            t = self.t
+    def expect(self, kind: TokenKind) -> int:
+        if self.t == kind:
+            i = self.i
             self.eat()
-            return t
+            return i
         else:
-            assert False, f"expected `{kind}`, found `{self.t.kind}`"
+            assert False, f"{self.tokens.loc(self.i)}: expected `{kind}`, found `{self.t}`"
 
     def parse_ty(self) -> Ty:
-        match ty := self.t.kind.get_ty():
+        match ty := self.t.get_ty():
             case None:
                 assert False, 'expected type'
             case _:
@@ -56,10 +66,10 @@ class Parser:
                 return Ty(ty)
 
     def parse_ident(self) -> Ident:
-        return Ident(self.expect(TokenKind.Ident).value)
+        return Ident(self.tokens.text(self.expect(TokenKind.Ident)))
 
     def parse_storage_qualifier(self) -> Storage | None:
-        kind = self.t.kind
+        kind = self.t
         if kind in storage_qualifiers:
             self.eat()
             return Storage(storage_qualifiers[kind])
@@ -82,9 +92,9 @@ class Parser:
     def parse_fn_args(self) -> List[FnArg]:
         self.expect(TokenKind.LParen)
         args: List[FnArg] = []
-        while self.t and self.t.kind != TokenKind.RParen:
+        while self.t and self.t != TokenKind.RParen:
             args.append(self.parse_fn_arg())
-            if self.t.kind == TokenKind.Comma:
+            if self.t == TokenKind.Comma:
                 self.eat()
             else:
                 break
@@ -92,19 +102,19 @@ class Parser:
         return args
 
     def parse_call(self) -> Call:
-        ident = self.t.value
+        ident = self.text()
         self.eat()
         self.expect(TokenKind.LParen)
         args: List[Expr] = []
-        while self.t and self.t.kind != TokenKind.RParen:
+        while self.t and self.t != TokenKind.RParen:
             args.append(self.parse_expr())
-            match self.t.kind:
+            match self.t:
                 case TokenKind.Comma:
                     self.eat()
                 case TokenKind.RParen:
                     break
                 case _:
-                    assert False, f"expected one of `}}` or `,`, got `{self.t.kind}`"
+                    assert False, f"expected one of `}}` or `,`, got `{self.t}`"
         self.expect(TokenKind.RParen)
         return Call(ident, args)
 
@@ -115,88 +125,86 @@ class Parser:
         return Field(name, field)
 
     def parse_primary(self) -> Expr:
-        match self.t.kind:
+        match self.t:
             case TokenKind.Ident:
                 next = self.peek()
                 if not next:
                     assert False, "unexpected eof"
-                match next.kind:
+                match next:
                     case TokenKind.LParen:
-                        return Expr(self.parse_call())
+                        return self.parse_call()
                     case TokenKind.Period:
-                        return Expr(self.parse_field_selector())
+                        return self.parse_field_selector()
                     case _:
-                        return Expr(self.parse_ident())
+                        return self.parse_ident()
             case TokenKind.Int \
                     | TokenKind.Float \
                     | TokenKind.Vec2 \
                     | TokenKind.Vec3 \
                     | TokenKind.Vec4:
-                return Expr(self.parse_call())
+                return self.parse_call()
             case TokenKind.IntLit:
-                return Expr(Int(self.expect(TokenKind.IntLit).value))
+                return Int(self.tokens.text(self.expect(TokenKind.IntLit)))
             case TokenKind.FloatLit:
-                return Expr(Float(self.expect(TokenKind.FloatLit).value))
+                return Float(self.tokens.text(self.expect(TokenKind.FloatLit)))
             case _:
-                assert False, f"{self.t.kind}, not implemented"
+                assert False, f"{self.t}, not implemented"
 
     def parse_unary(self) -> Expr:
-        match self.t.kind:
+        match self.t:
             case TokenKind.Minus:
                 self.eat()
-                return Expr(Unary(UnaryKind.Negative, self.parse_primary()))
+                return Unary(UnaryKind.Negative, self.parse_primary())
             case _:
                 return self.parse_primary()
 
-    def parse_factor(self) -> Expr:
-        left = self.parse_unary()
-        while self.t.kind in [TokenKind.Asterisk, TokenKind.Slash]:
-            kind = binary_op[self.t.kind]
-            self.eat()
-            left = Expr(Binary(left, self.parse_factor(), kind))
-        return left
-
-    def parse_term(self) -> Expr:
-        left = self.parse_factor()
-        while self.t.kind in [TokenKind.Plus, TokenKind.Minus]:
-            kind = binary_op[self.t.kind]
-            self.eat()
-            left = Expr(Binary(left, self.parse_term(), kind))
-        return left
+    def parse_binary_expr(self) -> Expr:
+        # precedence climbing with explicit stacks, operators of the same
+        # precedence are reduced as soon as the next one is seen, which makes
+        # them left associative without recursing for the right operand
+        operands: List[Expr] = [self.parse_unary()]
+        operators: List[Tuple[int, BinaryKind]] = []
 
-    def parse_relational_expr(self) -> Expr:
-        return self.parse_term()
+        def reduce():
+            _, kind = operators.pop()
+            right = operands.pop()
+            operands.append(Binary(operands.pop(), right, kind))
 
-    def parse_equality_expr(self) -> Expr:
-        left = self.parse_relational_expr()
-        while self.t.kind in [TokenKind.EqEq, TokenKind.NotEq]:
-            op = binary_op[self.t.kind]
+        while (precedence := binary_precedence.get(self.t)) != None:  # type: ignore
+            kind = binary_op[self.t]  # type: ignore
             self.eat()
-            right = self.parse_assign_expr()
-            left = Expr(Binary(left, right, op))
-        return left
+            while operators and operators[-1][0] >= precedence:
+                reduce()
+            operators.append((precedence, kind))
+            operands.append(self.parse_unary())
+        while operators:
+            reduce()
+        return operands[0]
 
     def parse_conditional_expr(self) -> Expr:
-        return self.parse_equality_expr()
+        return self.parse_binary_expr()
 
     def parse_assign_expr(self) -> Expr:
-        left = self.parse_conditional_expr()
-        while self.t.kind == TokenKind.Eq:
+        # assignment is right associative, `a = b = c` is `a = (b = c)`
+        exprs = [self.parse_conditional_expr()]
+        while self.t == TokenKind.Eq:
             self.eat()
-            right = self.parse_assign_expr()
-            left = Expr(Assign(left, right))
-        return left
+            exprs.append(self.parse_conditional_expr())
+        expr = exprs.pop()
+        while exprs:
+            expr = Assign(exprs.pop(), expr)
+        return expr
 
     def parse_expr(self) -> Expr:
         return self.parse_assign_expr()
 
     def parse_expr_stmt(self) -> ExprStmt:
         exprs: List[Expr] = []
-        while self.t.kind != TokenKind.Semi:
+        while self.t != TokenKind.Semi:
             exprs.append(self.parse_expr())
-            if self.t.kind == TokenKind.Semi:
+            if self.t == TokenKind.Semi:
                 break
-            elif self.t.kind == TokenKind.Comma:
+            elif self.t == TokenKind.Comma:
                 self.eat()
                 continue
             else:
@@ -205,14 +213,15 @@ class Parser:
         return ExprStmt(exprs)
 
     def parse_decl_stmt(self) -> Decl:
+        ty_qualifiers = self.parse_ty_qualifier()
         ty = self.parse_ty()
         exprs = self.parse_expr_stmt()
-        return Decl(ty, exprs)
+        return Decl(ty, exprs, ty_qualifiers)
 
     def parse_stmt(self) -> Stmt | None:
-        if self.t.kind.get_ty():
+        if self.t.get_ty() or self.t in storage_qualifiers:
             return Stmt(self.parse_decl_stmt())
-        elif self.t.kind == TokenKind.Return:
+        elif self.t == TokenKind.Return:
             self.eat()
             return Stmt(Return(self.parse_expr()))
         else:
@@ -223,7 +232,7 @@ class Parser:
     def parse_block(self) -> Block:
         self.expect(TokenKind.LBrace)
         stmts: List[Stmt] = []
-        while self.t and self.t.kind != TokenKind.RBrace:
+        while self.t and self.t != TokenKind.RBrace:
             if (stmt := self.parse_stmt()) != None:
                 stmts.append(stmt)
         self.expect(TokenKind.RBrace)
@@ -232,7 +241,7 @@ class Parser:
     def parse_def(self) -> Def:
         ty = self.parse_ty()
         ident = self.parse_ident()
-        if self.t.kind == TokenKind.LParen:
+        if self.t == TokenKind.LParen:
             args = self.parse_fn_args()
             block = self.parse_block()
             return Def(Fn(ident, FnSig(args, ty), block))
@@ -247,11 +256,12 @@ class Parser:
 
 
 def parser_from_src(src: str) -> Parser:
-    tokens = tokenize(src)
-    return Parser(tokens)
+    return Parser(TokenBuffer(src))
+
+
+def parser_from_lines(lines: Iterable[str]) -> Parser:
+    return Parser(TokenStream(scan_lines(lines)))
 
 
 def parser_from_file(filepath: str) -> Parser:
-    with open(filepath, 'r') as f:
-        src = f.read()
-        return parser_from_src(src)
+    return Parser(TokenStream(scan_file(filepath)))
@@ -0,0 +1,103 @@
+"""
+Compiles BLSL files without Blender and writes the node graphs they lower
+to, see `serialize.graphs_to_dict`. The add-on's "Import Node Graph"
+operator instantiates them.
+
+    python -m compiler shader.blsl -o build/
+    python -m compiler --check src/*.blsl
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+from .cache import DiskCache, check_src, compile_cached, open_disk_cache
+from .callgraph import CallGraph
+from .serialize import dump, graphs_to_dict
+
+
+def out_path(src: str, out_dir: str | None, ext: str) -> str:
+    base = os.path.splitext(os.path.basename(src))[0] + ext
+    return os.path.join(out_dir, base) if out_dir else os.path.splitext(src)[0] + ext
+
+
+def compile_file(path: str, args: argparse.Namespace) -> Tuple[str, str | None]:
+    """
+    Compiles one file, returns its path and the error message if any. With
+    `--check` it's only type checked, nothing is written or cached.
+
+    >>> import shutil, tempfile
+    >>> from . import cache
+    >>> root = tempfile.mkdtemp()
+    >>> path = os.path.join(root, 'f.blsl')
+    >>> with open(path, 'w') as f:
+    ...     _ = f.write("float f() { return 1.0; }")
+    >>> size = len(cache.compiled)
+    >>> main([path, '--check', '--cache-dir', os.path.join(root, 'cache')])
+    0
+    >>> sorted(os.listdir(root)), len(cache.compiled) == size
+    (['f.blsl'], True)
+    >>> with open(path, 'w') as f:
+    ...     _ = f.write("float f() { return x; }")
+    >>> compile_file(path, argparse.Namespace(check=True))[1]
+    '`x` is not defined'
+    >>> _ = open_disk_cache(None)
+    >>> shutil.rmtree(root)
+    >>>
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            src = f.read()
+        if args.check:
+            check_src(src)
+            return path, None
+        result = compile_cached(src, args.tree_type, args.inline, args.hoist)
+        roots = [fn.name.name for fn in CallGraph(result.module).roots()]
+        dump(graphs_to_dict(result.graphs, roots, args.tree_type), out_path(path, args.out_dir, args.ext))
+    except (AssertionError, OSError) as e:
+        return path, str(e)
+    return path, None
+
+
+def init_worker(cache_dir: str | None):
+    open_disk_cache(cache_dir)
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m compiler', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('-o', '--out-dir', help="directory of the node graphs, next to the sources by default")
+    parser.add_argument('--tree-type', default='ShaderNodeTree', choices=['ShaderNodeTree', 'GeometryNodeTree'])
+    parser.add_argument('--inline', default='AUTO', choices=['AUTO', 'ALWAYS', 'NEVER'])
+    parser.add_argument('--hoist', default='NONE', choices=['NONE', 'CONST', 'ALL'])
+    parser.add_argument('--gzip', dest='ext', action='store_const', const='.json.gz', default='.json',
+                        help="write gzip compressed graphs")
+    parser.add_argument('--check', action='store_true', help="only type check")
+    parser.add_argument('--cache-dir', help="keep compiles in this directory, see `DiskCache`; "
+                        "they're unpickled, only use a directory no one else can write to")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="worker processes")
+    args = parser.parse_args(argv)
+
+    if args.out_dir:
+        os.makedirs(args.out_dir, exist_ok=True)
+    if args.jobs > 1 and len(args.files) > 1:
+        if args.cache_dir:
+            # clears stale versions once instead of racing in every worker
+            DiskCache(args.cache_dir)
+        with ProcessPoolExecutor(args.jobs, initializer=init_worker, initargs=(args.cache_dir, )) as pool:
+            results = list(pool.map(compile_file, args.files, [args] * len(args.files), chunksize=16))
+    else:
+        open_disk_cache(args.cache_dir)
+        results = [compile_file(path, args) for path in args.files]
+
+    failed = 0
+    for path, error in results:
+        if error:
+            print(f"{path}: {error}", file=sys.stderr)
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+from __future__ import annotations
+from typing import Dict, Tuple
+import numpy as np
+from .Ast import Ty, TypeKind
+from .npgen import Kernel
+
+# attribute data type and `foreach_set` property of the outputs by type
+attribute_types = {
+    TypeKind.Int: ('INT', 'value'),
+    TypeKind.Float: ('FLOAT', 'value'),
+    TypeKind.Vec2: ('FLOAT_VECTOR', 'vector'),
+    TypeKind.Vec3: ('FLOAT_VECTOR', 'vector'),
+    TypeKind.Vec4: ('FLOAT_VECTOR', 'vector'),
+}
+
+
+def attribute_info(mesh, name: str) -> Tuple[str, str]:
+    """The domain and data type of the attribute `name` of `mesh`."""
+    if name not in mesh.attributes and name == 'position':
+        # meshes before 3.5 have no position attribute
+        return 'POINT', 'FLOAT_VECTOR'
+    attr = mesh.attributes[name]
+    return attr.domain, attr.data_type
+
+
+def check_input(mesh, name: str, ty: Ty):
+    """Asserts that the attribute `name` can be read into a parameter of type `ty`."""
+    domain, data_type = attribute_info(mesh, name)
+    if domain != 'POINT':
+        assert False, f"`{name}` is a {domain.lower()} attribute, only point attributes can be baked"
+    if data_type not in ('INT', 'FLOAT', 'FLOAT_VECTOR'):
+        assert False, f"`{name}` is a {data_type} attribute, which can't be baked"
+    if (data_type == 'FLOAT_VECTOR') != ty.is_vector():
+        assert False, f"`{name}` is a {data_type} attribute, it can't be read into a `{ty.display_name()}` parameter"
+
+
+def check_output(name: str, ty: Ty):
+    """Asserts that a result of type `ty` can be stored in the attribute `name`."""
+    if name == 'position' and attribute_types[ty.kind][0] != 'FLOAT_VECTOR':
+        assert False, f"`position` can't store a `{ty.display_name()}` result"
+
+
+def read_attribute(mesh, name: str) -> np.ndarray:
+    """The values of the point attribute `name`, vectors as rows."""
+    if name not in mesh.attributes and name == 'position':
+        data = np.zeros(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get('co', data)
+        return data.reshape(-1, 3)
+    attr = mesh.attributes[name]
+    size = len(attr.data)
+    match ty := attr.data_type:
+        case 'INT':
+            data = np.zeros(size, dtype=np.int32)
+            attr.data.foreach_get('value', data)
+            return data.astype(np.float32)
+        case 'FLOAT':
+            data = np.zeros(size, dtype=np.float32)
+            attr.data.foreach_get('value', data)
+            return data
+        case 'FLOAT_VECTOR':
+            data = np.zeros(size * 3, dtype=np.float32)
+            attr.data.foreach_get('vector', data)
+            return data.reshape(-1, 3)
+        case _:
+            assert False, f"{ty}"
+
+
+def write_attribute(mesh, name: str, data: np.ndarray, ty: Ty):
+    data_type, prop = attribute_types[ty.kind]
+    if data_type == 'INT':
+        data = data.astype(np.int32)
+    attr = mesh.attributes.get(name)
+    if attr and (attr.data_type != data_type or attr.domain != 'POINT'):
+        mesh.attributes.remove(attr)
+        attr = None
+    if not attr:
+        attr = mesh.attributes.new(name, data_type, 'POINT')
+    attr.data.foreach_set(prop, data.ravel())
+
+
+def bake(kernel: Kernel, mesh, input: str, attribute: str, chunk_size: int = 65536, threads: int | None = None):
+    """
+    Evaluates `kernel` for every point of `mesh`. The first parameter reads
+    the attribute `input`, the others the attributes named like them if
+    any, parameters without one take their defaults. The result is stored
+    in the attribute `attribute` and out parameters in attributes named
+    like them. Every attribute is checked before any is read or written.
+
+    >>> import bpy
+    >>> from compiler.Parser import parser_from_src
+    >>> from compiler.typechk import TyChecker
+    >>> from compiler.npgen import compile_fn
+    >>> def kernel(src):
+    ...     module = parser_from_src(src).parse()
+    ...     _ = TyChecker(module)
+    ...     return compile_fn(module)
+    >>> mesh = bpy.data.meshes.new('mesh')
+    >>> mesh.vertices.add(2)
+    >>> mesh.vertices.foreach_set('co', [3.0, 4.0, 0.0, 1.0, 2.0, 2.0])
+    >>> scale = mesh.attributes.new('scale', 'FLOAT', 'POINT')
+    >>> scale.data.foreach_set('value', [1.0, 2.0])
+    >>> bake(kernel("float f(vec3 p, float scale) { return length(p) * scale; }"), mesh, 'position', 'len')
+    >>> data = np.zeros(2, np.float32)
+    >>> mesh.attributes['len'].data.foreach_get('value', data)
+    >>> data
+    array([5., 6.], dtype=float32)
+    >>> bake(kernel("float f(float x) { return x; }"), mesh, 'position', 'x')
+    Traceback (most recent call last):
+    ...
+    AssertionError: `position` is a FLOAT_VECTOR attribute, it can't be read into a `float` parameter
+    >>> _ = mesh.attributes.new('area', 'FLOAT', 'FACE')
+    >>> bake(kernel("float f(float area) { return area; }"), mesh, 'area', 'x')
+    Traceback (most recent call last):
+    ...
+    AssertionError: `area` is a face attribute, only point attributes can be baked
+    >>> bake(kernel("float f(vec3 p) { return p.x; }"), mesh, 'position', 'position')
+    Traceback (most recent call last):
+    ...
+    AssertionError: `position` can't store a `float` result
+    >>> 'x' in mesh.attributes
+    False
+    >>>
+    """
+    inputs: Dict[str, str] = {}
+    for i, inp in enumerate(kernel.inputs):
+        name = input if i == 0 else inp.name
+        if name in mesh.attributes or name == 'position':
+            check_input(mesh, name, inp.ty)
+            inputs[inp.name] = name
+    outputs = {name: attribute if name == 'ret' else name for name in kernel.outputs}
+    for name, attr in outputs.items():
+        check_output(attr, kernel.outputs[name])
+
+    values = {name: read_attribute(mesh, attr) for name, attr in inputs.items()}
+    outs = kernel.map(values, len(mesh.vertices), chunk_size, threads)
+    for name, data in outs.items():
+        write_attribute(mesh, outputs[name], data, kernel.outputs[name])
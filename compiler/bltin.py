@@ -1,3 +1,4 @@
+from typing import Dict, List, Tuple
 from .Ast import *
 
 Tfloat = Ty(TypeKind.Float)
@@ -69,3 +70,15 @@ builtins = {
         Sig([Tfloat], Tfloat),
     ],
 }
+
+
+# `(name, argument types)` -> `(signature index, return type)`, resolves an
+# overload with a single lookup instead of trying every signature
+overloads: Dict[Tuple[str, Tuple[TypeKind, ...]], Tuple[int, Ty]] = {}
+for name, sigs in builtins.items():
+    for i, sig in enumerate(sigs):
+        overloads.setdefault((name, tuple(ty.kind for ty in sig.args)), (i, sig.ret_ty))
+
+
+def resolve(name: str, args: List[Ty]) -> Tuple[int, Ty] | None:
+    return overloads.get((name, tuple(ty.kind for ty in args)))
@@ -0,0 +1,302 @@
+from __future__ import annotations
+import contextlib
+import hashlib
+import mmap
+import os
+import pickle
+import re
+import shutil
+from collections import OrderedDict
+from typing import Callable, Dict, Generic, Iterable, List, TypeVar
+from .Ast import Module
+from .ir import Graph
+from .lower import lower_module
+from .Parser import parser_from_lines, parser_from_src
+from .tokenizer import mapped_lines
+from .typechk import TyChecker
+
+K = TypeVar('K')
+V = TypeVar('V')
+
+comment_re = re.compile(r"//[^\n]*")
+space_re = re.compile(r"\s+")
+# names of the directories `DiskCache` keeps the compiles of a version in
+version_re = re.compile(r"[0-9a-f]{32}")
+
+
+class LRUCache(Generic[K, V]):
+    """
+    Mapping with at most `size` entries, adding one more evicts the least
+    recently used.
+
+    >>> cache = LRUCache(2)
+    >>> cache.put('a', 1); cache.put('b', 2)
+    >>> cache.get('a')
+    1
+    >>> cache.put('c', 3)
+    >>> cache.get('b') is None, cache.get('c')
+    (True, 3)
+    >>> cache.stats
+    {'hits': 2, 'misses': 1, 'evictions': 1}
+    >>>
+    """
+
+    def __init__(self, size: int = 64):
+        self.size = size
+        self.entries: OrderedDict[K, V] = OrderedDict()
+        self.stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: K) -> V | None:
+        if key not in self.entries:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key: K, value: V):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        self.evict()
+
+    def resize(self, size: int):
+        self.size = size
+        self.evict()
+
+    def evict(self):
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        self.entries.clear()
+
+
+def normalize(src: str) -> str:
+    """
+    The source without what can't change the compiled nodes: comments and
+    the amount of whitespace between tokens.
+
+    >>> normalize("float f() { // one\\r\\n  return 1.0;  \\r\\n}\\n")
+    'float f() { return 1.0; }'
+    >>>
+    """
+    return space_re.sub(' ', comment_re.sub('', src)).strip()
+
+
+def cache_key(src: str, tree_type: str, **options: str) -> str:
+    """Hash of the normalized source, target tree type and compiler options."""
+    return lines_key((src, ), tree_type, **options)
+
+
+def lines_key(lines: Iterable[str], tree_type: str, **options: str) -> str:
+    """
+    `cache_key` of the source read one line at a time, the lines are
+    normalized and hashed as they come.
+
+    >>> src = "float f() { // one\\n  return 1.0;\\n}\\n"
+    >>> lines_key(src.splitlines(), 'ShaderNodeTree') == cache_key(src, 'ShaderNodeTree')
+    True
+    >>>
+    """
+    h = hashlib.blake2b(digest_size=16)
+    separator = b''
+    for line in lines:
+        words = comment_re.sub('', line).split()
+        if words:
+            h.update(separator + ' '.join(words).encode())
+            separator = b' '
+    h.update(tree_type.encode())
+    for name, value in sorted(options.items()):
+        h.update(f"\0{name}={value}".encode())
+    return h.hexdigest()
+
+
+class Compiled:
+    """Everything compiling a source produces before node generation."""
+    __match_args__ = ('key', 'module', 'graphs', )
+
+    def __init__(self, key: str, module: Module, graphs: List[Graph]):
+        self.key = key
+        self.module = module
+        self.graphs = graphs
+
+
+def compiler_version() -> str:
+    """Hash of the compiler's sources, changes whenever any of them does."""
+    h = hashlib.blake2b(digest_size=16)
+    root = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(root)):
+        if name.endswith('.py'):
+            h.update(name.encode())
+            with open(os.path.join(root, name), 'rb') as f:
+                h.update(f.read())
+    return h.hexdigest()
+
+
+class DiskCache:
+    """
+    Compiles pickled into `root`, one file per cache key, so they survive
+    restarts. Files live in `root/compiles/<compiler_version>`, the
+    directories of other versions are deleted when the cache is opened.
+    Only directories in `compiles` named like a version are, `root` may be
+    shared with anything else. Loading unpickles the files, which can run
+    any code in them, so `root` must only be writable by the user, like the
+    add-on's default in Blender's per-user data files.
+
+    >>> import tempfile
+    >>> root = tempfile.mkdtemp()
+    >>> for name in ('0' * 32, 'notes'):
+    ...     os.makedirs(os.path.join(root, 'compiles', name))
+    >>> cache = DiskCache(root)
+    >>> os.listdir(os.path.join(root, 'compiles'))
+    ['notes']
+    >>> value = compile_cached("float f() { return 1.0; }")
+    >>> cache.get(value.key) is None
+    True
+    >>> cache.put(value.key, value)
+    >>> cache.get(value.key).key == value.key, cache.version == compiler_version()
+    (True, True)
+    >>> sorted(os.listdir(os.path.join(root, 'compiles'))) == sorted([cache.version, 'notes'])
+    True
+    >>> cache.stats
+    {'hits': 1, 'misses': 1, 'writes': 1}
+    >>> shutil.rmtree(root)
+    >>>
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.version = compiler_version()
+        versions = os.path.join(root, 'compiles')
+        self.path = os.path.join(versions, self.version)
+        self.stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'writes': 0}
+        if os.path.isdir(versions):
+            for name in os.listdir(versions):
+                other = os.path.join(versions, name)
+                if name != self.version and version_re.fullmatch(name) and os.path.isdir(other):
+                    shutil.rmtree(other, ignore_errors=True)
+
+    def file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.pickle")
+
+    def get(self, key: str) -> Compiled | None:
+        try:
+            with open(self.file(key), 'rb') as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            self.stats['misses'] += 1
+            return None
+        except Exception:
+            # truncated or otherwise unreadable, compile again; another
+            # process may have removed or replaced it already
+            with contextlib.suppress(OSError):
+                os.remove(self.file(key))
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        return value
+
+    def put(self, key: str, value: Compiled):
+        try:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except RecursionError:
+            # expressions nesting deeper than pickle recurses aren't stored
+            return
+        os.makedirs(self.path, exist_ok=True)
+        # another process may load the file while it's written
+        tmp = f"{self.file(key)}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self.file(key))
+        self.stats['writes'] += 1
+
+
+# compiles of this session, see `compile_cached`
+compiled: LRUCache[str, Compiled] = LRUCache()
+# compiles of earlier sessions, off unless opened with `open_disk_cache`
+disk_cache: DiskCache | None = None
+
+
+def open_disk_cache(root: str | None) -> DiskCache | None:
+    global disk_cache
+    disk_cache = DiskCache(root) if root else None
+    return disk_cache
+
+
+def check_src(src: str) -> Module:
+    module = parser_from_src(src).parse()
+    TyChecker(module)
+    return module
+
+
+def check_lines(lines: Callable[[], Iterable[str]]) -> Module:
+    module = parser_from_lines(lines()).parse()
+    TyChecker(module)
+    return module
+
+
+def lookup(key: str, tree_type: str, inline: str, hoist: str, check: Callable[[], Module]) -> Compiled:
+    hit = compiled.get(key)
+    if hit is None and disk_cache:
+        hit = disk_cache.get(key)
+        if hit:
+            compiled.put(key, hit)
+    if hit is None:
+        module = check()
+        hit = Compiled(key, module, lower_module(module, tree_type, inline, hoist))
+        compiled.put(key, hit)
+        if disk_cache:
+            disk_cache.put(key, hit)
+    return hit
+
+
+def compile_cached(src: str, tree_type: str = 'ShaderNodeTree', inline: str = 'AUTO', hoist: str = 'NONE',
+                   check: Callable[[str], Module] = check_src) -> Compiled:
+    """
+    Parses, checks and lowers `src`, or returns what an earlier compile of
+    the same normalized source with the same options produced, looking in
+    this session's compiles first and then in `disk_cache`. `check` parses
+    and type checks the source on a miss. The result is shared, callers
+    must not modify it.
+
+    >>> size = compiled.size
+    >>> compiled.resize(1)
+    >>> a = compile_cached("float f() { return 1.0; }")
+    >>> compile_cached("float f()  {  return 1.0; }  // same") is a
+    True
+    >>> b = compile_cached("float f() { return 2.0; }")
+    >>> compile_cached("float f() { return 1.0; }") is a, len(compiled)
+    (False, 1)
+    >>> compiled.resize(size)
+    >>>
+    """
+    key = cache_key(src, tree_type, inline=inline, hoist=hoist)
+    return lookup(key, tree_type, inline, hoist, lambda: check(src))
+
+
+def compile_lines_cached(lines: Callable[[], Iterable[str]], tree_type: str = 'ShaderNodeTree',
+                         inline: str = 'AUTO', hoist: str = 'NONE',
+                         check: Callable[[Callable[[], Iterable[str]]], Module] = check_lines) -> Compiled:
+    """
+    `compile_cached` of the source `lines()` yields, without joining it.
+    The lines are read once for the key and again by `check` on a miss.
+    """
+    key = lines_key(lines(), tree_type, inline=inline, hoist=hoist)
+    return lookup(key, tree_type, inline, hoist, lambda: check(lines))
+
+
+def compile_file_cached(filepath: str, tree_type: str = 'ShaderNodeTree', inline: str = 'AUTO',
+                        hoist: str = 'NONE') -> Compiled:
+    """
+    `compile_lines_cached` of a file. It's memory-mapped once, the key is
+    hashed from the mapping and a miss parses the same mapping.
+    """
+    with open(filepath, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return compile_lines_cached(lambda: (), tree_type, inline, hoist)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return compile_lines_cached(lambda: mapped_lines(mm), tree_type, inline, hoist)
@@ -0,0 +1,85 @@
+from __future__ import annotations
+from typing import Dict, List
+from .Ast import *
+
+# evaluating a group instance costs about as much as this many nodes
+group_cost = 4
+
+
+class CallGraph:
+    """Calls between the functions of a type checked module."""
+
+    def __init__(self, module: Module):
+        self.fns: Dict[str, Fn] = {}
+        for deff in module.defs:
+            match deff.kind:
+                case Fn(Ident(name)) as fn:
+                    self.fns[name] = fn
+        # callees of every function, one entry per call site
+        self.callees: Dict[str, List[str]] = {
+            name: [callee for callee in fn.calls if callee in self.fns]
+            for name, fn in self.fns.items()
+        }
+        # number of call sites of every function
+        self.calls: Dict[str, int] = dict.fromkeys(self.fns, 0)
+        for callees in self.callees.values():
+            for callee in callees:
+                self.calls[callee] += 1
+
+    def order(self) -> List[Fn]:
+        """The functions with every callee before its callers."""
+        order: List[Fn] = []
+        # 1 while a function's callees are visited, 2 once it's ordered
+        state: Dict[str, int] = {}
+        for root in self.fns:
+            if root in state:
+                continue
+            state[root] = 1
+            stack = [(root, iter(self.callees[root]))]
+            while stack:
+                name, callees = stack[-1]
+                for callee in callees:
+                    match state.get(callee):
+                        case None:
+                            state[callee] = 1
+                            stack.append((callee, iter(self.callees[callee])))
+                            break
+                        case 1:
+                            assert False, f"`{callee}` is recursive, node groups can't call themselves"
+                else:
+                    stack.pop()
+                    state[name] = 2
+                    order.append(self.fns[name])
+        return order
+
+    def roots(self) -> List[Fn]:
+        """The functions that aren't called by any other, in source order."""
+        return [fn for name, fn in self.fns.items() if not self.calls[name]]
+
+
+class Inliner:
+    """
+    Decides whether calls of a function are inlined or instance its node
+    group. `mode` is 'AUTO', 'ALWAYS' or 'NEVER'; in 'AUTO' a function is
+    inlined when copying its body into every caller expands to no more
+    nodes than one shared group plus `group_cost` per instance. `sizes`
+    holds the node count of every function lowered so far.
+    """
+
+    def __init__(self, graph: CallGraph, mode: str = 'AUTO'):
+        self.graph = graph
+        self.mode = mode
+        self.sizes: Dict[str, int] = {}
+
+    def inline(self, name: str) -> bool:
+        match self.mode:
+            case 'ALWAYS':
+                return True
+            case 'NEVER':
+                return False
+            case 'AUTO':
+                size = self.sizes[name]
+                calls = self.graph.calls[name]
+                return size * calls <= size + calls * group_cost
+            case _:
+                assert False, f"{self.mode}"
@@ -0,0 +1,87 @@
+from __future__ import annotations
+from typing import Dict, Hashable, Set, Tuple
+from .ir import Node, Const, Input, Op, Broadcast, Extract, Group, Result, Graph
+
+# operations whose first two inputs can be swapped without changing the result
+commutative: Set[Tuple[str, str]] = {
+    ('ShaderNodeMath', 'ADD'),
+    ('ShaderNodeMath', 'MULTIPLY'),
+    ('ShaderNodeMath', 'MINIMUM'),
+    ('ShaderNodeMath', 'MAXIMUM'),
+    ('ShaderNodeMath', 'COMPARE'),
+    ('ShaderNodeVectorMath', 'ADD'),
+    ('ShaderNodeVectorMath', 'MULTIPLY'),
+    ('ShaderNodeVectorMath', 'MINIMUM'),
+    ('ShaderNodeVectorMath', 'MAXIMUM'),
+    ('ShaderNodeVectorMath', 'DOT_PRODUCT'),
+}
+
+
+def value_number(graph: Graph):
+    """
+    Hash-conses the graph, structurally identical nodes with the same
+    arguments are merged into the first one.
+
+    >>> from compiler.bltin import Tfloat
+    >>> g = Graph('f')
+    >>> a, b = g.add_input('a', Tfloat), g.add_input('b', Tfloat)
+    >>> def op(operation, *args):
+    ...     return g.add(Op('ShaderNodeMath', operation, list(args), Tfloat))
+    >>> for name, value in (('x', op('ADD', op('MULTIPLY', a, b), g.add(Const(Tfloat, 1.0)))),
+    ...                     ('y', op('ADD', op('MULTIPLY', b, a), g.add(Const(Tfloat, 1.0)))),
+    ...                     ('z', op('SUBTRACT', op('SUBTRACT', a, b), op('SUBTRACT', b, a)))):
+    ...     _ = g.add_output(name, Tfloat)
+    ...     g.set_output(name, value)
+    >>> g.node_count()
+    7
+    >>> value_number(g)
+    >>> g.node_count()
+    5
+    >>> print(g.dump())
+    graph f:
+      %2: float = ShaderNodeMath.MULTIPLY(%a, %b)
+      %3: float = ShaderNodeMath.ADD(%2, 1.0)
+      %4: float = ShaderNodeMath.SUBTRACT(%a, %b)
+      %5: float = ShaderNodeMath.SUBTRACT(%b, %a)
+      %6: float = ShaderNodeMath.SUBTRACT(%4, %5)
+      out x: float = %3
+      out y: float = %3
+      out z: float = %6
+    >>>
+    """
+    numbers: Dict[Node, int] = {}
+    table: Dict[Hashable, Node] = {}
+
+    def key(node: Node) -> Hashable:
+        args = tuple(numbers[arg] for arg in node.args)
+        match node:
+            case Const(value):
+                return ('const', node.ty.kind, value)
+            case Op(node_type, operation, _):
+                if (node_type, operation) in commutative and len(args) == 2:
+                    args = tuple(sorted(args))
+                return ('op', node_type, operation, node.ty.kind, args)
+            case Broadcast():
+                return ('broadcast', node.ty.kind, args)
+            case Extract(_, index):
+                return ('extract', index, args)
+            case Group(name, _):
+                return ('group', name, args)
+            case Result(_, name):
+                return ('result', name, args)
+            case _:
+                assert False, f"{node}"
+
+    def number(node: Node) -> Node:
+        match node:
+            case Input():
+                numbers[node] = len(numbers)
+                return node
+        k = key(node)
+        if k in table:
+            return table[k]
+        table[k] = node
+        numbers[node] = len(numbers)
+        return node
+
+    graph.rewrite(number)
@@ -0,0 +1,40 @@
+from __future__ import annotations
+from typing import Set
+from .ir import Node, Input, Graph
+
+
+def eliminate_dead_code(graph: Graph):
+    """
+    Removes nodes that don't contribute to any group output. The number of
+    dropped Blender nodes is recorded in `graph.stats['dce']`, extracts of
+    one vector share a Separate XYZ node and count once.
+
+    >>> from compiler.bltin import Tfloat, vec3
+    >>> from compiler.ir import Const, Extract, Op
+    >>> g = Graph('f')
+    >>> v, s = g.add_input('v', vec3), g.add_input('s', Tfloat)
+    >>> x, y = g.add(Extract(v, 0, Tfloat)), g.add(Extract(v, 1, Tfloat))
+    >>> _ = g.add(Op('ShaderNodeMath', 'ADD', [x, y], Tfloat))
+    >>> _ = g.add_output('ret', Tfloat)
+    >>> g.set_output('ret', g.add(Op('ShaderNodeMath', 'MULTIPLY', [s, g.add(Const(Tfloat, 2.0))], Tfloat)))
+    >>> eliminate_dead_code(g)
+    >>> g.stats['dce']
+    2
+    >>> print(g.dump())
+    graph f:
+      %2: float = ShaderNodeMath.MULTIPLY(%s, 2.0)
+      out ret: float = %2
+    >>>
+    """
+    before = graph.node_count()
+    live: Set[Node] = set()
+    stack = [out.value for out in graph.outputs.values() if out.value]
+    while stack:
+        node = stack.pop()
+        if node in live:
+            continue
+        live.add(node)
+        stack.extend(node.args)
+    graph.nodes = [node for node in graph.nodes
+                   if node in live or isinstance(node, Input)]
+    graph.stats['dce'] = graph.stats.get('dce', 0) + before - graph.node_count()
@@ -0,0 +1,184 @@
+from __future__ import annotations
+import math
+import struct
+from typing import Callable, Dict, List, Tuple
+from .ir import Node, Const, Op, Broadcast, Extract, Graph
+
+FLT_EPSILON = 1.1920928955078125e-07
+
+Scalar = float
+Vector = Tuple[float, float, float]
+
+
+def f32(x: float) -> float:
+    """Rounds `x` to the nearest single precision float, like Blender does."""
+    try:
+        return struct.unpack('f', struct.pack('f', x))[0]
+    except OverflowError:
+        return math.copysign(math.inf, x)
+
+
+def to_float(value) -> Scalar:
+    match value:
+        case tuple():
+            # implicit vector to float conversion averages the components
+            return f32(f32(f32(value[0] + value[1]) + value[2]) / 3)
+        case _:
+            return f32(float(value))
+
+
+def to_vector(value) -> Vector:
+    match value:
+        case tuple():
+            return tuple(f32(v) for v in value)
+        case _:
+            v = f32(float(value))
+            return (v, v, v)
+
+
+def safe_divide(a: float, b: float) -> float:
+    return f32(a / b) if b != 0.0 else 0.0
+
+
+def safe_sqrt(a: float) -> float:
+    return f32(math.sqrt(a)) if a > 0.0 else 0.0
+
+
+def vmap(fn: Callable[..., float]) -> Callable[..., Vector]:
+    return lambda *args: tuple(fn(*lanes) for lanes in zip(*args))
+
+
+def dot(a: Vector, b: Vector) -> Scalar:
+    return f32(f32(f32(a[0] * b[0]) + f32(a[1] * b[1])) + f32(a[2] * b[2]))
+
+
+def cross(a: Vector, b: Vector) -> Vector:
+    return (
+        f32(f32(a[1] * b[2]) - f32(a[2] * b[1])),
+        f32(f32(a[2] * b[0]) - f32(a[0] * b[2])),
+        f32(f32(a[0] * b[1]) - f32(a[1] * b[0])),
+    )
+
+
+def length(a: Vector) -> Scalar:
+    return f32(math.sqrt(dot(a, a)))
+
+
+def sub(a: Vector, b: Vector) -> Vector:
+    return tuple(f32(x - y) for x, y in zip(a, b))
+
+
+def scale(a: Vector, s: float) -> Vector:
+    return tuple(f32(x * s) for x in a)
+
+
+def normalize(a: Vector) -> Vector:
+    d = dot(a, a)
+    if d > 1e-35:
+        l = f32(math.sqrt(d))
+        return tuple(f32(x / l) for x in a)
+    return (0.0, 0.0, 0.0)
+
+
+def project(a: Vector, b: Vector) -> Vector:
+    d = dot(b, b)
+    if d != 0.0:
+        return scale(b, f32(dot(a, b) / d))
+    return (0.0, 0.0, 0.0)
+
+
+def map_range(v: float, from_min: float, from_max: float, to_min: float, to_max: float) -> Scalar:
+    factor = safe_divide(f32(v - from_min), f32(from_max - from_min))
+    result = f32(to_min + f32(factor * f32(to_max - to_min)))
+    if to_min > to_max:
+        return min(max(result, to_max), to_min)
+    return min(max(result, to_min), to_max)
+
+
+def compare(a: float, b: float, epsilon: float) -> Scalar:
+    return 1.0 if a == b or abs(f32(a - b)) <= max(epsilon, FLT_EPSILON) else 0.0
+
+
+# `(node_type, operation)` -> (input kinds, implementation). Input kinds are
+# 'S' for scalar and 'V' for vector sockets, in the order of the enabled
+# inputs of the node; inputs without an argument are zero.
+ops: Dict[Tuple[str, str | None], Tuple[str, Callable]] = {
+    ('ShaderNodeMath', 'ADD'): ('SS', lambda a, b: f32(a + b)),
+    ('ShaderNodeMath', 'SUBTRACT'): ('SS', lambda a, b: f32(a - b)),
+    ('ShaderNodeMath', 'MULTIPLY'): ('SS', lambda a, b: f32(a * b)),
+    ('ShaderNodeMath', 'DIVIDE'): ('SS', safe_divide),
+    ('ShaderNodeMath', 'MINIMUM'): ('SS', min),
+    ('ShaderNodeMath', 'MAXIMUM'): ('SS', max),
+    ('ShaderNodeMath', 'ABSOLUTE'): ('S', abs),
+    ('ShaderNodeMath', 'SQRT'): ('S', safe_sqrt),
+    ('ShaderNodeMath', 'COMPARE'): ('SSS', compare),
+    ('ShaderNodeMath', 'MULTIPLY_ADD'): ('SSS', lambda a, b, c: f32(f32(a * b) + c)),
+    ('ShaderNodeVectorMath', 'ADD'): ('VV', vmap(lambda a, b: f32(a + b))),
+    ('ShaderNodeVectorMath', 'SUBTRACT'): ('VV', vmap(lambda a, b: f32(a - b))),
+    ('ShaderNodeVectorMath', 'MULTIPLY'): ('VV', vmap(lambda a, b: f32(a * b))),
+    ('ShaderNodeVectorMath', 'DIVIDE'): ('VV', vmap(safe_divide)),
+    ('ShaderNodeVectorMath', 'MINIMUM'): ('VV', vmap(min)),
+    ('ShaderNodeVectorMath', 'MAXIMUM'): ('VV', vmap(max)),
+    ('ShaderNodeVectorMath', 'ABSOLUTE'): ('V', vmap(abs)),
+    ('ShaderNodeVectorMath', 'DOT_PRODUCT'): ('VV', dot),
+    ('ShaderNodeVectorMath', 'CROSS_PRODUCT'): ('VV', cross),
+    ('ShaderNodeVectorMath', 'LENGTH'): ('V', length),
+    ('ShaderNodeVectorMath', 'MULTIPLY_ADD'): ('VVV', vmap(lambda a, b, c: f32(f32(a * b) + c))),
+    ('ShaderNodeVectorMath', 'SCALE'): ('VS', scale),
+    ('ShaderNodeVectorMath', 'DISTANCE'): ('VV', lambda a, b: length(sub(a, b))),
+    ('ShaderNodeVectorMath', 'NORMALIZE'): ('V', normalize),
+    ('ShaderNodeVectorMath', 'PROJECT'): ('VV', project),
+    ('FunctionNodeCompare', 'NOT_EQUAL'): ('SSS', lambda a, b, epsilon: 1.0 if abs(f32(a - b)) > epsilon else 0.0),
+    ('ShaderNodeCombineXYZ', None): ('SSS', lambda x, y, z: (x, y, z)),
+    ('ShaderNodeClamp', None): ('SSS', lambda v, lo, hi: min(max(v, lo), hi)),
+    ('ShaderNodeMapRange', None): ('SSSSS', map_range),
+}
+
+
+def evaluate(node: Node, args: List) -> Scalar | Vector | None:
+    """
+    Computes the value of `node` given the values of its arguments, returns
+    `None` if the node can't be evaluated at compile time.
+    """
+    match node:
+        case Op(node_type, operation, _):
+            if (node_type, operation) not in ops:
+                return None
+            kinds, fn = ops[(node_type, operation)]
+            values = []
+            for i, kind in enumerate(kinds):
+                match kind, i < len(args):
+                    case 'S', True:
+                        values.append(to_float(args[i]))
+                    case 'V', True:
+                        values.append(to_vector(args[i]))
+                    case 'S', False:
+                        values.append(0.0)
+                    case 'V', False:
+                        values.append((0.0, 0.0, 0.0))
+            return fn(*values)
+        case Broadcast():
+            size = node.ty.get_size()
+            v = to_float(args[0])
+            return tuple(v if i < size else 0.0 for i in range(3))
+        case Extract(_, index):
+            return to_vector(args[0])[index]
+        case _:
+            return None
+
+
+def fold_constants(graph: Graph):
+    """Replaces nodes whose arguments are all constant with their value."""
+    def fold(node: Node) -> Node:
+        match node:
+            case Op() | Broadcast() | Extract():
+                if not all(isinstance(arg, Const) for arg in node.args):
+                    return node
+                value = evaluate(node, [arg.value for arg in node.args])
+                if value == None:
+                    return node
+                return graph.add(Const(node.ty, value))
+            case _:
+                return node
+
+    graph.rewrite(fold)
@@ -0,0 +1,93 @@
+from __future__ import annotations
+import bpy
+from typing import Dict, List
+from .nodegen import add_instance, instanced, literal, n_ins, n_out
+from .serialize import load, ty_of
+from .wrappers import NodeTree
+
+
+def socket(ref: Dict, nodes: Dict[str, bpy.types.Node], nt: NodeTree) -> bpy.types.NodeSocket:
+    if 'input' in ref:
+        return nt._ins.get(ref['input'])
+    node = nodes[ref['node']]
+    if 'output' in ref:
+        return node.outputs[ref['output']]
+    return n_out(node)
+
+
+def link(ref: Dict, to: bpy.types.NodeSocket, nodes: Dict[str, bpy.types.Node], nt: NodeTree, ty: str | None):
+    if 'value' in ref:
+        nt.link(literal(ref['value']), to, ty_of(ty) if ty else None)
+    else:
+        nt.link(socket(ref, nodes, nt), to, ty_of(ty) if ty else None)
+
+
+def import_group(group: Dict, tree_type: str) -> NodeTree:
+    """Generates or patches the node group described by `group`."""
+    nt = NodeTree(group['name'], tree_type, {node['id'] for node in group['nodes']})
+    for inp in group['inputs']:
+        nt.add_input(inp['name'], ty_of(inp['ty']).kind, inp['default'])
+    for out in group['outputs']:
+        nt.add_output(out['name'], ty_of(out['ty']).kind)
+    nodes: Dict[str, bpy.types.Node] = {}
+    for desc in group['nodes']:
+        node = nt.add_node(desc['type'], desc['id'])
+        nodes[desc['id']] = node
+        if desc['operation'] and node.operation != desc['operation']:
+            node.operation = desc['operation']
+        if 'group' in desc:
+            tree = bpy.data.node_groups.get(desc['group'])
+            if node.node_tree != tree:
+                node.node_tree = tree
+        for ref, sock in zip(desc['inputs'], n_ins(node)):
+            link(ref, sock, nodes, nt, desc['ty'])
+    for out in group['outputs']:
+        if out['value']:
+            link(out['value'], nt._outs.get(out['name']), nodes, nt, out['ty'])
+        else:
+            nt.unlink(nt._outs.get(out['name']))
+    nt.prune()
+    return nt
+
+
+def import_graphs(path: str, host: bpy.types.NodeTree) -> List[bpy.types.Nodes]:
+    """
+    Instantiates a node graph file written by `python -m compiler` and adds
+    its root groups to `host`. Returns the nodes of the imported groups.
+
+    >>> import os, shutil, tempfile
+    >>> from compiler.cache import compile_cached
+    >>> from compiler.serialize import dump, graphs_to_dict
+    >>> from nodeeval import evaluate
+    >>> src = "float sq(float x) { return x * x; }\\nfloat f(float x) { return sq(x) + 1.0; }"
+    >>> result = compile_cached(src, 'GeometryNodeTree', inline='NEVER')
+    >>> data = graphs_to_dict(result.graphs, ['f'], 'GeometryNodeTree')
+    >>> root = tempfile.mkdtemp()
+    >>> for ext in ('.json', '.json.gz'):
+    ...     bpy.reset()
+    ...     host = bpy.data.node_groups.new('host', 'GeometryNodeTree')
+    ...     path = os.path.join(root, 'f' + ext)
+    ...     dump(data, path)
+    ...     with open(path, 'rb') as f:
+    ...         gzipped = f.read(2) == b'\\x1f\\x8b'
+    ...     # importing again patches the groups instead of adding more
+    ...     for _ in range(2):
+    ...         _ = import_graphs(path, host)
+    ...     print(ext, gzipped, load(path) == data, [tree.name for tree in bpy.data.node_groups],
+    ...           len(host.nodes), float(evaluate(bpy.data.node_groups['f'], {'x': 3.0})['ret']))
+    .json False True ['host', 'sq', 'f'] 1 10.0
+    .json.gz True True ['host', 'sq', 'f'] 1 10.0
+    >>> shutil.rmtree(root)
+    >>>
+    """
+    data = load(path)
+    if data['tree_type'] != host.bl_idname:
+        assert False, f"{path} was compiled for `{data['tree_type']}`"
+    trees = []
+    instances = instanced(host)
+    for group in data['groups']:
+        tree = import_group(group, data['tree_type'])._nt
+        trees.append(tree.nodes)
+        if group['name'] in data['roots'] and tree not in instances:
+            add_instance(host, tree)
+    return trees
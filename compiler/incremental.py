@@ -0,0 +1,177 @@
+from __future__ import annotations
+import hashlib
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Set, Tuple
+from .Ast import *
+from .Parser import Parser
+from .tokenizer import TokenKind, TokenStream, scan_lines
+from .typechk import TyChecker
+
+# braces and the comments that could hide them
+brace_re = re.compile(r"//[^\n]*|[{}]")
+
+
+def split_lines(lines: Iterable[str]) -> Iterator[Tuple[int, int, str]]:
+    """
+    Splits the source into the spans of its top level definitions, each
+    span runs from the end of the previous one to its closing brace. Yields
+    the line and column a span starts at and its text, only the text of
+    the current span is kept.
+
+    >>> src = "float a() { return 1.0; }\\n// }\\nvoid b() {}\\n"
+    >>> [(line, col, text.strip()) for line, col, text in split_lines(src.splitlines())]
+    [(1, 0, 'float a() { return 1.0; }'), (1, 25, '// }\\nvoid b() {}')]
+    >>>
+    """
+    pieces: List[str] = []
+    start = (1, 0)
+    depth = 0
+    for line, src in enumerate(lines, 1):
+        if not src.endswith('\n'):
+            src += '\n'
+        col = 0
+        for m in brace_re.finditer(src):
+            match m.group():
+                case '{':
+                    depth += 1
+                case '}':
+                    depth -= 1
+                    if depth == 0:
+                        pieces.append(src[col:m.end()])
+                        yield *start, ''.join(pieces)
+                        pieces = []
+                        start = (line, m.end())
+                        col = m.end()
+        pieces.append(src[col:])
+    # an unfinished definition still has to be parsed to report its error
+    rest = ''.join(pieces)
+    if rest.strip():
+        yield *start, rest
+
+
+class Entry:
+    __match_args__ = ('defs', 'calls', )
+
+    def __init__(self, defs: List[Def], calls: Set[str]):
+        self.defs = defs
+        # names of everything called by the definitions
+        self.calls = calls
+
+    def names(self) -> List[str]:
+        return [deff.kind.name.name for deff in self.defs]
+
+
+class ModuleCache:
+    """
+    Parses and type checks a module one definition at a time. Definitions
+    whose source didn't change since the last compile reuse their checked
+    AST, only the changed ones and the ones calling them are checked again.
+
+    >>> cache = ModuleCache()
+    >>> src = ("float a() { return 1.0; }\\nfloat b() { return a(); }\\n"
+    ...        "float c() { return 3.0; }\\nfloat d() { return b(); }\\n")
+    >>> before = cache.compile(src).defs
+    >>> after = cache.compile(src.replace('1.0', '2.0')).defs
+    >>> [old is new for old, new in zip(before, after)]
+    [False, False, True, False]
+    >>> cache.stats
+    {'reused': 1, 'checked': 3}
+    >>> cache.compile(src.replace("float a() { return 1.0; }", ""))
+    Traceback (most recent call last):
+    ...
+    AssertionError: `a` is not defined
+    >>>
+    """
+
+    def __init__(self) -> None:
+        self.entries: Dict[bytes, Entry] = {}
+        self.stats: Dict[str, int] = {}
+
+    def parse(self, line: int, col: int, src: str) -> Entry:
+        calls: Set[str] = set()
+
+        def tokens():
+            # pad the first line so that error locations are those in the whole source
+            prev = None
+            for token in scan_lines((' ' * col + src).splitlines(), line):
+                if token[0] == TokenKind.LParen and prev and prev[0] == TokenKind.Ident:
+                    calls.add(prev[1])
+                prev = token
+                yield token
+
+        module = Parser(TokenStream(tokens())).parse()
+        return Entry(module.defs, calls)
+
+    def compile(self, src: str) -> Module:
+        return self.compile_lines(src.splitlines)
+
+    def compile_lines(self, lines: Callable[[], Iterable[str]]) -> Module:
+        """
+        Compiles the source `lines()` yields. It's read once, and a second
+        time if definitions calling changed ones have to be parsed again,
+        both reads must yield the same lines.
+
+        >>> cache = ModuleCache()
+        >>> src = "float a() { return 1.0; }\\nfloat b() { return a(); }\\n"
+        >>> _ = cache.compile(src)
+        >>> _ = cache.compile(src.replace('1.0', '2.0'))
+        >>> cache.stats
+        {'reused': 0, 'checked': 2}
+        >>> _ = cache.compile(src.replace('1.0', '2.0') + "float c() { return 3.0; }")
+        >>> cache.stats
+        {'reused': 2, 'checked': 1}
+        >>> cache.compile("float b() { return 2.0; }\\nfloat a() { return 1.0; }\\nfloat a() { return 1.0; }")
+        Traceback (most recent call last):
+        ...
+        AssertionError: `a` is already defined
+        >>>
+        """
+        keys: List[bytes] = []
+        parsed: List[Entry] = []
+        # indices of the spans parsed by this compile
+        fresh: Set[int] = set()
+        entries: Dict[bytes, Entry] = {}
+        changed: Set[str] = set()
+        for line, col, src in split_lines(lines()):
+            key = hashlib.blake2b(src.encode(), digest_size=16).digest()
+            if key in entries:
+                # a copy of an earlier definition, parse it again so that
+                # checking reports it redefined like a full parse does
+                entry = self.parse(line, col, src)
+            elif key in self.entries:
+                entry = entries[key] = self.entries[key]
+            else:
+                entry = entries[key] = self.parse(line, col, src)
+            if entry is not self.entries.get(key):
+                fresh.add(len(parsed))
+                changed.update(entry.names())
+            keys.append(key)
+            parsed.append(entry)
+        # removed definitions invalidate their callers too
+        names = {name for entry in parsed for name in entry.names()}
+        changed.update(name for entry in self.entries.values() for name in entry.names() if name not in names)
+
+        dirty = set(changed)
+        stale: Set[int] = set()
+        while True:
+            dependents = [
+                i for i, entry in enumerate(parsed)
+                if i not in fresh and i not in stale and entry.calls & dirty
+            ]
+            if not dependents:
+                break
+            for i in dependents:
+                stale.add(i)
+                dirty.update(parsed[i].names())
+        if stale:
+            # the cached AST carries types inferred against the old callees
+            for i, (line, col, src) in enumerate(split_lines(lines())):
+                if i in stale:
+                    parsed[i] = entries[keys[i]] = self.parse(line, col, src)
+
+        module = Module([deff for entry in parsed for deff in entry.defs])
+        TyChecker(module, dirty & names)
+        self.entries = entries
+        self.stats['reused'] = len(names - dirty)
+        self.stats['checked'] = len(dirty & names)
+        return module
@@ -0,0 +1,265 @@
+from __future__ import annotations
+import hashlib
+from typing import Callable, Dict, List, Tuple
+from .Ast import Ty
+
+
+class Node:
+    """
+    A value in the dataflow graph. Every node produces exactly one value of
+    type `ty`; `args` are the values it consumes.
+    """
+
+    def __init__(self, ty: Ty, args: List[Node] | None = None):
+        self.ty = ty
+        self.args: List[Node] = args if args is not None else []
+
+
+class Const(Node):
+    __match_args__ = ('value', )
+
+    def __init__(self, ty: Ty, value: int | float | Tuple[float, ...]):
+        super().__init__(ty)
+        self.value = value
+
+
+class Input(Node):
+    """Group input `name`, `default` is the socket's default value if set."""
+    __match_args__ = ('name', )
+
+    def __init__(self, ty: Ty, name: str, default: int | float | Tuple[float, ...] | None = None):
+        super().__init__(ty)
+        self.name = name
+        self.default = default
+
+
+class Op(Node):
+    """
+    A single Blender node of type `node_type`. `args` are linked to the
+    enabled inputs of the node in order, inputs without an argument keep
+    their default value.
+    """
+    __match_args__ = ('node_type', 'operation', 'args', )
+
+    def __init__(self, node_type: str, operation: str | None, args: List[Node], ty: Ty):
+        super().__init__(ty, args)
+        self.node_type = node_type
+        self.operation = operation
+
+
+class Broadcast(Node):
+    """Scalar to vector conversion, fills the first `ty.get_size()` lanes."""
+    __match_args__ = ('arg', )
+
+    def __init__(self, arg: Node, ty: Ty):
+        super().__init__(ty, [arg])
+
+    @property
+    def arg(self) -> Node:
+        return self.args[0]
+
+
+class Extract(Node):
+    """Reads the `index`th component of a vector."""
+    __match_args__ = ('arg', 'index', )
+
+    def __init__(self, arg: Node, index: int, ty: Ty):
+        super().__init__(ty, [arg])
+        self.index = index
+
+    @property
+    def arg(self) -> Node:
+        return self.args[0]
+
+
+class Group(Node):
+    """
+    Instance of the node group `name`, `args` are linked to its inputs in
+    order. Its outputs are read with `Result`.
+    """
+    __match_args__ = ('name', 'args', )
+
+    def __init__(self, name: str, args: List[Node], ty: Ty):
+        super().__init__(ty, args)
+        self.name = name
+
+
+class Result(Node):
+    """Reads the output `name` of the group instance `arg`."""
+    __match_args__ = ('arg', 'name', )
+
+    def __init__(self, arg: Group, name: str, ty: Ty):
+        super().__init__(ty, [arg])
+        self.name = name
+
+    @property
+    def arg(self) -> Node:
+        return self.args[0]
+
+
+class Output:
+    __match_args__ = ('name', 'ty', 'value', )
+
+    def __init__(self, name: str, ty: Ty, value: Node | None = None):
+        self.name = name
+        self.ty = ty
+        self.value = value
+
+
+class Graph:
+    """
+    Body of a single node group. `nodes` is kept in topological order, a node
+    is always appended after its arguments.
+    """
+
+    def __init__(self, name: str, tree_type: str = 'ShaderNodeTree'):
+        self.name = name
+        # node tree type the graph is compiled for, decides which nodes exist
+        self.tree_type = tree_type
+        self.nodes: List[Node] = []
+        self.inputs: Dict[str, Input] = {}
+        self.outputs: Dict[str, Output] = {}
+        # per pass statistics, e.g. the number of nodes a pass removed
+        self.stats: Dict[str, int] = {}
+
+    def add(self, node: Node) -> Node:
+        self.nodes.append(node)
+        return node
+
+    def add_input(self, name: str, ty: Ty, default: int | float | Tuple[float, ...] | None = None) -> Input:
+        inp = Input(ty, name, default)
+        self.inputs[name] = inp
+        self.nodes.append(inp)
+        return inp
+
+    def add_output(self, name: str, ty: Ty) -> Output:
+        out = Output(name, ty)
+        self.outputs[name] = out
+        return out
+
+    def set_output(self, name: str, value: Node):
+        self.outputs[name].value = value
+
+    def rewrite(self, fn: Callable[[Node], Node]):
+        """
+        Replaces every node with `fn(node)`, in order. `fn` sees the arguments
+        of `node` already rewritten and either returns `node` itself or a node
+        that is already part of the graph, new nodes are created with `add`.
+        """
+        nodes = self.nodes
+        self.nodes = []
+        repl: Dict[Node, Node] = {}
+        for node in nodes:
+            node.args = [repl.get(arg, arg) for arg in node.args]
+            new = fn(node)
+            if new is node:
+                self.nodes.append(node)
+            else:
+                repl[node] = new
+        for out in self.outputs.values():
+            if out.value:
+                out.value = repl.get(out.value, out.value)
+
+    def node_count(self) -> int:
+        """Number of nodes the graph expands to, excluding group input and output."""
+        count = 0
+        separated = set()
+        for node in self.nodes:
+            match node:
+                case Const() | Input() | Result():
+                    pass
+                case Extract(arg):
+                    # components of a vector share one Separate XYZ node
+                    if arg not in separated:
+                        separated.add(arg)
+                        count += 1
+                case _:
+                    count += 1
+        return count
+
+    def node_keys(self) -> Dict[Node, str]:
+        """
+        Stable names for the nodes that become Blender nodes, derived from
+        what a node computes instead of its position so that recompiling an
+        edited source names the unchanged nodes the same. Constant arguments
+        only count by type, changing a literal keeps the names and just
+        updates a default value.
+
+        >>> from compiler.bltin import Tfloat, vec3
+        >>> g = Graph('f')
+        >>> x = g.add_input('x', Tfloat)
+        >>> a = g.add(Op('ShaderNodeMath', 'ADD', [x, g.add(Const(Tfloat, 1.0))], Tfloat))
+        >>> b = g.add(Op('ShaderNodeMath', 'ADD', [x, g.add(Const(Tfloat, 2.0))], Tfloat))
+        >>> c = g.add(Op('ShaderNodeMath', 'ADD', [x, g.add(Const(vec3, (1.0, 2.0, 3.0)))], Tfloat))
+        >>> keys = g.node_keys()
+        >>> keys[b] == keys[a] + '.1', keys[c] == keys[a] + '.2'
+        (True, False)
+        """
+        keys: Dict[Node, str] = {}
+        seen: Dict[str, int] = {}
+        for node in self.nodes:
+            args = tuple(f"const {arg.ty.display_name()}" if isinstance(arg, Const) else keys[arg]
+                         for arg in node.args)
+            match node:
+                case Const():
+                    continue
+                case Input(name):
+                    what = ('input', name)
+                case Op(node_type, operation, _):
+                    what = ('op', node_type, operation)
+                case Broadcast():
+                    what = ('broadcast', )
+                case Extract(_, index):
+                    what = ('extract', index)
+                case Group(name, _):
+                    what = ('group', name)
+                case Result(_, name):
+                    what = ('result', name)
+                case _:
+                    assert False, f"{node}"
+            digest = hashlib.blake2b(repr((what, node.ty.display_name(), args)).encode(), digest_size=8).hexdigest()
+            # nodes that differ only in their constants
+            seen[digest] = seen.get(digest, -1) + 1
+            keys[node] = f"blsl.{digest}" + (f".{seen[digest]}" if seen[digest] else "")
+        return keys
+
+    def dump(self) -> str:
+        names: Dict[Node, str] = {}
+        lines: List[str] = [f"graph {self.name}:"]
+
+        def ref(node: Node) -> str:
+            match node:
+                case Const(value):
+                    return repr(value)
+                case _:
+                    return names[node]
+
+        for node in self.nodes:
+            match node:
+                case Const():
+                    continue
+                case Input(name):
+                    names[node] = f"%{name}"
+                    continue
+            names[node] = f"%{len(names)}"
+            args = ", ".join(ref(arg) for arg in node.args)
+            match node:
+                case Op(node_type, operation, _):
+                    what = f"{node_type}.{operation}" if operation else node_type
+                case Broadcast():
+                    what = "broadcast"
+                case Extract(_, index):
+                    what = f"extract.{'xyz'[index]}"
+                case Group(name, _):
+                    what = f"group {name}"
+                case Result(_, name):
+                    what = f"result.{name}"
+                case _:
+                    assert False, f"{node}"
+            lines.append(
+                f"  {names[node]}: {node.ty.display_name()} = {what}({args})")
+        for out in self.outputs.values():
+            value = ref(out.value) if out.value else "unset"
+            lines.append(f"  out {out.name}: {out.ty.display_name()} = {value}")
+        return "\n".join(lines)
+
@@ -0,0 +1,188 @@
+from __future__ import annotations
+from typing import Dict, List
+from .Ast import Ty
+from .bltin import Tfloat
+from .ir import Node, Const, Input, Op, Broadcast, Graph
+from .simplify import is_zero, is_one
+
+
+def z_lane(node: Node) -> bool | List[Node]:
+    """
+    Whether the third lane of `node` is known to be zero, or the arguments
+    whose third lanes all have to be zero for it to be.
+    """
+    match node:
+        case Const(tuple(data)):
+            return data[2] == 0.0
+        case Broadcast():
+            return node.ty.get_size() < 3
+        case Op('ShaderNodeCombineXYZ', _, args):
+            return len(args) < 3 or is_zero(args[2])
+        case Op('ShaderNodeVectorMath', 'ADD' | 'SUBTRACT' | 'MINIMUM' | 'MAXIMUM' | 'ABSOLUTE' | 'NORMALIZE', args):
+            return list(args)
+        case Op('ShaderNodeVectorMath', 'SCALE', [v, _]):
+            return [v]
+        case _:
+            return False
+
+
+def z_is_zero(node: Node, memo: Dict[Node, bool]) -> bool:
+    """
+    Whether the unused third lane of a `vec2` value is known to be zero.
+    Only then can a `vec2` broadcast, which leaves that lane at zero, be
+    replaced by an operation that scales all three lanes. Uses an explicit
+    stack, chains of vector operations can be arbitrarily long.
+    """
+    stack = [node]
+    while stack:
+        top = stack[-1]
+        if top in memo:
+            stack.pop()
+            continue
+        match z_lane(top):
+            case bool(result):
+                memo[top] = result
+                stack.pop()
+            case args:
+                pending = [arg for arg in args if arg not in memo]
+                if pending:
+                    stack += pending
+                else:
+                    memo[top] = all(memo[arg] for arg in args)
+                    stack.pop()
+    return memo[node]
+
+
+def select(graph: Graph):
+    """
+    Tiles the graph onto Blender's fused and specialized nodes:
+
+    - `a * b + c` becomes Multiply Add, for floats and vectors
+    - `v * s` becomes Scale instead of a broadcast and a multiplication
+    - `length(a - b)` becomes Distance
+    - `v / length(v)` becomes Normalize
+    - `b * (dot(a, b) / dot(b, b))` becomes Project
+    - `clamp((x - a) / (b - a), 0.0, 1.0)` becomes a clamped Map Range
+
+    Intermediate nodes are only fused when they have no other uses, the
+    number of selected nodes is recorded in `graph.stats['isel']`. Below,
+    the multiplication used twice isn't fused, and the `vec2` input may
+    carry anything in its third lane so multiplying it isn't a Scale.
+
+    >>> from compiler.Parser import parser_from_src
+    >>> from compiler.typechk import TyChecker
+    >>> from compiler.lower import lower_module
+    >>> def show(src):
+    ...     module = parser_from_src(src).parse()
+    ...     _ = TyChecker(module)
+    ...     print(lower_module(module, 'GeometryNodeTree', 'ALWAYS', 'NONE')[-1].dump())
+    >>> show("vec3 f(vec3 a, vec3 b, vec3 c) { return a * b + c; }")
+    graph f:
+      %3: vec3 = ShaderNodeVectorMath.MULTIPLY_ADD(%a, %b, %c)
+      out ret: vec3 = %3
+    >>> show("float f(float a, float b, float c) { float m = a * b; return m + c + m; }")
+    graph f:
+      %3: float = ShaderNodeMath.MULTIPLY(%a, %b)
+      %4: float = ShaderNodeMath.ADD(%3, %c)
+      %5: float = ShaderNodeMath.ADD(%4, %3)
+      out ret: float = %5
+    >>> show("vec3 f(vec3 v, float s) { return v * s; }")
+    graph f:
+      %2: vec3 = ShaderNodeVectorMath.SCALE(%v, %s)
+      out ret: vec3 = %2
+    >>> show("vec2 f(vec2 v, float s) { return v * s; }")
+    graph f:
+      %2: vec2 = broadcast(%s)
+      %3: vec2 = ShaderNodeVectorMath.MULTIPLY(%v, %2)
+      out ret: vec2 = %3
+    >>> show("vec2 f(float x, float y, float s) { vec2 v = vec2(x, y); return v * s; }")
+    graph f:
+      %3: vec2 = ShaderNodeCombineXYZ(%x, %y)
+      %4: vec2 = ShaderNodeVectorMath.SCALE(%3, %s)
+      out ret: vec2 = %4
+    >>> show("float f(vec3 a, vec3 b) { return length(a - b); }")
+    graph f:
+      %2: float = ShaderNodeVectorMath.DISTANCE(%a, %b)
+      out ret: float = %2
+    >>> show("vec3 f(vec3 v) { return v / length(v); }")
+    graph f:
+      %1: vec3 = ShaderNodeVectorMath.NORMALIZE(%v)
+      out ret: vec3 = %1
+    >>> show("vec3 f(vec3 a, vec3 b) { float s = dot(a, b) / dot(b, b); return b * s; }")
+    graph f:
+      %2: vec3 = ShaderNodeVectorMath.PROJECT(%a, %b)
+      out ret: vec3 = %2
+    >>> show("float f(float x, float a, float b) { float t = x - a; float d = b - a; return clamp(t / d, 0.0, 1.0); }")
+    graph f:
+      %3: float = ShaderNodeMapRange(%x, %a, %b, 0.0, 1.0)
+      out ret: float = %3
+    >>>
+    """
+    uses: Dict[Node, int] = {}
+    for node in graph.nodes:
+        for arg in node.args:
+            uses[arg] = uses.get(arg, 0) + 1
+    for out in graph.outputs.values():
+        if out.value:
+            uses[out.value] = uses.get(out.value, 0) + 1
+    zero_z: Dict[Node, bool] = {}
+
+    def single(node: Node) -> bool:
+        return uses.get(node, 0) == 1
+
+    def op(node_type: str, operation: str | None, args, ty: Ty) -> Node:
+        return graph.add(Op(node_type, operation, args, ty))
+
+    def broadcastable(v: Node) -> bool:
+        # scaling touches all three lanes, a `vec2` broadcast only two
+        return v.ty.get_size() == 3 or z_is_zero(v, zero_z)
+
+    def project(b: Node, s: Node) -> Node | None:
+        match s:
+            case Op('ShaderNodeMath', 'DIVIDE', [Op('ShaderNodeVectorMath', 'DOT_PRODUCT', [x, y]) as num,
+                                                  Op('ShaderNodeVectorMath', 'DOT_PRODUCT', [bb, bb2]) as den]) \
+                    if bb is b and bb2 is b and single(s) and single(num):
+                if y is b:
+                    return x
+                if x is b:
+                    return y
+        return None
+
+    def rule(node: Node) -> Node:
+        match node:
+            case Op('ShaderNodeMath' | 'ShaderNodeVectorMath' as nt, 'ADD', [a, b]):
+                for mul, c in ((a, b), (b, a)):
+                    match mul:
+                        case Op(mt, 'MULTIPLY', [x, y]) if mt == nt and single(mul):
+                            return op(nt, 'MULTIPLY_ADD', [x, y, c], node.ty)
+            case Op('ShaderNodeVectorMath', 'MULTIPLY', [a, b]):
+                for v, s in ((a, b), (b, a)):
+                    match s:
+                        case Broadcast(arg) if broadcastable(v):
+                            if (x := project(v, arg)) and single(s):
+                                return op('ShaderNodeVectorMath', 'PROJECT', [x, v], node.ty)
+                            return op('ShaderNodeVectorMath', 'SCALE', [v, arg], node.ty)
+            case Op('ShaderNodeVectorMath', 'LENGTH', [Op('ShaderNodeVectorMath', 'SUBTRACT', [a, b]) as sub]) \
+                    if single(sub):
+                return op('ShaderNodeVectorMath', 'DISTANCE', [a, b], node.ty)
+            case Op('ShaderNodeVectorMath', 'DIVIDE', [v, Broadcast(Op('ShaderNodeVectorMath', 'LENGTH', [w]) as length) as s]) \
+                    if w is v and single(s) and single(length) and broadcastable(v):
+                return op('ShaderNodeVectorMath', 'NORMALIZE', [v], node.ty)
+            case Op('ShaderNodeClamp', None, [Op('ShaderNodeMath', 'DIVIDE', [num, den]) as div, lo, hi]) \
+                    if single(div) and is_zero(lo) and is_one(hi):
+                match num, den:
+                    case Op('ShaderNodeMath', 'SUBTRACT', [x, a]), Op('ShaderNodeMath', 'SUBTRACT', [b, a2]) if a is a2:
+                        pass
+                    case _:
+                        x, a, b = num, graph.add(Const(Tfloat, 0.0)), den
+                return op('ShaderNodeMapRange', None, [x, a, b, lo, hi], node.ty)
+        return node
+
+    def count(node: Node) -> Node:
+        new = rule(node)
+        if new is not node:
+            uses[new] = uses.get(new, 0) + uses.get(node, 0)
+            graph.stats['isel'] = graph.stats.get('isel', 0) + 1
+        return new
+
+    graph.rewrite(count)
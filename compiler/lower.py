@@ -0,0 +1,353 @@
+from __future__ import annotations
+from typing import Dict, List
+from .Ast import *
+from .bltin import builtins as bltins, Tfloat, Tint
+from .callgraph import CallGraph, Inliner
+from .ir import Node, Const, Input, Op, Broadcast, Extract, Group, Result, Graph
+from .opt import optimize
+from .visitor import Visitor, handles
+
+
+def coerce(value: Node, ty: Ty, g: Graph) -> Node:
+    """Converts a scalar `value` into the vector type `ty`, if needed."""
+    if not ty.is_vector() or value.ty.is_vector():
+        return value
+    match value:
+        case Const(data):
+            size = ty.get_size()
+            return g.add(Const(ty, tuple(float(data) if i < size else 0.0 for i in range(3))))
+        case _:
+            return g.add(Broadcast(value, ty))
+
+
+def vec_math(op: str, args: List[Node], ty: Ty, g: Graph) -> Node:
+    vty = args[0].ty if not ty.is_vector() else ty
+    args = [coerce(arg, vty, g) for arg in args]
+    return g.add(Op('ShaderNodeVectorMath', op, args, ty))
+
+
+def math(op: str, args: List[Node], ty: Ty, g: Graph) -> Node:
+    return g.add(Op('ShaderNodeMath', op, args, ty))
+
+
+def lower_vec(sig: int, args: List[Node], g: Graph, name: str) -> Node:
+    ty = bltins[name][sig].ret_ty
+    match len(args):
+        case 1:
+            return g.add(Broadcast(args[0], ty))
+        case _:
+            return g.add(Op('ShaderNodeCombineXYZ', None, args[:3], ty))
+
+
+def lower_length(sig: int, args: List[Node], g: Graph, name: str) -> Node:
+    return vec_math('LENGTH', args, Tfloat, g)
+
+
+def lower_math(sig: int, args: List[Node], g: Graph, name: str) -> Node:
+    op = None
+    match name:
+        case 'min':
+            op = 'MINIMUM'
+        case 'max':
+            op = 'MAXIMUM'
+        case _:
+            assert False
+    ty = bltins[name][sig].ret_ty
+    match sig:
+        case 0:
+            return math(op, args, ty, g)
+        case 1 | 2 | 3 | 4:
+            return vec_math(op, args, ty, g)
+        case _:
+            assert False
+
+
+def lower_abs(sig: int, args: List[Node], g: Graph, name: str) -> Node:
+    ty = bltins[name][sig].ret_ty
+    match sig:
+        case 0:
+            return math('ABSOLUTE', args, ty, g)
+        case 1 | 2:
+            return vec_math('ABSOLUTE', args, ty, g)
+        case _:
+            assert False
+
+
+def lower_dot(sig: int, args: List[Node], g: Graph, name: str) -> Node:
+    return vec_math('DOT_PRODUCT', args, bltins[name][sig].ret_ty, g)
+
+
+def lower_cross(sig: int, args: List[Node], g: Graph, name: str) -> Node:
+    return vec_math('CROSS_PRODUCT', args, bltins[name][sig].ret_ty, g)
+
+
+def lower_clamp(sig: int, args: List[Node], g: Graph, name: str) -> Node:
+    return g.add(Op('ShaderNodeClamp', None, args, bltins[name][sig].ret_ty))
+
+
+def lower_sqrt(sig: int, args: List[Node], g: Graph, name: str) -> Node:
+    return math('SQRT', args, bltins[name][sig].ret_ty, g)
+
+
+builtins = {
+    'vec4': lower_vec,
+    'vec3': lower_vec,
+    'vec2': lower_vec,
+    'length': lower_length,
+    'min': lower_math,
+    'max': lower_math,
+    'abs': lower_abs,
+    'dot': lower_dot,
+    'cross': lower_cross,
+    'clamp': lower_clamp,
+    'sqrt': lower_sqrt,
+}
+
+field_to_socket_index = {'x': 0, 'y': 1, 'z': 2}
+
+
+def is_output(param: FnArg) -> bool:
+    return any(qual.is_output() for qual in param.ty_qualifiers)
+
+
+def literal_value(expr: Expr) -> int | float | None:
+    """The value of a literal, possibly negated, or `None`."""
+    match expr:
+        case Int(value):
+            return int(value)
+        case Float(value):
+            return float(value)
+        case Unary(UnaryKind.Negative, Int(value) | Float(value) as literal):
+            return -literal_value(literal)  # type: ignore
+    return None
+
+
+class Lowering(Visitor):
+    """
+    Lowers a type checked `Fn` into a `Graph`. Doesn't depend on `bpy`, so
+    programs can be lowered and measured outside of Blender.
+    """
+
+    def __init__(self, fn: Fn, tree_type: str = 'ShaderNodeTree',
+                 inliner: Inliner | None = None, graph: Graph | None = None,
+                 hoist: str = 'NONE'):
+        self.fn = fn
+        # decides how calls of other functions of the module are lowered
+        self.inliner = inliner
+        # which literals become group inputs: 'NONE', 'CONST' for the ones
+        # initializing `const` locals or 'ALL'
+        self.hoist = hoist
+        # inlining into `graph`, which already has its inputs and outputs
+        self.inlined = graph != None
+        # current value of every variable by slot, see `resolve_locals`
+        self.values: List[Node | None] = [None] * len(fn.locals)
+        # group outputs of the out parameters by slot
+        self.outputs: Dict[int, str] = {}
+        # value of the last `return`
+        self.ret: Node | None = None
+        self.g = graph or Graph(fn.name.name, tree_type)
+
+    def add_param(self, arg: FnArg):
+        match arg:
+            case FnArg(Ident(name) as ident, ty, ty_qualifiers):
+                sock = self.g.add_input(name, ty)
+                for qual in ty_qualifiers:
+                    if qual.is_output():
+                        self.g.add_output(name, ty)
+                        self.g.set_output(name, sock)
+                        self.outputs[ident.slot] = name  # type: ignore
+                    break
+                self.values[ident.slot] = sock  # type: ignore
+
+    def hoist_literal(self, name: str, ty: Ty, value: int | float) -> Node:
+        """
+        Adds a group input defaulting to `value` in place of a constant, so
+        tuning it on the group node doesn't change the tree's topology. Such
+        inputs aren't folded.
+        """
+        # inlined functions share the graph, prefix their inputs
+        if self.inlined:
+            name = f"{self.fn.name.name}.{name}"
+        unique, n = name, 1
+        while unique in self.g.inputs:
+            n += 1
+            unique = f"{name}.{n}"
+        return self.g.add_input(unique, ty, int(value) if ty == Tint else float(value))
+
+    def assign(self, ident: Ident, value: Node):
+        self.values[ident.slot] = value  # type: ignore
+        if ident.slot in self.outputs:
+            self.g.set_output(self.outputs[ident.slot], value)  # type: ignore
+
+    # `lower_expr(expr)` adds the nodes computing `expr` and returns the last one
+
+    @handles('lower_expr', Assign)
+    def lower_assign(self, expr: Assign) -> Node:
+        match expr.left:
+            case Ident() as ident:
+                value = self.lower_expr(expr.init)
+                self.assign(ident, value)
+                return value
+        assert False, f"{expr.left}"
+
+    @handles('lower_expr', Int)
+    def lower_int(self, expr: Int) -> Node:
+        if self.hoist == 'ALL':
+            return self.hoist_literal('value', Tint, int(expr.value))
+        return self.g.add(Const(Tint, int(expr.value)))
+
+    @handles('lower_expr', Float)
+    def lower_float(self, expr: Float) -> Node:
+        if self.hoist == 'ALL':
+            return self.hoist_literal('value', Tfloat, float(expr.value))
+        return self.g.add(Const(Tfloat, float(expr.value)))
+
+    @handles('lower_expr', Ident)
+    def lower_ident(self, expr: Ident) -> Node:
+        return self.values[expr.slot]  # type: ignore
+
+    @handles('lower_expr', Binary)
+    def lower_binary_chain(self, expr: Binary) -> Node:
+        # lower the left spine of operator chains in a loop, they nest as
+        # deep as they are long
+        spine: List[Binary] = []
+        left: Expr = expr
+        while isinstance(left, Binary):
+            spine.append(left)
+            left = left.left
+        node = self.lower_expr(left)
+        for binary in reversed(spine):
+            node = self.lower_binary(binary, node, self.lower_expr(binary.right))
+        return node
+
+    @handles('lower_expr', Call)
+    def lower_call(self, expr: Call) -> Node | None:
+        lowered = [self.lower_expr(arg) for arg in expr.args]
+        if expr.name in builtins:
+            assert expr.sig != None
+            return builtins[expr.name](expr.sig, lowered, self.g, expr.name)
+
+        assert self.inliner, f"`{expr.name}` is not a builtin"
+        callee = self.inliner.graph.fns[expr.name]
+        outs: Dict[str, Node] = {}
+        if self.inliner.inline(expr.name):
+            inlined = Lowering(callee, self.g.tree_type, self.inliner, self.g, self.hoist)
+            for param, value in zip(callee.sig.args, lowered):
+                inlined.values[param.name.slot] = value  # type: ignore
+            inlined.lower_block(callee.body)
+            for param in callee.sig.args:
+                if is_output(param):
+                    outs[param.name.name] = inlined.values[param.name.slot]  # type: ignore
+            ret = inlined.ret
+        else:
+            group = self.g.add(Group(expr.name, lowered, Ty(TypeKind.Void)))
+            for param in callee.sig.args:
+                if is_output(param):
+                    outs[param.name.name] = self.g.add(Result(group, param.name.name, param.ty))
+            ret = None
+            if callee.sig.ret_ty.kind != TypeKind.Void:
+                ret = self.g.add(Result(group, 'ret', callee.sig.ret_ty))
+        # out arguments are variables, checked by `TyChecker`
+        for param, arg in zip(callee.sig.args, expr.args):
+            if is_output(param):
+                self.assign(arg, outs[param.name.name])  # type: ignore
+        return ret
+
+    @handles('lower_expr', Field)
+    def lower_field(self, expr: Field) -> Node:
+        var = self.values[expr.name.slot]  # type: ignore
+        assert var.ty.is_vector()
+        return self.g.add(Extract(var, field_to_socket_index[expr.field.name], Tfloat))
+
+    @handles('lower_expr', Unary)
+    def lower_unary(self, expr: Unary) -> Node:
+        g = self.g
+        if self.hoist == 'ALL' and (literal := literal_value(expr)) != None:
+            return self.hoist_literal('value', Tint if isinstance(literal, int) else Tfloat, literal)
+        value = self.lower_expr(expr.expr)
+        if value.ty.is_vector():
+            return vec_math('SUBTRACT', [g.add(Const(Tint, 0)), value], value.ty, g)
+        return math('SUBTRACT', [g.add(Const(Tint, 0)), value], value.ty, g)
+
+    @handles('lower_expr', object)
+    def lower_other(self, expr: Expr) -> Node:
+        assert False, f"{expr}"
+
+    def lower_binary(self, binary: Binary, l: Node, r: Node) -> Node:
+        g = self.g
+        ty = binary.ty
+        assert ty != None
+        if ty.is_vector():
+            node = vec_math(binary.op.blender_op(), [l, r], ty, g)
+        else:
+            node = math(binary.op.blender_op(), [l, r], ty, g)
+        match binary.op:
+            case BinaryKind.NotEq:
+                node = math('SUBTRACT', [g.add(Const(Tint, 1)), node], ty, g)
+        return node
+
+    # `lower_stmt(stmt)` lowers the statement `stmt.kind`
+
+    @handles('lower_stmt', ExprStmt)
+    def lower_expr_stmt(self, stmt: ExprStmt):
+        for expr in stmt.exprs:
+            self.lower_expr(expr)
+
+    @handles('lower_stmt', Decl)
+    def lower_decl(self, stmt: Decl):
+        for expr in stmt.decls.exprs:
+            match expr:
+                case Assign(Ident() as ident, init):
+                    if self.hoist != 'NONE' and stmt.is_const() and (literal := literal_value(init)) != None:
+                        self.assign(ident, self.hoist_literal(ident.name, stmt.ty, literal))
+                    elif init:
+                        self.assign(ident, self.lower_expr(init))
+                case _:
+                    assert False
+
+    @handles('lower_stmt', Return)
+    def lower_return(self, stmt: Return):
+        self.ret = self.lower_expr(stmt.expr)
+        if not self.inlined:
+            self.g.set_output('ret', self.ret)
+
+    @handles('lower_stmt', object)
+    def lower_other_stmt(self, stmt):
+        assert False, f"{stmt}"
+
+    def lower_block(self, block: Block):
+        for stmt in block.stmts:
+            self.lower_stmt(stmt.kind)
+
+    def lower(self) -> Graph:
+        match self.fn:
+            case Fn(_, FnSig(args, ret_ty), body):
+                for arg in args:
+                    self.add_param(arg)
+                if ret_ty.kind != TypeKind.Void:
+                    self.g.add_output('ret', ret_ty)
+                self.lower_block(body)
+        return self.g
+
+
+def lower_module(module: Module, tree_type: str = 'ShaderNodeTree', inline: str = 'AUTO',
+                 hoist: str = 'NONE') -> List[Graph]:
+    """
+    Lowers the functions of a type checked module, callees first. Only the
+    graphs instanced as node groups are returned, that is those of the
+    functions no other function calls and of the callees not inlined
+    everywhere. See `Inliner` for `inline` and `Lowering` for `hoist`.
+    """
+    calls = CallGraph(module)
+    inliner = Inliner(calls, inline)
+    graphs: Dict[str, Graph] = {}
+    for fn in calls.order():
+        graph = optimize(Lowering(fn, tree_type, inliner, hoist=hoist).lower())
+        inliner.sizes[fn.name.name] = graph.node_count()
+        graphs[fn.name.name] = graph
+
+    used = {fn.name.name for fn in calls.roots()}
+    for name in reversed(graphs):
+        if name in used:
+            used.update(node.name for node in graphs[name].nodes if isinstance(node, Group))
+    return [graph for name, graph in graphs.items() if name in used]
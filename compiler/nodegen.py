@@ -1,221 +1,79 @@
 from __future__ import annotations
 import bpy
 from .Ast import *
-from .wrappers import NodeTree, Value, ValueKind
-from typing import Dict, List
-from .bltin import builtins as bltins
+from .ir import Node, Const, Input, Op, Broadcast, Extract, Group, Result, Graph
+from .cache import Compiled
+from .callgraph import CallGraph
+from .lower import lower_module
+from .visitor import Visitor, handles
+from .wrappers import NodeTree, Value, ValueKind, source_prop
+from typing import Dict, List, Set
 
 
-def vec4_to_vec4(value: List[Value | bpy.types.NodeSocket], nt: NodeTree) -> bpy.types.Node:
-    node = nt.add_node('ShaderNodeCombineXYZ')
-    for i in range(3):
-        val = value[i]
-        nt.link(val, node.inputs[i])
-    return node
-
-
-def float_to_vec4(value: Value | bpy.types.NodeSocket, nt: NodeTree) -> bpy.types.Node:
-    node = nt.add_node('ShaderNodeCombineXYZ')
-    for i in range(3):
-        nt.link(value, node.inputs[i])
-    return node
-
-
-def gen_vec4(sig: int, args: List[Value | bpy.types.NodeSocket], nt: NodeTree, _) -> bpy.types.Node:
-    match sig:
-        case 0:
-            return float_to_vec4(args[0], nt)
-        case 1:
-            return vec4_to_vec4(args, nt)
-        case _:
-            assert False
+def n_out(node: bpy.types.Node) -> bpy.types.NodeSocket:
+    visible_outputs = [output for output in node.outputs if output.enabled]
+    return visible_outputs[0]
 
 
-def gen_vec3(sig: int, args: List[Value | bpy.types.NodeSocket], nt: NodeTree, _) -> bpy.types.Node:
-    match sig:
-        case 0:
-            return float_to_vec4(args[0], nt)
-        case 1:
-            return vec4_to_vec4(args, nt)
-        case _:
-            assert False
+def n_ins(node: bpy.types.Node) -> List[bpy.types.NodeSocket]:
+    return [input for input in node.inputs if input.enabled]
 
 
-def float_to_vec2(value: Value | bpy.types.NodeSocket, nt: NodeTree) -> bpy.types.Node:
-    node = nt.add_node('ShaderNodeCombineXYZ')
-    for i in range(2):
-        nt.link(value, node.inputs[i])
-    return node
+def n_in(node: bpy.types.Node) -> bpy.types.NodeSocket:
+    return n_ins(node)[0]
 
 
-def vec2_to_vec2(value: List[Value | bpy.types.NodeSocket], nt: NodeTree) -> bpy.types.Node:
-    node = nt.add_node('ShaderNodeCombineXYZ')
-    for i in range(2):
-        val = value[i]
-        nt.link(val, node.inputs[i])
-    return node
+def const_value(const: Const) -> Value:
+    return literal(const.value)
 
 
-def gen_vec2(sig: int, args: List[Value | bpy.types.NodeSocket], nt: NodeTree, _) -> bpy.types.Node:
-    match sig:
-        case 0 | 2:
-            return float_to_vec2(args[0], nt)
-        case 1 | 3:
-            return vec2_to_vec2(args, nt)
-        case _:
-            assert False
+def literal(value) -> Value:
+    match value:
+        case tuple(data) | list(data):
+            return Value(ValueKind.Vector3, list(data))
+        case int(data):
+            return Value(ValueKind.Int, data)
+        case data:
+            return Value(ValueKind.Float, data)
 
 
-def gen_length(sig: int, args: List[Value | bpy.types.NodeSocket], nt: NodeTree, _) -> bpy.types.Node:
-    node = nt.add_node('ShaderNodeVectorMath')
-    assert isinstance(node, bpy.types.ShaderNodeVectorMath)
-    node.operation = 'LENGTH'
-    nt.link(args[0], node.inputs[0])
-    return node
+def instanced(host: bpy.types.NodeTree) -> Set[bpy.types.NodeTree]:
+    """The node groups `host` has group nodes of."""
+    return {node.node_tree for node in host.nodes if getattr(node, 'node_tree', None)}
 
 
-def gen_math(sig: int, args: List[Value | bpy.types.NodeSocket], nt: NodeTree, name: str) -> bpy.types.Node:
-    ntype = None
-    op = None
-    match name:
-        case 'min':
-            op = 'MINIMUM'
-        case 'max':
-            op = 'MAXIMUM'
+def add_instance(host: bpy.types.NodeTree, tree: bpy.types.NodeTree):
+    """Adds a node instancing `tree` to `host`."""
+    match host.bl_idname:
+        case 'ShaderNodeTree':
+            node = host.nodes.new('ShaderNodeGroup')
+        case 'GeometryNodeTree':
+            node = host.nodes.new('GeometryNodeGroup')
         case _:
-            assert False
-    match sig:
-        case 0:
-            node = nt.add_node("ShaderNodeMath")
-            ntype = bpy.types.ShaderNodeMath
-        case 1 | 2 | 3 | 4:
-            node = nt.add_node("ShaderNodeVectorMath")
-            ntype = bpy.types.ShaderNodeVectorMath
-        case _:
-            assert False
-    assert isinstance(node, ntype)
-    node.operation = op
-    ty = bltins[name][sig].ret_ty
-    for i in range(2):
-        nt.link(args[i], node.inputs[i], ty)
-    return node
-
+            assert False, f"{host.bl_idname}"
 
-def gen_abs(sig: int, args: List[Value | bpy.types.NodeSocket], nt: NodeTree, name: str) -> bpy.types.Node:
-    ntype = None
-    match sig:
-        case 0:
-            node = nt.add_node("ShaderNodeMath")
-            ntype = bpy.types.ShaderNodeMath
-        case 1 | 2:
-            node = nt.add_node("ShaderNodeVectorMath")
-            ntype = bpy.types.ShaderNodeVectorMath
+    match node:
+        case bpy.types.ShaderNodeGroup() | bpy.types.GeometryNodeGroup():
+            node.node_tree = tree
         case _:
-            assert False
-    assert isinstance(node, ntype)
-    node.operation = 'ABSOLUTE'
-    ty = bltins[name][sig].ret_ty
-    nt.link(args[0], node.inputs[0], ty)
-    return node
-
-
-def gen_dot(sig: int, args: List[Value | bpy.types.NodeSocket], nt: NodeTree, name: str) -> bpy.types.Node:
-    node = nt.add_node("ShaderNodeVectorMath")
-    assert isinstance(node, bpy.types.ShaderNodeVectorMath)
-    node.operation = 'DOT_PRODUCT'
-    ty = bltins[name][sig].ret_ty
-    for i in range(2):
-        nt.link(args[i], node.inputs[i], ty)
-    return node
-
-
-def gen_cross(sig: int, args: List[Value | bpy.types.NodeSocket], nt: NodeTree, name: str) -> bpy.types.Node:
-    node = nt.add_node("ShaderNodeVectorMath")
-    assert isinstance(node, bpy.types.ShaderNodeVectorMath)
-    node.operation = 'CROSS_PRODUCT'
-    ty = bltins[name][sig].ret_ty
-    for i in range(2):
-        nt.link(args[i], node.inputs[i], ty)
-    return node
-
-
-def gen_clamp(sig: int, args: List[Value | bpy.types.NodeSocket], nt: NodeTree, name: str) -> bpy.types.Node:
-    node = nt.add_node("ShaderNodeClamp")
-    assert isinstance(node, bpy.types.ShaderNodeClamp)
-    ty = bltins[name][sig].ret_ty
-    for i in range(3):
-        nt.link(args[i], node.inputs[i], ty)
-    return node
-
-
-def gen_sqrt(sig: int, args: List[Value | bpy.types.NodeSocket], nt: NodeTree, name: str) -> bpy.types.Node:
-    node = nt.add_node("ShaderNodeMath")
-    assert isinstance(node, bpy.types.ShaderNodeMath)
-    node.operation = 'SQRT'
-    ty = bltins[name][sig].ret_ty
-    nt.link(args[0], node.inputs[0], ty)
-    return node
-
+            assert False, "not implemented"
 
-builtins = {
-    'vec4': gen_vec4,
-    'vec3': gen_vec3,
-    'vec2': gen_vec2,
-    'length': gen_length,
-    'min': gen_math,
-    'max': gen_math,
-    'abs': gen_abs,
-    'dot': gen_dot,
-    'cross': gen_cross,
-    'clamp': gen_clamp,
-    'sqrt': gen_sqrt,
-}
 
-field_to_socket_index = {'x': 0, 'y': 1, 'z': 2}
+class NodeGen(Visitor):
+    """Backend, instantiates lowered `Graph`s as Blender node groups."""
 
-
-def n_out(node: bpy.types.Node) -> bpy.types.NodeSocket:
-    visible_outputs = [output for output in node.outputs if output.enabled]
-    return visible_outputs[0]
-
-
-def n_in(node: bpy.types.Node) -> bpy.types.NodeSocket:
-    visible_inputs = [input for input in node.inputs if input.enabled]
-    return visible_inputs[0]
-
-
-class Env:
-    def __init__(self, paren_env: Env | None = None):
-        self.parent: Env | None = paren_env
-        self.bindings: Dict[str, Value | bpy.types.NodeSocket] = {}
-        self.ctx: FnSig | None = None
-        self.outputs: Dict[str, Value | bpy.types.NodeSocket] = {}
-
-    def bind(self, name: str, sock: Value | bpy.types.NodeSocket):
-        if name in self.bindings:
-            assert False, f"`{name}` is already defined"
-        self.bindings[name] = sock
-
-    def bind_output(self, name: str, sock: Value | bpy.types.NodeSocket):
-        self.outputs[name] = sock
-
-    def set(self, name: str, sock: Value | bpy.types.NodeSocket):
-        self.bindings[name] = sock
-
-    def get(self, name: str) -> Value | bpy.types.NodeSocket:
-        if name in self.bindings:
-            return self.bindings[name]
-        elif self.parent:
-            return self.parent.get(name)
-        else:
-            assert False
-
-
-class NodeGen:
     def __init__(self, module: Module, ctx: bpy.types.Context):
         self.module = module
         self.ctx = ctx
-        self.env = Env()
+        self.socks: Dict[Node, bpy.types.NodeSocket] = {}
+        self.separates: Dict[Node, bpy.types.Node] = {}
+        # instances of the node groups of called functions
+        self.groups: Dict[Node, bpy.types.Node] = {}
+        self.graphs: List[Graph] = []
+        # stable names of the nodes of the graph being generated
+        self.keys: Dict[Node, str] = {}
+        # summed `NodeTree.stats` of the generated groups
+        self.stats: Dict[str, int] = {}
         match self.ctx.space_data:
             case bpy.types.SpaceNodeEditor():
                 self.nt = self.ctx.space_data.node_tree
@@ -226,137 +84,118 @@ class NodeGen:
     def tree_type(self) -> str:
         return self.nt.bl_idname
 
-    def add_param(self, arg: FnArg, nt: NodeTree):
-        match arg:
-            case FnArg(Ident(name), Ty(kind), ty_qualifiers):
-                out = None
-                for qual in ty_qualifiers:
-                    if qual.is_output():
-                        out = nt.add_output(name, kind)
-                        self.env.bind_output(name, out)
-                    break
-                sock = nt.add_input(name, kind)
-                if out:
-                    nt.link(sock, out)
-                self.env.bind(name, sock)
-
-    def gen_expr(self, expr: Expr, nt: NodeTree) -> bpy.types.NodeSocket | Value:
-        match expr.kind:
-            case Assign(Expr(Ident(name)), init):
-                value = self.gen_expr(init, nt)
-                if name in self.env.outputs:
-                    sock = self.env.outputs[name]
-                    match sock:
-                        case bpy.types.NodeSocket():
-                            nt.link(value, sock)
-                self.env.set(name, value)
-                return value
-            case Int(value):
-                return Value(ValueKind.Int, int(value))
-            case Float(value):
-                return Value(ValueKind.Float, float(value))
-            case Ident(name):
-                return self.env.get(name)
-            case Binary(left, right, kind):
-                assert expr.kind.ty != None
-                l = self.gen_expr(left, nt)
-                r = self.gen_expr(right, nt)
-                ntype = None
-                if expr.kind.ty.is_vector():
-                    node = nt.add_node("ShaderNodeVectorMath")
-                    ntype = bpy.types.ShaderNodeVectorMath
-                else:
-                    node = nt.add_node("ShaderNodeMath")
-                    ntype = bpy.types.ShaderNodeMath
-                assert isinstance(node, ntype)
-                node.operation = kind.blender_op()
-                nt.link(l, node.inputs[0], expr.kind.ty)
-                nt.link(r, node.inputs[1], expr.kind.ty)
-                match kind:
-                    case BinaryKind.NotEq:
-                        out = nt.add_node("ShaderNodeMath")
-                        out.operation = "SUBTRACT"
-                        nt.link(Value(ValueKind.Int, 1), out.inputs[0])
-                        nt.link(n_out(node), out.inputs[1])
-                        node = out
-                return n_out(node)
-            case Call(name, args):
-                assert expr.kind.sig != None
-                if name in builtins:
-                    gen_args = [self.gen_expr(arg, nt) for arg in args]
-                    node = builtins[name](expr.kind.sig, gen_args, nt, name)
-                else:
-                    node = nt.add_group()
-                    node.node_tree = bpy.data.node_groups.get(name)
-                return n_out(node)
-            case Field(Ident(name), Ident(field)):
-                var = self.env.get(name)
-                match var:
-                    case bpy.types.NodeSocketVector():
-                        out = nt.add_node("ShaderNodeSeparateXYZ")
-                        nt.link(var, out.inputs[0])
-                        return out.outputs[field_to_socket_index[field]]
-                    case _:
-                        assert False
-            case Unary(_, expr):
-                sock = self.gen_expr(expr, nt)
-                out = nt.add_node("ShaderNodeMath")
-                out.operation = "SUBTRACT"
-                nt.link(Value(ValueKind.Int, 0), out.inputs[0])
-                nt.link(sock, out.inputs[1])
-                return n_out(out)
+    def link(self, value: Node, to: bpy.types.NodeSocket, nt: NodeTree, ty: Ty | None = None):
+        match value:
+            case Const():
+                nt.link(const_value(value), to, ty)
             case _:
-                assert False, f"{expr.kind}"
-
-    def gen_node_tree(self, block: Block, nt: NodeTree):
-        for stmt in block.stmts:
-            match stmt.kind:
-                case ExprStmt(exprs):
-                    for expr in exprs:
-                        self.gen_expr(expr, nt)
-                case Decl(_, exprs):
-                    for expr in exprs.exprs:
-                        match expr.kind:
-                            case Assign(Expr(Ident(name)), init):
-                                if init:
-                                    sock = self.gen_expr(init, nt)
-                                    self.env.bind(name, sock)
-                            case _:
-                                assert False
-                case Return(expr):
-                    sock_out = self.gen_expr(expr, nt)
-                    match sock_out:
-                        case Value(_, data):
-                            sock = nt._outs.get('ret')
-                            sock.default_value = data
-                        case _:
-                            nt.link_to_output('ret', sock_out)
-                case _:
-                    assert False, f"{stmt.kind}"
-
-    def emit(self, clear=False):
-        for deff in self.module.defs:
-            match deff:
-                case Def(Fn(Ident(name), FnSig(args, Ty(ret_ty)), body)):
-                    if clear:
-                        self.nt.nodes.clear()
-                    nt = NodeTree(name, self.tree_type)
-                    match self.tree_type:
-                        case 'ShaderNodeTree':
-                            node = self.nt.nodes.new('ShaderNodeGroup')
-                        case 'GeometryNodeTree':
-                            node = self.nt.nodes.new('GeometryNodeGroup')
-                        case _:
-                            assert False, f"{self.tree_type}"
-
-                    match node:
-                        case bpy.types.ShaderNodeGroup() | bpy.types.GeometryNodeGroup():
-                            node.node_tree = nt._nt
-                        case _:
-                            assert False, "not implemented"
-                    for arg in args:
-                        self.add_param(arg, nt)
-                    if ret_ty != TypeKind.Void:
-                        nt.add_output('ret', ret_ty)
-                    self.gen_node_tree(body, nt)
-                    return nt._nt.nodes
+                nt.link(self.socks[value], to, ty)
+
+    # `gen_node(node, nt)` adds the Blender nodes for `node` to `nt` and
+    # returns the socket holding its value
+
+    @handles('gen_node', Const)
+    def gen_const(self, node: Const, nt: NodeTree) -> bpy.types.NodeSocket | None:
+        return None
+
+    @handles('gen_node', Input)
+    def gen_input(self, node: Input, nt: NodeTree) -> bpy.types.NodeSocket | None:
+        return nt._ins.get(node.name)
+
+    @handles('gen_node', Op)
+    def gen_op(self, node: Op, nt: NodeTree) -> bpy.types.NodeSocket | None:
+        out = nt.add_node(node.node_type, self.keys[node])
+        if node.operation and out.operation != node.operation:
+            out.operation = node.operation
+        for arg, sock in zip(node.args, n_ins(out)):
+            self.link(arg, sock, nt, node.ty)
+        return n_out(out)
+
+    @handles('gen_node', Broadcast)
+    def gen_broadcast(self, node: Broadcast, nt: NodeTree) -> bpy.types.NodeSocket | None:
+        out = nt.add_node('ShaderNodeCombineXYZ', self.keys[node])
+        for i in range(node.ty.get_size()):
+            self.link(node.arg, out.inputs[i], nt)
+        return out.outputs[0]
+
+    @handles('gen_node', Extract)
+    def gen_extract(self, node: Extract, nt: NodeTree) -> bpy.types.NodeSocket | None:
+        arg = node.arg
+        if arg not in self.separates:
+            # shared by all the components of `arg`
+            key = self.keys.get(arg, self.keys[node])
+            out = nt.add_node('ShaderNodeSeparateXYZ', f"{key}.separate")
+            self.link(arg, out.inputs[0], nt)
+            self.separates[arg] = out
+        return self.separates[arg].outputs[node.index]
+
+    @handles('gen_node', Group)
+    def gen_group(self, node: Group, nt: NodeTree) -> bpy.types.NodeSocket | None:
+        out = nt.add_group(self.keys[node])
+        tree = bpy.data.node_groups.get(node.name)
+        if out.node_tree != tree:
+            out.node_tree = tree
+        for arg, sock in zip(node.args, out.inputs):
+            self.link(arg, sock, nt)
+        self.groups[node] = out
+        return None
+
+    @handles('gen_node', Result)
+    def gen_result(self, node: Result, nt: NodeTree) -> bpy.types.NodeSocket | None:
+        return self.groups[node.arg].outputs[node.name]
+
+    @handles('gen_node', object)
+    def gen_other(self, node: Node, nt: NodeTree) -> bpy.types.NodeSocket | None:
+        assert False, f"{node}"
+
+    def gen_node_tree(self, graph: Graph) -> NodeTree:
+        """Generates or patches the node group of `graph`."""
+        self.keys = graph.node_keys()
+        nt = NodeTree(graph.name, self.tree_type, set(self.keys.values()))
+        for inp in graph.inputs.values():
+            nt.add_input(inp.name, inp.ty.kind, inp.default)
+        for out in graph.outputs.values():
+            nt.add_output(out.name, out.ty.kind)
+        for node in graph.nodes:
+            if (sock := self.gen_node(node, nt)) != None:
+                self.socks[node] = sock
+        for out in graph.outputs.values():
+            if out.value:
+                self.link(out.value, nt._outs.get(out.name), nt, out.ty)
+            else:
+                nt.unlink(nt._outs.get(out.name))
+        nt.prune()
+        for name, count in nt.stats.items():
+            self.stats[name] = self.stats.get(name, 0) + count
+        return nt
+
+    def emit(self, clear=False, inline='AUTO', hoist='NONE', compiled: Compiled | None = None) -> List[bpy.types.Nodes]:
+        """
+        Generates the node groups of the module, callees first, and makes
+        sure the edited tree has an instance of every function not called by
+        another one. Existing groups are patched, see `NodeTree`, and the
+        other nodes of the edited tree are left alone unless `clear` is set.
+        With the graphs of a cached compile, groups already generated from
+        the same source are used as they are. Returns the nodes of the
+        generated groups.
+        """
+        if compiled:
+            self.graphs, key = compiled.graphs, compiled.key
+        else:
+            self.graphs, key = lower_module(self.module, self.tree_type, inline, hoist), ''
+        if clear:
+            self.nt.nodes.clear()
+        roots = {fn.name.name for fn in CallGraph(self.module).roots()}
+        instances = instanced(self.nt)
+        trees: List[bpy.types.NodeTree] = []
+        for graph in self.graphs:
+            tree = bpy.data.node_groups.get(graph.name)
+            if key and tree and tree.bl_idname == self.tree_type and tree.get(source_prop) == key:
+                self.stats['cached'] = self.stats.get('cached', 0) + 1
+            else:
+                tree = self.gen_node_tree(graph)._nt
+                tree[source_prop] = key
+            trees.append(tree)
+            if graph.name in roots and tree not in instances:
+                add_instance(self.nt, tree)
+        return [tree.nodes for tree in trees]
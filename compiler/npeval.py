@@ -0,0 +1,345 @@
+from __future__ import annotations
+from typing import Callable, Dict, List
+import numpy as np
+from .Ast import *
+from .bltin import builtins as bltins
+from .callgraph import CallGraph
+from .fold import FLT_EPSILON
+from .lower import field_to_socket_index, is_output
+from .visitor import Visitor, handles
+
+# scalars are float32 arrays of shape `(N,)`, vectors of shape `(N, 3)`,
+# `vec2` values keep their unused third lane like the vector sockets do
+Array = np.ndarray
+
+
+def align(value) -> Array:
+    """Pads vectors to 3 lanes with zeros, like `wrappers.align`."""
+    value = np.asarray(value, dtype=np.float32)
+    lanes = value.shape[-1]
+    if lanes < 3:
+        value = np.concatenate([value, np.zeros(value.shape[:-1] + (3 - lanes, ), np.float32)], axis=-1)
+    return value
+
+
+def to_float(value: Array, ty: Ty) -> Array:
+    if ty.is_vector():
+        # implicit vector to float conversion averages the components
+        return ((value[..., 0] + value[..., 1]) + value[..., 2]) / np.float32(3)
+    return value
+
+
+def to_vector(value: Array, ty: Ty) -> Array:
+    if ty.is_vector():
+        return value
+    return np.repeat(value[..., None], 3, axis=-1)
+
+
+def broadcast(value: Array, ty: Ty) -> Array:
+    """A scalar in the lanes of the vector type `ty`, the others are zero."""
+    lanes = [value] * ty.get_size()
+    lanes += [np.zeros_like(value)] * (3 - len(lanes))
+    return np.stack(lanes, axis=-1)
+
+
+def coerce(value: Array, value_ty: Ty, ty: Ty) -> Array:
+    if not ty.is_vector() or value_ty.is_vector():
+        return value
+    return broadcast(value, ty)
+
+
+def convert(value, ty: Ty) -> Array:
+    """
+    A value passed to a group socket of type `ty`: a scalar, an array of
+    `(N,)` samples or for vectors a tuple or an array of `(N, 2)` or `(N, 3)`
+    samples.
+    """
+    value = np.asarray(value, dtype=np.float32)
+    if ty.is_vector():
+        return align(value) if value.ndim > 0 else to_vector(value, Ty(TypeKind.Float))
+    assert value.ndim < 2, f"expected samples of a scalar, found shape {value.shape}"
+    if ty.kind == TypeKind.Int:
+        # integer sockets truncate
+        value = np.trunc(value)
+    return value
+
+
+def samples(value: Array, ty: Ty) -> int | None:
+    """The number of samples of `value`, `None` for a single one."""
+    if value.ndim > ty.is_vector():
+        return len(value)
+    return None
+
+
+def safe_divide(a: Array, b: Array) -> Array:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(b != 0, a / np.where(b != 0, b, np.float32(1)), np.float32(0))
+
+
+def safe_sqrt(a: Array) -> Array:
+    return np.where(a > 0, np.sqrt(np.maximum(a, np.float32(0))), np.float32(0))
+
+
+def dot(a: Array, b: Array) -> Array:
+    return (a[..., 0] * b[..., 0] + a[..., 1] * b[..., 1]) + a[..., 2] * b[..., 2]
+
+
+def compare(a: Array, b: Array) -> Array:
+    # Math's Compare clamps its unlinked epsilon to `FLT_EPSILON`
+    with np.errstate(invalid='ignore'):
+        equal = (a == b) | (np.abs(a - b) <= np.float32(FLT_EPSILON))
+    return equal.astype(np.float32)
+
+
+def eval_vec(sig: int, args: List[Array], name: str) -> Array:
+    ty = bltins[name][sig].ret_ty
+    match len(args):
+        case 1:
+            return broadcast(args[0], ty)
+        case _:
+            lanes = list(np.broadcast_arrays(*args[:3]))
+            lanes += [np.zeros_like(lanes[0])] * (3 - len(lanes))
+            return np.stack(lanes, axis=-1)
+
+
+def eval_length(sig: int, args: List[Array], name: str) -> Array:
+    return np.sqrt(dot(args[0], args[0]))
+
+
+def eval_math(sig: int, args: List[Array], name: str) -> Array:
+    fn = np.minimum if name == 'min' else np.maximum
+    ty = bltins[name][sig].ret_ty
+    return fn(args[0], coerce(args[1], bltins[name][sig].args[1], ty))
+
+
+def eval_abs(sig: int, args: List[Array], name: str) -> Array:
+    return np.abs(args[0])
+
+
+def eval_dot(sig: int, args: List[Array], name: str) -> Array:
+    return dot(args[0], args[1])
+
+
+def eval_cross(sig: int, args: List[Array], name: str) -> Array:
+    a, b = args
+    return np.stack([
+        a[..., 1] * b[..., 2] - a[..., 2] * b[..., 1],
+        a[..., 2] * b[..., 0] - a[..., 0] * b[..., 2],
+        a[..., 0] * b[..., 1] - a[..., 1] * b[..., 0],
+    ], axis=-1)
+
+
+def eval_clamp(sig: int, args: List[Array], name: str) -> Array:
+    return np.minimum(np.maximum(args[0], args[1]), args[2])
+
+
+def eval_sqrt(sig: int, args: List[Array], name: str) -> Array:
+    return safe_sqrt(args[0])
+
+
+builtins: Dict[str, Callable[[int, List[Array], str], Array]] = {
+    'vec4': eval_vec,
+    'vec3': eval_vec,
+    'vec2': eval_vec,
+    'length': eval_length,
+    'min': eval_math,
+    'max': eval_math,
+    'abs': eval_abs,
+    'dot': eval_dot,
+    'cross': eval_cross,
+    'clamp': eval_clamp,
+    'sqrt': eval_sqrt,
+}
+
+
+def output(value: Array, ty: Ty, size: int) -> Array:
+    """`value` read from a group output of type `ty`, for `size` samples."""
+    if ty.kind == TypeKind.Int:
+        value = np.trunc(value)
+    shape = (size, 3) if ty.is_vector() else (size, )
+    return np.array(np.broadcast_to(value, shape), dtype=np.float32)
+
+
+def ty_of(expr: Expr) -> Ty:
+    # assignments are void expressions valued like their variable
+    if isinstance(expr, Assign):
+        return ty_of(expr.left)
+    assert expr.ty != None, f"{expr} isn't type checked"
+    return expr.ty
+
+
+class Evaluator(Visitor):
+    """
+    Evaluates a type checked `Fn` over arrays of samples with NumPy, with
+    the single precision semantics of the nodes `Lowering` generates, no
+    nodes are built. Calls of other functions of the module are evaluated
+    like inlined ones.
+    """
+
+    def __init__(self, fn: Fn, fns: Dict[str, Fn] | None = None):
+        self.fn = fn
+        self.fns = fns or {}
+        # current value of every variable by slot, see `resolve_locals`
+        self.values: List[Array | None] = [None] * len(fn.locals)
+        # value of the last `return`, like the one `Lowering` outputs
+        self.ret: Array | None = None
+
+    # `eval_expr(expr)` computes the value of `expr`
+
+    @handles('eval_expr', Assign)
+    def eval_assign(self, expr: Assign) -> Array:
+        match expr.left:
+            case Ident() as ident:
+                value = self.eval_expr(expr.init)
+                self.values[ident.slot] = value  # type: ignore
+                return value
+        assert False, f"{expr.left}"
+
+    @handles('eval_expr', Int, Float)
+    def eval_literal(self, expr: Int | Float) -> Array:
+        value = int(expr.value) if isinstance(expr, Int) else float(expr.value)
+        return np.float32(value)  # type: ignore
+
+    @handles('eval_expr', Ident)
+    def eval_ident(self, expr: Ident) -> Array:
+        value = self.values[expr.slot]  # type: ignore
+        assert value is not None, f"`{expr.name}` is used before it is assigned"
+        return value
+
+    @handles('eval_expr', Binary)
+    def eval_binary_chain(self, expr: Binary) -> Array:
+        # evaluate the left spine of operator chains in a loop, they nest as
+        # deep as they are long
+        spine: List[Binary] = []
+        left: Expr = expr
+        while isinstance(left, Binary):
+            spine.append(left)
+            left = left.left
+        value = self.eval_expr(left)
+        for binary in reversed(spine):
+            value = self.eval_binary(binary, value, self.eval_expr(binary.right))
+        return value
+
+    @handles('eval_expr', Call)
+    def eval_call(self, expr: Call) -> Array | None:
+        args = [self.eval_expr(arg) for arg in expr.args]
+        if expr.name in builtins:
+            assert expr.sig != None
+            return builtins[expr.name](expr.sig, args, expr.name)
+
+        assert expr.name in self.fns, f"`{expr.name}` is not a builtin"
+        callee = Evaluator(self.fns[expr.name], self.fns)
+        for param, value in zip(callee.fn.sig.args, args):
+            callee.values[param.name.slot] = value  # type: ignore
+        callee.eval_block(callee.fn.body)
+        for param, arg in zip(callee.fn.sig.args, expr.args):
+            if is_output(param):
+                self.values[arg.slot] = callee.values[param.name.slot]  # type: ignore
+        return callee.ret
+
+    @handles('eval_expr', Field)
+    def eval_field(self, expr: Field) -> Array:
+        return self.eval_ident(expr.name)[..., field_to_socket_index[expr.field.name]]
+
+    @handles('eval_expr', Unary)
+    def eval_unary(self, expr: Unary) -> Array:
+        return np.float32(0) - self.eval_expr(expr.expr)
+
+    @handles('eval_expr', object)
+    def eval_other(self, expr: Expr) -> Array:
+        assert False, f"{expr}"
+
+    def eval_binary(self, binary: Binary, l: Array, r: Array) -> Array:
+        ty = binary.ty
+        assert ty != None
+        l_ty, r_ty = ty_of(binary.left), ty_of(binary.right)
+        if ty.is_vector():
+            l, r = coerce(l, l_ty, ty), coerce(r, r_ty, ty)
+        else:
+            # vectors compared with Math's Compare are averaged
+            l, r = to_float(l, l_ty), to_float(r, r_ty)
+        match binary.op:
+            case BinaryKind.Add:
+                return l + r
+            case BinaryKind.Sub:
+                return l - r
+            case BinaryKind.Mul:
+                return l * r
+            case BinaryKind.Div:
+                return safe_divide(l, r)
+            case BinaryKind.Eq:
+                return compare(l, r)
+            case BinaryKind.NotEq:
+                return np.float32(1) - compare(l, r)
+        assert False, f"{binary.op}"
+
+    # `eval_stmt(stmt)` executes the statement `stmt.kind`
+
+    @handles('eval_stmt', ExprStmt)
+    def eval_expr_stmt(self, stmt: ExprStmt):
+        for expr in stmt.exprs:
+            self.eval_expr(expr)
+
+    @handles('eval_stmt', Decl)
+    def eval_decl(self, stmt: Decl):
+        for expr in stmt.decls.exprs:
+            match expr:
+                case Assign(Ident() as ident, init):
+                    if init:
+                        self.values[ident.slot] = self.eval_expr(init)  # type: ignore
+                case _:
+                    assert False
+
+    @handles('eval_stmt', Return)
+    def eval_return(self, stmt: Return):
+        self.ret = self.eval_expr(stmt.expr)
+
+    @handles('eval_stmt', object)
+    def eval_other_stmt(self, stmt):
+        assert False, f"{stmt}"
+
+    def eval_block(self, block: Block):
+        for stmt in block.stmts:
+            self.eval_stmt(stmt.kind)
+
+
+def evaluate(module: Module, inputs: Dict[str, object] | None = None,
+             name: str | None = None, size: int | None = None) -> Dict[str, Array]:
+    """
+    Evaluates the function `name` of a type checked module, the last one by
+    default, over the samples in `inputs` by parameter name. A scalar
+    parameter takes a value or an array of shape `(N,)`, a vector one a
+    tuple or an array of shape `(N, 2)` or `(N, 3)`, missing parameters are
+    zero like unlinked sockets. Returns the values of the group outputs,
+    `ret` and the out parameters, with `size` or else `N` samples.
+
+    >>> from compiler.Parser import parser_from_src
+    >>> from compiler.typechk import TyChecker
+    >>> module = parser_from_src('''
+    ... float sdf(vec3 p, float r) { return length(p) - r; }
+    ... ''').parse()
+    >>> _ = TyChecker(module)
+    >>> evaluate(module, {'p': [(3.0, 4.0, 0.0), (0.0, 0.0, 1.0)], 'r': 1.0})
+    {'ret': array([4., 0.], dtype=float32)}
+    """
+    inputs = inputs or {}
+    fns = CallGraph(module).fns
+    fn = fns[name] if name else list(fns.values())[-1]
+    ev = Evaluator(fn, fns)
+    sizes = [size] if size else []
+    for param in fn.sig.args:
+        value = convert(inputs.get(param.name.name, 0.0), param.ty)
+        ev.values[param.name.slot] = value  # type: ignore
+        if (n := samples(value, param.ty)) and not size:
+            sizes.append(n)
+    ev.eval_block(fn.body)
+
+    size = max(sizes, default=1)
+    outs: Dict[str, Array] = {}
+    if fn.sig.ret_ty.kind != TypeKind.Void:
+        assert ev.ret is not None, f"`{fn.name.name}` doesn't return a value"
+        outs['ret'] = output(ev.ret, fn.sig.ret_ty, size)
+    for param in fn.sig.args:
+        if is_output(param):
+            outs[param.name.name] = output(ev.values[param.name.slot], param.ty, size)  # type: ignore
+    return outs
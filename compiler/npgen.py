@@ -0,0 +1,431 @@
+from __future__ import annotations
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from types import CodeType
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+from .Ast import Module, TypeKind
+from .cache import LRUCache
+from .callgraph import CallGraph, Inliner
+from .fold import FLT_EPSILON, ops, to_float, to_vector
+from .ir import Node, Const, Input, Op, Broadcast, Extract, Graph
+from .lower import Lowering
+from .npeval import Array, convert, samples, safe_sqrt
+from .opt import optimize
+
+# the helpers below write their result into `out`, which only aliases an
+# argument for the operations in `in_place`
+
+
+def safe_divide(a: Array, b: Array, out: Array):
+    zero = b == 0
+    np.divide(a, np.where(zero, np.float32(1), b), out=out)
+    out[zero] = 0
+
+
+def dot(a: Array, b: Array, out: Array):
+    np.multiply(a[..., 0], b[..., 0], out=out)
+    out += a[..., 1] * b[..., 1]
+    out += a[..., 2] * b[..., 2]
+
+
+def length(a: Array, out: Array):
+    dot(a, a, out)
+    np.sqrt(out, out=out)
+
+
+def cross(a: Array, b: Array, out: Array):
+    for i, j, k in ((0, 1, 2), (1, 2, 0), (2, 0, 1)):
+        np.subtract(a[..., j] * b[..., k], a[..., k] * b[..., j], out=out[..., i])
+
+
+def distance(a: Array, b: Array, out: Array):
+    length(a - b, out)
+
+
+def normalize(a: Array, out: Array):
+    d = a[..., 0] * a[..., 0] + a[..., 1] * a[..., 1] + a[..., 2] * a[..., 2]
+    keep = d > np.float32(1e-35)
+    np.divide(a, np.sqrt(np.where(keep, d, np.float32(1)))[..., None], out=out)
+    out[~keep] = 0
+
+
+def project(a: Array, b: Array, out: Array):
+    ab = np.empty(np.broadcast_shapes(a.shape, b.shape)[:-1], np.float32)
+    bb = np.empty_like(ab)
+    dot(a, b, ab)
+    dot(b, b, bb)
+    safe_divide(ab, bb, ab)
+    np.multiply(b, ab[..., None], out=out)
+
+
+def splat(a: Array) -> Array:
+    """A scalar linked into a vector socket, in all three lanes."""
+    a = np.asarray(a)
+    return np.broadcast_to(a[..., None], a.shape + (3, ))
+
+
+def compare(a: Array, b: Array, epsilon: Array, out: Array):
+    with np.errstate(invalid='ignore'):
+        equal = (a == b) | (np.abs(a - b) <= np.maximum(epsilon, np.float32(FLT_EPSILON)))
+    np.copyto(out, equal)
+
+
+def not_equal(a: Array, b: Array, epsilon: Array, out: Array):
+    with np.errstate(invalid='ignore'):
+        np.copyto(out, np.abs(a - b) > epsilon)
+
+
+def map_range(v: Array, from_min: Array, from_max: Array, to_min: Array, to_max: Array, out: Array):
+    safe_divide(v - from_min, np.asarray(from_max - from_min), out)
+    out *= to_max - to_min
+    out += to_min
+    np.clip(out, np.minimum(to_min, to_max), np.maximum(to_min, to_max), out=out)
+
+
+# `(node_type, operation)` -> code computing the node into `{o}` given its
+# arguments `{0}`, `{1}`... converted to the socket kinds of `fold.ops`
+templates: Dict[Tuple[str, str | None], str] = {
+    ('ShaderNodeMath', 'ADD'): "np.add({0}, {1}, out={o})",
+    ('ShaderNodeMath', 'SUBTRACT'): "np.subtract({0}, {1}, out={o})",
+    ('ShaderNodeMath', 'MULTIPLY'): "np.multiply({0}, {1}, out={o})",
+    ('ShaderNodeMath', 'DIVIDE'): "safe_divide({0}, {1}, {o})",
+    ('ShaderNodeMath', 'MINIMUM'): "np.minimum({0}, {1}, out={o})",
+    ('ShaderNodeMath', 'MAXIMUM'): "np.maximum({0}, {1}, out={o})",
+    ('ShaderNodeMath', 'ABSOLUTE'): "np.abs({0}, out={o})",
+    ('ShaderNodeMath', 'SQRT'): "{o}[...] = safe_sqrt({0})",
+    ('ShaderNodeMath', 'COMPARE'): "compare({0}, {1}, {2}, {o})",
+    ('ShaderNodeMath', 'MULTIPLY_ADD'): "np.multiply({0}, {1}, out={o})\n{o} += {2}",
+    ('ShaderNodeVectorMath', 'ADD'): "np.add({0}, {1}, out={o})",
+    ('ShaderNodeVectorMath', 'SUBTRACT'): "np.subtract({0}, {1}, out={o})",
+    ('ShaderNodeVectorMath', 'MULTIPLY'): "np.multiply({0}, {1}, out={o})",
+    ('ShaderNodeVectorMath', 'DIVIDE'): "safe_divide({0}, {1}, {o})",
+    ('ShaderNodeVectorMath', 'MINIMUM'): "np.minimum({0}, {1}, out={o})",
+    ('ShaderNodeVectorMath', 'MAXIMUM'): "np.maximum({0}, {1}, out={o})",
+    ('ShaderNodeVectorMath', 'ABSOLUTE'): "np.abs({0}, out={o})",
+    ('ShaderNodeVectorMath', 'DOT_PRODUCT'): "dot({0}, {1}, {o})",
+    ('ShaderNodeVectorMath', 'CROSS_PRODUCT'): "cross({0}, {1}, {o})",
+    ('ShaderNodeVectorMath', 'LENGTH'): "length({0}, {o})",
+    ('ShaderNodeVectorMath', 'MULTIPLY_ADD'): "np.multiply({0}, {1}, out={o})\n{o} += {2}",
+    ('ShaderNodeVectorMath', 'SCALE'): "np.multiply({0}, np.asarray({1})[..., None], out={o})",
+    ('ShaderNodeVectorMath', 'DISTANCE'): "distance({0}, {1}, {o})",
+    ('ShaderNodeVectorMath', 'NORMALIZE'): "normalize({0}, {o})",
+    ('ShaderNodeVectorMath', 'PROJECT'): "project({0}, {1}, {o})",
+    ('FunctionNodeCompare', 'NOT_EQUAL'): "not_equal({0}, {1}, {2}, {o})",
+    ('ShaderNodeCombineXYZ', None): "{o}[..., 0] = {0}\n{o}[..., 1] = {1}\n{o}[..., 2] = {2}",
+    ('ShaderNodeClamp', None): "np.maximum({0}, {1}, out={o})\nnp.minimum({o}, {2}, out={o})",
+    ('ShaderNodeMapRange', None): "map_range({0}, {1}, {2}, {3}, {4}, {o})",
+}
+
+# elementwise operations whose result can overwrite a dying argument
+in_place = {
+    (node_type, operation)
+    for node_type in ('ShaderNodeMath', 'ShaderNodeVectorMath')
+    for operation in ('ADD', 'SUBTRACT', 'MULTIPLY', 'DIVIDE', 'MINIMUM', 'MAXIMUM', 'ABSOLUTE', 'SQRT')
+}
+
+runtime = {
+    'np': np, 'splat': splat, 'safe_divide': safe_divide, 'safe_sqrt': safe_sqrt, 'dot': dot, 'length': length,
+    'cross': cross, 'distance': distance, 'normalize': normalize, 'project': project,
+    'compare': compare, 'not_equal': not_equal, 'map_range': map_range,
+}
+
+
+def constant(value: float | Tuple[float, ...]) -> str:
+    if isinstance(value, tuple):
+        return f"np.array({tuple(float(v) for v in value)!r}, np.float32)"
+    return f"np.float32({float(value)!r})"
+
+
+class KernelGen:
+    """
+    Generates the source of a NumPy kernel computing an optimized `Graph`,
+    a straight line of array operations with one statement per node. Every
+    node writes into a preallocated buffer with `out=`, a buffer is reused
+    once the last node reading it has run, so a kernel allocates as many
+    arrays as values are live at once rather than one per node.
+    """
+
+    def __init__(self, graph: Graph):
+        self.graph = graph
+        self.lines: List[str] = []
+        # names of the constants by their code
+        self.consts: Dict[str, str] = {}
+        # expression reading the value of every node
+        self.exprs: Dict[Node, str] = {}
+        # buffer holding the value of every node computed into one, the
+        # lanes extracted from a vector are views of its buffer
+        self.buffers: Dict[Node, str] = {}
+        # released buffers, vector ones are named `v*` and scalar ones `t*`
+        self.free: Dict[bool, List[str]] = {False: [], True: []}
+        self.count = 0
+        # index of the last node reading every buffer
+        self.last_use: Dict[str, int] = {}
+
+    def alloc(self, vector: bool) -> str:
+        if self.free[vector]:
+            return self.free[vector].pop()
+        name = f"{'v' if vector else 't'}{self.count}"
+        self.count += 1
+        self.lines.append(f"{name} = np.empty({'(n, 3)' if vector else 'n'}, np.float32)")
+        return name
+
+    def release(self, buffers: List[str]):
+        for buffer in buffers:
+            self.free[buffer[0] == 'v'].append(buffer)
+
+    def const(self, value: float | Tuple[float, ...]) -> str:
+        code = constant(value)
+        if code not in self.consts:
+            self.consts[code] = f"c{len(self.consts)}"
+        return self.consts[code]
+
+    def arg(self, node: Node, kind: str, temps: List[str]) -> str:
+        """The expression reading `node` from a socket of kind 'S' or 'V'."""
+        match node, kind:
+            case Const(value), 'S':
+                return self.const(to_float(value))
+            case Const(value), 'V':
+                return self.const(to_vector(value))
+        expr = self.exprs[node]
+        if kind == 'V' and not node.ty.is_vector():
+            return f"splat({expr})"
+        if kind == 'S' and node.ty.is_vector():
+            # implicit vector to float conversion averages the components
+            temp = self.alloc(False)
+            temps.append(temp)
+            self.lines.append(f"np.add({expr}[..., 0], {expr}[..., 1], out={temp})")
+            self.lines.append(f"{temp} += {expr}[..., 2]")
+            self.lines.append(f"{temp} /= np.float32(3)")
+            return temp
+        return expr
+
+    def gen_node(self, node: Node, index: int):
+        match node:
+            case Const():
+                # read through `arg`, which converts them at compile time
+                return
+            case Input(name):
+                self.exprs[node] = f"i{len(self.exprs)}"
+                self.lines.append(f"{self.exprs[node]} = inputs[{name!r}]")
+                return
+            case Extract(arg, lane):
+                self.exprs[node] = f"{self.exprs[arg]}[..., {lane}]"
+                if arg in self.buffers:
+                    self.buffers[node] = self.buffers[arg]
+                return
+
+        temps: List[str] = []
+        match node:
+            case Op(node_type, operation, args):
+                key = (node_type, operation)
+                assert key in templates, f"`{node_type}` `{operation}` can't be evaluated on the CPU"
+                kinds = ops[key][0]
+                values = [self.arg(arg, kind, temps) for arg, kind in zip(args, kinds)]
+                # unlinked inputs are zero, like in `fold.evaluate`
+                values += [self.const((0.0, 0.0, 0.0) if kind == 'V' else 0.0) for kind in kinds[len(args):]]
+                code = templates[key]
+                vector = node.ty.is_vector()
+            case Broadcast(arg):
+                size = node.ty.get_size()
+                values = [self.arg(arg, 'S', temps)]
+                code = f"{{o}}[..., :{size}] = np.asarray({{0}})[..., None]"
+                if size < 3:
+                    code += f"\n{{o}}[..., {size}:] = 0"
+                vector = True
+            case _:
+                assert False, f"`{type(node).__name__}` can't be evaluated on the CPU, calls have to be inlined"
+
+        # buffers no later node reads
+        dying = {self.buffers[arg] for arg in node.args if arg in self.buffers}
+        dying = [buffer for buffer in sorted(dying) if self.last_use[buffer] == index]
+        if isinstance(node, Op) and (node.node_type, node.operation) in in_place:
+            self.release(dying)
+            dying = []
+        out = self.alloc(vector)
+        self.lines += code.format(*values, o=out).split('\n')
+        self.exprs[node] = out
+        self.buffers[node] = out
+        self.free[False] += temps
+        self.release(dying)
+
+    def generate(self) -> str:
+        nodes = self.graph.nodes
+        # the node whose buffer holds the value of every computed node
+        owner: Dict[Node, Node] = {}
+        for node in nodes:
+            match node:
+                case Extract(arg) if arg in owner:
+                    owner[node] = owner[arg]
+                case Op() | Broadcast():
+                    owner[node] = node
+        last: Dict[Node, int] = {}
+        for i, node in enumerate(nodes):
+            for arg in node.args:
+                if arg in owner:
+                    last[owner[arg]] = i
+        for out in self.graph.outputs.values():
+            if out.value in owner:
+                # outputs are read after every node
+                last[owner[out.value]] = len(nodes)
+
+        for i, node in enumerate(nodes):
+            self.gen_node(node, i)
+            if owner.get(node) is node:
+                self.last_use[self.buffers[node]] = last.get(node, i)
+                if node not in last:
+                    self.release([self.buffers[node]])
+
+        outs: List[str] = []
+        truncs: List[str] = []
+        returned = set()
+        for out in self.graph.outputs.values():
+            assert out.value, f"output `{out.name}` of `{self.graph.name}` is not set"
+            match out.value:
+                case Const(value):
+                    expr = self.const(value)
+                case _:
+                    expr = self.exprs[out.value]
+            if self.buffers.get(out.value) != expr or expr in returned:
+                # inputs, constants, lanes and values returned twice are copied
+                name = f"r{len(outs)}"
+                shape = '(n, 3)' if out.ty.is_vector() else '(n, )'
+                self.lines.append(f"{name} = np.array(np.broadcast_to({expr}, {shape}), np.float32)")
+                expr = name
+            returned.add(expr)
+            if out.ty.kind == TypeKind.Int:
+                # integer sockets truncate
+                truncs.append(f"np.trunc({expr}, out={expr})")
+            outs.append(f"{out.name!r}: {expr}")
+        self.lines += truncs
+        self.lines.append(f"return {{{', '.join(outs)}}}")
+
+        body = [f"    {line}" for line in self.lines]
+        header = [f"{name} = {code}" for code, name in self.consts.items()]
+        header += ['', ''] if header else []
+        return '\n'.join(header + ['def kernel(n, inputs):'] + body) + '\n'
+
+
+class Kernel:
+    """
+    A compiled kernel, calling it evaluates the graph it was generated from
+    over arrays of samples like `npeval.evaluate` evaluates the function.
+    """
+
+    def __init__(self, graph: Graph, source: str, code: CodeType):
+        self.name = graph.name
+        self.source = source
+        # the names, types and defaults of the arguments are the graph's,
+        # graphs generating the same source share only `code`
+        self.inputs = list(graph.inputs.values())
+        self.outputs = {out.name: out.ty for out in graph.outputs.values()}
+        namespace = dict(runtime)
+        exec(code, namespace)
+        self.fn: Callable[[int, Dict[str, Array]], Dict[str, Array]] = namespace['kernel']
+
+    def __call__(self, inputs: Dict[str, object] | None = None, size: int | None = None) -> Dict[str, Array]:
+        """
+        Evaluates the kernel over the samples in `inputs` by group input
+        name, see `npeval.evaluate`. Returns new arrays of `size` or else as
+        many samples as the inputs have.
+        """
+        values, size = self.convert(inputs, size)
+        return self.fn(size, values)
+
+    def convert(self, inputs: Dict[str, object] | None, size: int | None) -> Tuple[Dict[str, Array], int]:
+        """The inputs converted to their socket types and the number of samples."""
+        inputs = inputs or {}
+        values: Dict[str, Array] = {}
+        sizes = [size] if size else []
+        for inp in self.inputs:
+            default = inp.default if inp.default is not None else 0.0
+            values[inp.name] = convert(inputs.get(inp.name, default), inp.ty)
+            if (n := samples(values[inp.name], inp.ty)) and not size:
+                sizes.append(n)
+        return values, max(sizes, default=1)
+
+    def map(self, inputs: Dict[str, object] | None = None, size: int | None = None,
+            chunk_size: int = 65536, threads: int | None = None) -> Dict[str, Array]:
+        """
+        Like calling the kernel, but evaluates `chunk_size` samples at a time
+        on a pool of `threads` threads. NumPy releases the GIL inside array
+        operations so chunks run in parallel, and the temporaries of a call
+        are the size of a chunk however many samples there are.
+        """
+        values, size = self.convert(inputs, size)
+        sliced = {inp.name for inp in self.inputs if samples(values[inp.name], inp.ty)}
+        outs = {name: np.empty((size, 3) if ty.is_vector() else size, np.float32)
+                for name, ty in self.outputs.items()}
+
+        def run(start: int):
+            end = min(start + chunk_size, size)
+            chunk = {name: value[start:end] if name in sliced else value for name, value in values.items()}
+            for name, value in self.fn(end - start, chunk).items():
+                outs[name][start:end] = value
+
+        with ThreadPoolExecutor(threads) as pool:
+            # consumed to raise the errors of the chunks
+            for _ in pool.map(run, range(0, size, chunk_size)):
+                pass
+        return outs
+
+
+# compiled kernel code by the hash of its source
+kernels: LRUCache[str, CodeType] = LRUCache(64)
+
+
+def compile_graph(graph: Graph) -> Kernel:
+    """
+    The kernel of `graph`, which can't contain group nodes. Only the code
+    is cached, the kernel binds the inputs and defaults of `graph`.
+
+    >>> from compiler.bltin import Tfloat
+    >>> kernels.clear()
+    >>> def double(default):
+    ...     g = Graph('f')
+    ...     x = g.add_input('x', Tfloat, default)
+    ...     g.add_output('ret', Tfloat)
+    ...     g.set_output('ret', g.add(Op('ShaderNodeMath', 'ADD', [x, x], Tfloat)))
+    ...     return compile_graph(g)
+    >>> double(1.0)()['ret'], double(2.0)()['ret'], len(kernels)
+    (array([2.], dtype=float32), array([4.], dtype=float32), 1)
+    """
+    source = KernelGen(graph).generate()
+    key = hashlib.blake2b(source.encode(), digest_size=16).hexdigest()
+    code = kernels.get(key)
+    if code is None:
+        code = compile(source, f"<blsl kernel {key}>", 'exec')
+        kernels.put(key, code)
+    return Kernel(graph, source, code)
+
+
+def compile_fn(module: Module, name: str | None = None, tree_type: str = 'GeometryNodeTree') -> Kernel:
+    """
+    Compiles the function `name` of a type checked module, the last one by
+    default, into a kernel. Calls are inlined and the graph is optimized for
+    `tree_type` like the node group would be.
+
+    >>> from compiler.Parser import parser_from_src
+    >>> from compiler.typechk import TyChecker
+    >>> module = parser_from_src('''
+    ... float sdf(vec3 p, float r) { return length(p) - r; }
+    ... ''').parse()
+    >>> _ = TyChecker(module)
+    >>> kernel = compile_fn(module)
+    >>> kernel({'p': [(3.0, 4.0, 0.0), (0.0, 0.0, 1.0)], 'r': 1.0})
+    {'ret': array([4., 0.], dtype=float32)}
+    >>> print(kernel.source)
+    def kernel(n, inputs):
+        i0 = inputs['p']
+        i1 = inputs['r']
+        t0 = np.empty(n, np.float32)
+        length(i0, t0)
+        np.subtract(t0, i1, out=t0)
+        return {'ret': t0}
+    <BLANKLINE>
+    """
+    calls = CallGraph(module)
+    assert not name or name in calls.fns, f"`{name}` is not defined"
+    fn = calls.fns[name] if name else list(calls.fns.values())[-1]
+    graph = optimize(Lowering(fn, tree_type, Inliner(calls, 'ALWAYS')).lower())
+    return compile_graph(graph)
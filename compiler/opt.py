@@ -0,0 +1,22 @@
+from typing import Callable, List
+from .ir import Graph
+from .fold import fold_constants
+from .simplify import simplify
+from .cse import value_number
+from .isel import select
+from .dce import eliminate_dead_code
+
+
+passes: List[Callable[[Graph], None]] = [
+    fold_constants,
+    simplify,
+    value_number,
+    select,
+    eliminate_dead_code,
+]
+
+
+def optimize(graph: Graph) -> Graph:
+    for p in passes:
+        p(graph)
+    return graph
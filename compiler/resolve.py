@@ -0,0 +1,105 @@
+from __future__ import annotations
+from typing import Dict, Sequence
+from .Ast import *
+from .visitor import Visitor, handles
+
+
+class Resolver(Visitor):
+    def __init__(self, fn: Fn):
+        self.fn = fn
+        self.slots: Dict[str, int] = {}
+
+    def define(self, ident: Ident):
+        if ident.name in self.slots:
+            assert False, f"`{ident.name}` is already defined"
+        ident.slot = self.slots[ident.name] = len(self.fn.locals)
+        self.fn.locals.append(ident.name)
+
+    def use(self, expr: Expr):
+        # explicit stack, operator chains nest as deep as they are long
+        stack = [expr]
+        while stack:
+            stack += self.resolve_expr(stack.pop())
+
+    # `resolve_expr(expr)` resolves `expr` itself and returns its operands
+
+    @handles('resolve_expr', Ident)
+    def resolve_ident(self, expr: Ident) -> Sequence[Expr]:
+        if expr.name not in self.slots:
+            assert False, f"`{expr.name}` is not defined"
+        expr.slot = self.slots[expr.name]
+        return ()
+
+    @handles('resolve_expr', Binary)
+    def resolve_binary(self, expr: Binary) -> Sequence[Expr]:
+        return (expr.right, expr.left)
+
+    @handles('resolve_expr', Unary)
+    def resolve_unary(self, expr: Unary) -> Sequence[Expr]:
+        return (expr.expr, )
+
+    @handles('resolve_expr', Assign)
+    def resolve_assign(self, expr: Assign) -> Sequence[Expr]:
+        return (expr.init, expr.left)
+
+    @handles('resolve_expr', Call)
+    def resolve_call(self, expr: Call) -> Sequence[Expr]:
+        self.fn.calls.append(expr.name)
+        return expr.args[::-1]
+
+    @handles('resolve_expr', Field)
+    def resolve_field(self, expr: Field) -> Sequence[Expr]:
+        return (expr.name, )
+
+    @handles('resolve_expr', Int, Float)
+    def resolve_literal(self, expr: Expr) -> Sequence[Expr]:
+        return ()
+
+    @handles('resolve_expr', object)
+    def resolve_other(self, expr) -> Sequence[Expr]:
+        assert False, f"{expr}"
+
+    # `resolve_stmt(stmt)` resolves the statement `stmt.kind`
+
+    @handles('resolve_stmt', ExprStmt)
+    def resolve_expr_stmt(self, stmt: ExprStmt):
+        for expr in stmt.exprs:
+            self.use(expr)
+
+    @handles('resolve_stmt', Decl)
+    def resolve_decl(self, stmt: Decl):
+        for expr in stmt.decls.exprs:
+            match expr:
+                case Assign(Ident() as ident, init):
+                    if init:
+                        self.use(init)
+                    self.define(ident)
+                case Ident(name):
+                    assert False, f"`{name}` must be initialized"
+                case _:
+                    assert False
+
+    @handles('resolve_stmt', Return)
+    def resolve_return(self, stmt: Return):
+        self.use(stmt.expr)
+
+    @handles('resolve_stmt', object)
+    def resolve_other_stmt(self, stmt):
+        assert False, stmt
+
+
+def resolve_locals(fn: Fn):
+    """
+    Numbers the parameters and local variables of `fn` in declaration order
+    and stores the number in the `slot` of every `Ident` naming one, so
+    later passes keep variables in a list instead of looking them up by
+    name. The names by slot end up in `fn.locals`, the names of the called
+    functions in `fn.calls`.
+    """
+    fn.locals = []
+    fn.calls = []
+    resolver = Resolver(fn)
+    for arg in fn.sig.args:
+        resolver.define(arg.name)
+    for stmt in fn.body.stmts:
+        resolver.resolve_stmt(stmt.kind)
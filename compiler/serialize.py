@@ -0,0 +1,124 @@
+from __future__ import annotations
+import gzip
+import json
+from typing import Dict, List
+from .Ast import Ty, TypeKind
+from .ir import Node, Const, Input, Op, Broadcast, Extract, Group, Result, Graph
+
+# bumped whenever the layout below changes
+format_version = 1
+
+
+def group_node_type(tree_type: str) -> str:
+    match tree_type:
+        case 'ShaderNodeTree':
+            return 'ShaderNodeGroup'
+        case 'GeometryNodeTree':
+            return 'GeometryNodeGroup'
+        case _:
+            assert False, f"{tree_type}"
+
+
+def ty_of(name: str) -> Ty:
+    return Ty(TypeKind[name])
+
+
+def graph_to_dict(graph: Graph) -> Dict:
+    """
+    Describes the Blender nodes `graph` compiles to. Every node has the
+    stable `id` of `Graph.node_keys`, its `type`, `operation`, the node
+    group it instances if any, the type `ty` constant inputs are converted
+    to and one reference per enabled input. A reference is one of
+    `{"value": v}` for a constant, `{"input": name}` for a group input and
+    `{"node": id}` or `{"node": id, "output": o}` for an output of another
+    node.
+    """
+    keys = graph.node_keys()
+    nodes: List[Dict] = []
+    refs: Dict[Node, Dict] = {}
+    separates: Dict[Node, str] = {}
+
+    def ref(node: Node) -> Dict:
+        match node:
+            case Const(value):
+                return {'value': list(value) if isinstance(value, tuple) else value}
+            case _:
+                return refs[node]
+
+    for node in graph.nodes:
+        match node:
+            case Const():
+                continue
+            case Input(name):
+                refs[node] = {'input': name}
+            case Op(node_type, operation, args):
+                nodes.append({'id': keys[node], 'type': node_type, 'operation': operation,
+                              'ty': node.ty.kind.name, 'inputs': [ref(arg) for arg in args]})
+                refs[node] = {'node': keys[node]}
+            case Broadcast(arg):
+                nodes.append({'id': keys[node], 'type': 'ShaderNodeCombineXYZ', 'operation': None,
+                              'ty': None, 'inputs': [ref(arg)] * node.ty.get_size()})
+                refs[node] = {'node': keys[node]}
+            case Extract(arg, index):
+                # shared by all the components of `arg`, like in `NodeGen`
+                if arg not in separates:
+                    separates[arg] = f"{keys.get(arg, keys[node])}.separate"
+                    nodes.append({'id': separates[arg], 'type': 'ShaderNodeSeparateXYZ', 'operation': None,
+                                  'ty': None, 'inputs': [ref(arg)]})
+                refs[node] = {'node': separates[arg], 'output': index}
+            case Group(name, args):
+                nodes.append({'id': keys[node], 'type': group_node_type(graph.tree_type), 'operation': None,
+                              'group': name, 'ty': None, 'inputs': [ref(arg) for arg in args]})
+            case Result(arg, name):
+                refs[node] = {'node': keys[arg], 'output': name}
+            case _:
+                assert False, f"{node}"
+    return {
+        'name': graph.name,
+        'inputs': [
+            {'name': inp.name, 'ty': inp.ty.kind.name,
+             'default': list(inp.default) if isinstance(inp.default, tuple) else inp.default}
+            for inp in graph.inputs.values()
+        ],
+        'outputs': [
+            {'name': out.name, 'ty': out.ty.kind.name, 'value': ref(out.value) if out.value else None}
+            for out in graph.outputs.values()
+        ],
+        'nodes': nodes,
+    }
+
+
+def graphs_to_dict(graphs: List[Graph], roots: List[str], tree_type: str) -> Dict:
+    """
+    Describes a compiled module: its groups, callees first, and the names of
+    the ones instanced in the edited tree.
+    """
+    return {
+        'version': format_version,
+        'tree_type': tree_type,
+        'roots': roots,
+        'groups': [graph_to_dict(graph) for graph in graphs],
+    }
+
+
+def dump(data: Dict, path: str):
+    """Writes `data` as JSON, gzip compressed if `path` ends with `.gz`."""
+    text = json.dumps(data, separators=(',', ':'))
+    if path.endswith('.gz'):
+        with gzip.open(path, 'wt', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+def load(path: str) -> Dict:
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+    else:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    if data.get('version') != format_version:
+        assert False, f"{path}: unsupported node graph version {data.get('version')}"
+    return data
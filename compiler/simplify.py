@@ -0,0 +1,123 @@
+from __future__ import annotations
+import math
+from .Ast import Ty, TypeKind
+from .bltin import Tfloat
+from .ir import Node, Const, Op, Graph
+from .fold import FLT_EPSILON, f32
+
+
+def is_const(node: Node, value: float) -> bool:
+    match node:
+        case Const(tuple(data)):
+            return all(v == value for v in data)
+        case Const(data):
+            return data == value
+        case _:
+            return False
+
+
+def is_zero(node: Node) -> bool:
+    return is_const(node, 0.0)
+
+
+def is_one(node: Node) -> bool:
+    return is_const(node, 1.0)
+
+
+def same_shape(a: Node, b: Node) -> bool:
+    """Whether `a` can stand in for `b` without an implicit conversion."""
+    return a.ty.is_vector() == b.ty.is_vector()
+
+
+def negated(node: Node, node_type: str) -> Node | None:
+    """Returns `x` if `node` is `0 - x` computed by a `node_type` node."""
+    match node:
+        case Op(ty, 'SUBTRACT', [zero, x]) if ty == node_type and is_zero(zero):
+            return x
+    return None
+
+
+def reciprocal(node: Node) -> int | float | tuple | None:
+    """Returns `1 / node` if it is a constant and the reciprocal is exact."""
+    def exact(v: float) -> float | None:
+        if v == 0.0 or not math.isfinite(v) or abs(math.frexp(v)[0]) != 0.5:
+            return None
+        r = f32(1.0 / v)
+        return r if r != 0.0 and math.isfinite(r) else None
+
+    match node:
+        case Const(tuple(data)):
+            lanes = [exact(v) for v in data]
+            return tuple(lanes) if all(v != None for v in lanes) else None
+        case Const(data):
+            return exact(float(data))
+    return None
+
+
+def simplify(graph: Graph):
+    """
+    Applies exact algebraic identities, `x + 0`, `x - 0`, `x * 1`, `x / 1`,
+    `0 - (0 - x)`, `0 * x` for integers and absorbs negations into the
+    consuming add or subtract. Division by a power of two becomes a
+    multiplication. On geometry node trees `!=` becomes a single Compare
+    node. The number of rewrites is recorded in `graph.stats['simplify']`.
+    """
+    def op(node_type: str, operation: str, a: Node, b: Node, ty: Ty) -> Node:
+        return graph.add(Op(node_type, operation, [a, b], ty))
+
+    def rule(node: Node) -> Node:
+        match node:
+            case Op('ShaderNodeMath' | 'ShaderNodeVectorMath' as nt, operation, [a, b]):
+                pass
+            case _:
+                return node
+        match operation:
+            case 'ADD':
+                if is_zero(b) and same_shape(a, node):
+                    return a
+                if is_zero(a) and same_shape(b, node):
+                    return b
+                if (x := negated(b, nt)) and same_shape(a, node):
+                    return op(nt, 'SUBTRACT', a, x, node.ty)
+                if (x := negated(a, nt)) and same_shape(b, node):
+                    return op(nt, 'SUBTRACT', b, x, node.ty)
+            case 'SUBTRACT':
+                if is_zero(b) and same_shape(a, node):
+                    return a
+                if (x := negated(b, nt)):
+                    if is_zero(a) and same_shape(x, node):
+                        return x
+                    if not is_zero(a):
+                        return op(nt, 'ADD', a, x, node.ty)
+                if nt == 'ShaderNodeMath' and is_const(a, 1.0) and graph.tree_type == 'GeometryNodeTree':
+                    match b:
+                        case Op('ShaderNodeMath', 'COMPARE', [l, r]):
+                            # `1 - (l == r)` is `l != r`, with Compare's epsilon
+                            # matching the one Math's compare clamps to
+                            return graph.add(Op('FunctionNodeCompare', 'NOT_EQUAL',
+                                                [l, r, graph.add(Const(Tfloat, FLT_EPSILON))], node.ty))
+            case 'MULTIPLY':
+                if is_one(b) and same_shape(a, node):
+                    return a
+                if is_one(a) and same_shape(b, node):
+                    return b
+                # `0 * x` is only zero when `x` can't be infinite or NaN
+                if is_zero(b) and a.ty.kind == TypeKind.Int:
+                    return graph.add(Const(node.ty, b.value))
+                if is_zero(a) and b.ty.kind == TypeKind.Int:
+                    return graph.add(Const(node.ty, a.value))
+            case 'DIVIDE':
+                if is_one(b) and same_shape(a, node):
+                    return a
+                if (r := reciprocal(b)) != None:
+                    ty = b.ty if b.ty.is_vector() else Tfloat
+                    return op(nt, 'MULTIPLY', a, graph.add(Const(ty, r)), node.ty)
+        return node
+
+    def count(node: Node) -> Node:
+        new = rule(node)
+        if new is not node:
+            graph.stats['simplify'] = graph.stats.get('simplify', 0) + 1
+        return new
+
+    graph.rewrite(count)
@@ -1,13 +1,31 @@
 import doctest
-from typing import List, Dict
+import gc
+import mmap
+import re
+import sys
+from array import array
+from typing import Iterable, Iterator, List, Dict, Tuple
 from enum import Enum, auto
 from .Ast import TypeKind
 
 
 class Token:
-    def __init__(self, kind, value):
+    __slots__ = ('kind', 'value', 'start', 'end', 'line', 'col', )
+
+    def __init__(self, kind, value, start=0, end=0, line=1, col=1):
         self.kind = kind
         self.value = value
+        # `start` and `end` are character offsets into the source string,
+        # not byte offsets, so `src[start:end]` is the token's text even in
+        # sources with non-ASCII comments; `line` and `col` are 1-based and
+        # point at `start`
+        self.start = start
+        self.end = end
+        self.line = line
+        self.col = col
+
+    def loc(self) -> str:
+        return f"{self.line}:{self.col}"
 
 
 class TokenKind(Enum):
@@ -88,6 +106,59 @@ punc: Dict[str, TokenKind] = {
 }
 
 
+# every match is a token preceded by the whitespace before it, comments and
+# unknown characters are matched as tokens and dropped by `tokenize`
+token_re = re.compile(r"""
+    (\s*)
+    (
+        //[^\n]*
+      | \d+\.\d*\.
+      | \d+\.\d*
+      | \d+
+      | [^\W\d]\w*
+      | == | != | [(){},=;+\-*/.!]
+      | \S
+    )
+""", re.VERBOSE)
+
+# keywords and punctuation, everything else is classified by its first character
+fixed_tokens: Dict[str, TokenKind] = {**keywords, **punc}
+
+
+def classify(val: str) -> TokenKind | None:
+    """
+    The kind of a token that isn't in `fixed_tokens`, None for comments and
+    unknown characters. Scanners add the location to its error.
+
+    >>> [classify(val) for val in ('1', '1.5', '_a1', '// x', '@')]
+    [<TokenKind.IntLit: 1>, <TokenKind.FloatLit: 2>, <TokenKind.Ident: 3>, None, None]
+    >>> classify('1.0.')
+    Traceback (most recent call last):
+    ...
+    AssertionError: unexpected `.`
+    >>>
+    """
+    c = val[0]
+    if c.isdigit():
+        if val.count('.') > 1:
+            assert False, "unexpected `.`"
+        return TokenKind.FloatLit if '.' in val else TokenKind.IntLit
+    if c == '_' or c.isalpha():
+        return TokenKind.Ident
+
+
+class paused_gc:
+    """Tokens never form cycles, pausing the collector avoids rescanning them."""
+
+    def __enter__(self):
+        self.enabled = gc.isenabled()
+        gc.disable()
+
+    def __exit__(self, *_):
+        if self.enabled:
+            gc.enable()
+
+
 def tokenize(src: str) -> List[Token]:
     """
     >>> tokens = tokenize("void main()")
@@ -105,62 +176,237 @@ def tokenize(src: str) -> List[Token]:
     5
     >>> [token.kind.name for token in tokens]
     ['IntLit', 'EqEq', 'IntLit', 'NotEq', 'IntLit']
+    >>> tokens = tokenize("a = 1;\n  b = 2; // end")
+    >>> [(token.value, token.start, token.loc()) for token in tokens][3:5]
+    [(';', 5, '1:6'), ('b', 9, '2:3')]
+    >>> len(tokens)
+    8
     >>>
     """
 
     tokens: List[Token] = []
+    append = tokens.append
+    get = fixed_tokens.get
+    pos = 0
+    line = 1
+    line_start = 0
+    with paused_gc():
+        for space, val in token_re.findall(src):
+            if space:
+                if '\n' in space:
+                    line += space.count('\n')
+                    line_start = pos + space.rindex('\n') + 1
+                pos += len(space)
+            begin = pos
+            pos += len(val)
+            kind = get(val)
+            if kind is None:
+                try:
+                    kind = classify(val)
+                except AssertionError as e:
+                    assert False, f"{line}:{begin - line_start + 1}: {e}"
+                if kind is None:
+                    continue
+            append(Token(kind, val, begin, pos, line, begin - line_start + 1))
+
+    return tokens
+
+
+# the same tokens without the leading whitespace, for scanning with `finditer`
+bare_token_re = re.compile(token_re.pattern.replace(r"(\s*)", "", 1), re.VERBOSE)
+
+# `TokenKind` by value, `TokenBuffer` stores kinds as their value
+token_kinds: List[TokenKind | None] = [None] * (max(kind.value for kind in TokenKind) + 1)
+for kind in TokenKind:
+    token_kinds[kind.value] = kind
+
+
+class TokenBuffer:
+    """
+    A token stream stored as parallel arrays, one byte for the kind and the
+    start and end character offsets into the source. Text is only sliced out of the
+    source when asked for, identifiers are interned.
+
+    >>> tokens = TokenBuffer("vec3 p = v.x; // end")
+    >>> len(tokens)
+    7
+    >>> [tokens.kind(i).name for i in range(len(tokens))]
+    ['Vec3', 'Ident', 'Eq', 'Ident', 'Period', 'Ident', 'Semi']
+    >>> tokens.text(3), tokens.loc(3)
+    ('v', '1:10')
+    >>> TokenBuffer("1.0.").kinds
+    Traceback (most recent call last):
+    ...
+    AssertionError: 1:1: unexpected `.`
+    >>>
+    """
+
+    def __init__(self, src: str):
+        self.src = src
+        self.kinds = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        add_kind = self.kinds.append
+        add_start = self.starts.append
+        add_end = self.ends.append
+        get = {text: kind.value for text, kind in fixed_tokens.items()}.get
+        for m in bare_token_re.finditer(src):
+            val = m.group()
+            kind = get(val)
+            if kind is None:
+                try:
+                    other = classify(val)
+                except AssertionError as e:
+                    assert False, f"{self.loc_of(m.start())}: {e}"
+                if other is None:
+                    continue
+                kind = other.value
+            start, end = m.span()
+            add_kind(kind)
+            add_start(start)
+            add_end(end)
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def kind(self, i: int) -> TokenKind | None:
+        if i < len(self.kinds):
+            return token_kinds[self.kinds[i]]
 
-    def add_token(kind: TokenKind, begin: int, end: int):
-        val: str = src[begin:end]
-        if kind == TokenKind.Ident and val in keywords:
-            kind = keywords[val]
-        tokens.append(Token(kind, val))
-
-    i = 0
-    while i < len(src):
-        c = src[i]
-        if c.isspace():
-            i += 1
-        elif c.isalpha() or c == '_':
-            begin = i
-            while i < len(src) and (src[i].isalnum() or src[i] == '_'):
-                i += 1
-            add_token(TokenKind.Ident, begin, i)
-        elif c.isdigit():
-            begin = i
-            is_float = False
-            while i < len(src) and (src[i].isdigit() or src[i] == '.'):
-                if src[i] == '.':
-                    if not is_float:
-                        is_float = True
-                    else:
-                        assert False, "unexpected `.`"
-                i += 1
-            add_token(
-                TokenKind.FloatLit if is_float else TokenKind.IntLit, begin, i)
-        elif c in punc:
-            if c == '/' and src[i + 1] == '/':
-                while src[i] != '\n':
-                    i += 1
-                continue
-            i += 1
-            prev = c
-            if i >= len(src):
-                add_token(punc[prev], i - 1, i)
-                break
-
-            c = src[i]
-            comp = prev + c
-            if comp in punc:
-                add_token(punc[comp], i - 1, i + 1)
+    def text(self, i: int) -> str:
+        text = self.src[self.starts[i]:self.ends[i]]
+        if self.kinds[i] == TokenKind.Ident.value:
+            return sys.intern(text)
+        return text
+
+    def loc_of(self, offset: int) -> str:
+        # only needed for error messages, so lines aren't tracked while scanning
+        line = self.src.count('\n', 0, offset) + 1
+        col = offset - self.src.rfind('\n', 0, offset)
+        return f"{line}:{col}"
+
+    def loc(self, i: int) -> str:
+        return self.loc_of(self.starts[i]) if i < len(self.kinds) else "eof"
+
+
+# (kind, text, character offset, line, column)
+StreamToken = Tuple[TokenKind, str, int, int, int]
+
+
+def scan_lines(lines: Iterable[str], line: int = 1) -> Iterator[StreamToken]:
+    """
+    Tokenizes the source one line at a time, no token spans a line break.
+    `line` is the number of the first line, offsets count from its start.
+
+    >>> tokens = list(scan_lines(["int a; // x", "  a = 1.5;"]))
+    >>> [(kind.name, text, line, col) for kind, text, _, line, col in tokens][3:6]
+    [('Ident', 'a', 2, 3), ('Eq', '=', 2, 5), ('FloatLit', '1.5', 2, 7)]
+    >>> tokens[3][2]
+    14
+    >>> [(text, offset, line) for _, text, offset, line, _ in scan_lines(["a\n", "b"], 5)]
+    [('a', 0, 5), ('b', 2, 6)]
+    >>>
+    """
+    get = fixed_tokens.get
+    offset = 0
+    for line, src in enumerate(lines, line):
+        for m in bare_token_re.finditer(src):
+            val = m.group()
+            kind = get(val)
+            if kind is None:
+                try:
+                    kind = classify(val)
+                except AssertionError as e:
+                    assert False, f"{line}:{m.start() + 1}: {e}"
+                if kind is None:
+                    continue
+                if kind == TokenKind.Ident:
+                    val = sys.intern(val)
+            yield kind, val, offset + m.start(), line, m.start() + 1
+        offset += len(src) if src.endswith('\n') else len(src) + 1
+
+
+def mapped_lines(mm: mmap.mmap) -> Iterator[str]:
+    """The lines of a memory-mapped file from its start, decoded one at a time."""
+    mm.seek(0)
+    return (line.decode() for line in iter(mm.readline, b''))
+
+
+def scan_file(filepath: str) -> Iterator[StreamToken]:
+    """
+    Tokenizes a memory-mapped file, reading it one line at a time.
+
+    >>> import os, tempfile
+    >>> fd, path = tempfile.mkstemp()
+    >>> with os.fdopen(fd, 'w', encoding='utf-8') as f:
+    ...     _ = f.write("// \u00e9\nvec3 p;\n")
+    >>> [(kind.name, text, line, col) for kind, text, _, line, col in scan_file(path)]
+    [('Vec3', 'vec3', 2, 1), ('Ident', 'p', 2, 6), ('Semi', ';', 2, 7)]
+    >>> open(path, 'w').close()
+    >>> list(scan_file(path))
+    []
+    >>> os.remove(path)
+    >>>
+    """
+    with open(filepath, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            yield from scan_lines(mapped_lines(mm))
+
+
+class TokenStream:
+    """
+    Pulls tokens from a generator as the parser advances, only the last
+    `size` tokens are kept.
+
+    >>> tokens = TokenStream(scan_lines(["a.x"]))
+    >>> tokens.kind(1).name, tokens.text(2), tokens.loc(2), tokens.kind(3)
+    ('Period', 'x', '1:3', None)
+    >>> tokens = TokenStream(scan_lines(["a + b", "+ c + d"]))
+    >>> tokens.text(6), tokens.loc(6), tokens.text(3), tokens.loc(3)
+    ('d', '2:7', '+', '2:1')
+    >>> tokens.text(2)
+    Traceback (most recent call last):
+    ...
+    AssertionError: token 2 is no longer buffered
+    >>>
+    """
+
+    # a power of two, enough for the current token and one of lookahead
+    size = 4
+
+    def __init__(self, tokens: Iterator[StreamToken]):
+        self.tokens = tokens
+        self.ring: List[StreamToken | None] = [None] * self.size
+        # number of tokens pulled from the generator so far
+        self.pulled = 0
+
+    def get(self, i: int) -> StreamToken | None:
+        if i >= self.pulled:
+            for token in self.tokens:
+                self.ring[self.pulled & (self.size - 1)] = token
+                self.pulled += 1
+                if self.pulled > i:
+                    break
             else:
-                i -= 1
-                add_token(punc[prev], i, i + 1)
-            i += 1
-        else:
-            i += 1
+                return None
+        assert i >= self.pulled - self.size, f"token {i} is no longer buffered"
+        return self.ring[i & (self.size - 1)]
 
-    return tokens
+    def kind(self, i: int) -> TokenKind | None:
+        if token := self.get(i):
+            return token[0]
+
+    def text(self, i: int) -> str:
+        token = self.get(i)
+        assert token, "unexpected eof"
+        return token[1]
+
+    def loc(self, i: int) -> str:
+        if token := self.get(i):
+            return f"{token[3]}:{token[4]}"
+        return "eof"
 
 
 doctest.testfile("tokenizer.py", globs=globals())
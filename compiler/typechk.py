@@ -1,39 +1,30 @@
 from __future__ import annotations
-from typing import Dict
+from typing import Dict, List, Set
 from .Ast import *
 from .bltin import *
+from .resolve import resolve_locals
+from .visitor import Visitor, handles
 
 
 class TyEnv:
-    def __init__(self, paren_env: TyEnv | None = None) -> None:
-        self.parent: TyEnv | None = paren_env
-        self.bindings: Dict[str, Ty] = {}
+    def __init__(self) -> None:
         self.fns: Dict[str, FnSig] = {}
-        self.ctx: FnSig | None = None
 
     def def_fn(self, name: str, fn: FnSig):
         if name in self.fns:
             assert False, f"`{name}` is already defined"
         self.fns[name] = fn
 
-    def bind(self, name: str, ty: Ty):
-        if name in self.bindings:
-            assert False, f"`{name}` is already defined"
-        self.bindings[name] = ty
-
-    def get(self, name: str) -> Ty | None:
-        if name in self.bindings:
-            return self.bindings[name]
-        elif self.parent:
-            return self.parent.get(name)
-
 
-class TyChecker:
-    def __init__(self, module: Module) -> None:
+class TyChecker(Visitor):
+    def __init__(self, module: Module, only: Set[str] | None = None) -> None:
         self.module = module
         self.ty_env = TyEnv()
         self.fn: FnSig | None = None
-        self._check()
+        # types and constness of the variables of the current function by slot
+        self.tys: List[Ty | None] = []
+        self.consts: List[bool] = []
+        self._check(only)
 
     def assert_eq(self, ty: Ty, kind: TypeKind) -> bool:
         if ty.kind == kind:
@@ -41,207 +32,253 @@ class TyChecker:
         else:
             assert False, f"expected `{ty.display_name()}` found `{kind.display_name()}`"
 
-    def find_var(self, name: str) -> Ty:
-        ty = self.ty_env.get(name)
-        if ty:
-            return ty
-        else:
-            assert False, f"`{name}` is not defined"
+    def bind(self, ident: Ident, ty: Ty, const: bool = False):
+        self.tys[ident.slot] = ty  # type: ignore
+        self.consts[ident.slot] = const  # type: ignore
+
+    def find_var(self, ident: Ident) -> Ty:
+        ty = self.tys[ident.slot]  # type: ignore
+        assert ty, f"`{ident.name}` is not defined"
+        return ty
+
+    def assert_mutable(self, expr: Expr):
+        match expr:
+            case Ident(name):
+                if self.consts[expr.slot]:  # type: ignore
+                    assert False, f"cannot assign to const `{name}`"
 
     def expect_ty(self, expected_ty: Ty, found_ty: Ty):
         return f"expected `{expected_ty.display_name()}` found `{found_ty.display_name()}`"
 
-    def check(self, expr: Expr, expected_ty: Ty):
-        match expr.kind:
-            case Assign(left, init):
-                self.check(init, expected_ty)
-            case Int():
-                self.assert_eq(expected_ty, TypeKind.Int)
-            case Float():
-                self.assert_eq(expected_ty, TypeKind.Float)
-            case Ident(name):
-                ty = self.find_var(name)
-                self.assert_eq(expected_ty, ty.kind)
-                expr.kind.ty = expected_ty
-            case Binary(left, right, kind):
-                left_ty = self.infer(left)
-                right_ty = self.infer(right)
-                match left_ty.is_vector(), right_ty.is_vector():
-                    case True, True:
-                        assert left_ty == right_ty, f"`{kind}` is not implemented for `{left_ty.display_name()}` and `{right_ty.display_name()}`"
-                        match kind:
-                            case BinaryKind.Eq | BinaryKind.NotEq:
-                                self.expect_ty(expected_ty, Ty(TypeKind.Int))
-                            case _:
-                                self.expect_ty(expected_ty, left_ty)
-                    case True, False:
-                        assert expected_ty == left_ty, self.expect_ty(
-                            expected_ty, left_ty)
-                    case False, True:
-                        assert expected_ty == right_ty, self.expect_ty(
-                            expected_ty, right_ty)
-                    case _, _:
-                        pass
-                expr.kind.ty = expected_ty
-            case Call(name, args):
-                if name in builtins:
-                    fns = builtins[name]
-                    matches = False
-
-                    i = 0
-                    for i, fn in enumerate(fns):
-                        if len(args) != len(fn.args):
-                            continue
-
-                        args_match = 0
-                        for arg, exp_ty in zip(args, fn.args):
-                            args_match += self.infer(arg) == exp_ty
-
-                        if args_match != len(args):
-                            continue
-                        if expected_ty != fn.ret_ty:
-                            continue
-
-                        matches = True
-                        break
-
-                    if not matches:
-                        assert False, f"no matching function call for `{name}`"
-                    expr.kind.sig = i
-
-                elif name in self.ty_env.fns:
-                    print("fn:", self.ty_env.fns[name])
-                    assert False
-            case Field(Ident(name), Ident(field)):
-                var = self.find_var(name)
-                match var.kind:
-                    case TypeKind.Int | TypeKind.Float:
-                        assert False, f"`{var.kind.name.lower()}` has no field `{field}`"
-                    case TypeKind.Vec2:
-                        if field not in {'x', 'y'}:
-                            assert False, f"`vec2` has no field `{field}`"
-                        self.expect_ty(expected_ty, Tfloat)
-                    case TypeKind.Vec3:
-                        if field not in {'x', 'y', 'z'}:
-                            assert False, f"`vec3` has no field `{field}`"
-                        self.expect_ty(expected_ty, Tfloat)
+    # `check(expr, expected_ty)` checks `expr` against an expected type
+
+    @handles('check', Assign)
+    def check_assign(self, expr: Assign, expected_ty: Ty):
+        self.assert_mutable(expr.left)
+        self.check(expr.init, expected_ty)
+
+    @handles('check', Int)
+    def check_int(self, expr: Int, expected_ty: Ty):
+        self.assert_eq(expected_ty, TypeKind.Int)
+
+    @handles('check', Float)
+    def check_float(self, expr: Float, expected_ty: Ty):
+        self.assert_eq(expected_ty, TypeKind.Float)
+
+    @handles('check', Ident)
+    def check_ident(self, expr: Ident, expected_ty: Ty):
+        ty = self.find_var(expr)
+        self.assert_eq(expected_ty, ty.kind)
+        expr.ty = expected_ty
+
+    @handles('check', Binary)
+    def check_binary(self, expr: Binary, expected_ty: Ty):
+        kind = expr.op
+        left_ty = self.infer(expr.left)
+        right_ty = self.infer(expr.right)
+        match left_ty.is_vector(), right_ty.is_vector():
+            case True, True:
+                assert left_ty == right_ty, f"`{kind}` is not implemented for `{left_ty.display_name()}` and `{right_ty.display_name()}`"
+                match kind:
+                    case BinaryKind.Eq | BinaryKind.NotEq:
+                        self.expect_ty(expected_ty, Ty(TypeKind.Int))
                     case _:
-                        assert False
-            case Unary(_, expr):
-                self.expect_ty(expected_ty, self.infer(expr))
-            case _:
-                assert False, f"{expr.kind}"
+                        self.expect_ty(expected_ty, left_ty)
+            case True, False:
+                assert expected_ty == left_ty, self.expect_ty(
+                    expected_ty, left_ty)
+            case False, True:
+                assert expected_ty == right_ty, self.expect_ty(
+                    expected_ty, right_ty)
+            case _, _:
+                pass
+        expr.ty = expected_ty
+
+    @handles('check', Call)
+    def check_call(self, expr: Call, expected_ty: Ty):
+        name = expr.name
+        if name in builtins:
+            match resolve(name, [self.infer(arg) for arg in expr.args]):
+                case (i, ret_ty) if ret_ty == expected_ty:
+                    expr.sig = i
+                case _:
+                    assert False, f"no matching function call for `{name}`"
+
+        elif name in self.ty_env.fns:
+            ret_ty = self.check_user_call(expr)
+            assert ret_ty == expected_ty, self.expect_ty(expected_ty, ret_ty)
+        else:
+            assert False, f"`{name}` is not defined"
+
+    def check_user_call(self, expr: Call) -> Ty:
+        sig = self.ty_env.fns[expr.name]
+        if len(expr.args) != len(sig.args):
+            assert False, f"`{expr.name}` takes {len(sig.args)} arguments, found {len(expr.args)}"
+        for arg, param in zip(expr.args, sig.args):
+            if any(qual.is_output() for qual in param.ty_qualifiers):
+                if not isinstance(arg, Ident):
+                    assert False, f"argument `{param.name.name}` of `{expr.name}` has to be a variable"
+                self.assert_mutable(arg)
+            self.check(arg, param.ty)
+        return sig.ret_ty
+
+    @handles('check', Field)
+    def check_field(self, expr: Field, expected_ty: Ty):
+        self.expect_ty(expected_ty, self.infer_field(expr))
+
+    @handles('check', Unary)
+    def check_unary(self, expr: Unary, expected_ty: Ty):
+        self.expect_ty(expected_ty, self.infer(expr.expr))
+
+    @handles('check', object)
+    def check_other(self, expr: Expr, expected_ty: Ty):
+        assert False, f"{expr}"
 
     def infer(self, expr: Expr) -> Ty:
-        match expr.kind:
-            case Assign(left, init):
-                ty = self.infer(left)
-                self.check(init, ty)
-                return Ty(TypeKind.Void)
-            case Int():
-                return Ty(TypeKind.Int)
-            case Float():
-                return Ty(TypeKind.Float)
-            case Ident(name):
-                return self.find_var(name)
-            case Binary(left, right, kind):
-                left_ty = self.infer(left)
-                right_ty = self.infer(right)
-                if left_ty.is_vector() and right_ty.is_vector():
-                    assert left_ty == right_ty, f"`{kind}` is not implemented for `{left_ty.display_name()}` and `{right_ty.display_name()}`"
-                if left_ty.is_vector():
-                    expr.kind.ty = left_ty
-                    return left_ty
-                else:
-                    expr.kind.ty = right_ty
-                    return right_ty
-            case Call(name, args):
-                if name in builtins:
-                    fns = builtins[name]
-                    matches = False
-
-                    i = 0
-                    for i, fn in enumerate(fns):
-                        if len(args) != len(fn.args):
-                            continue
-
-                        args_match = 0
-                        for arg, exp_ty in zip(args, fn.args):
-                            args_match += self.infer(arg) == exp_ty
-
-                        if args_match != len(args):
-                            continue
-
-                        matches = True
-                        break
-
-                    if not matches:
-                        assert False, f"no matching function call for `{name}`"
-                    expr.kind.sig = i
-                    return fns[i].ret_ty
-
-                elif name in self.ty_env.fns:
-                    print("fn:", self.ty_env.fns[name])
-                    assert False
-                else:
-                    assert False, name
-            case Field(Ident(name), Ident(field)):
-                var = self.find_var(name)
-                match var.kind:
-                    case TypeKind.Int | TypeKind.Float:
-                        assert False, f"`{var.kind.name.lower()}` has no field `{field}`"
-                    case TypeKind.Vec2:
-                        if field not in {'x', 'y'}:
-                            assert False, f"`vec2` has no field `{field}`"
-                        return Tfloat
-                    case TypeKind.Vec3:
-                        if field not in {'x', 'y', 'z'}:
-                            assert False, f"`vec3` has no field `{field}`"
-                        return Tfloat
-                assert False
-            case Unary(_, expr):
-                return self.infer(expr)
-            case _:
-                assert False, type(expr.kind)
+        if expr.ty is None:
+            # operator chains nest to the left as deep as they are long, infer
+            # the left spine bottom up so each step finds its left operand cached
+            spine: List[Expr] = []
+            left = expr
+            while isinstance(left, Binary) and left.ty is None:
+                spine.append(left)
+                left = left.left
+            for operand in reversed(spine[1:]):
+                operand.ty = self.infer_expr(operand)
+            expr.ty = self.infer_expr(expr)
+        return expr.ty
+
+    # `infer_expr(expr)` computes the type of `expr`, use `infer` for the cached one
+
+    @handles('infer_expr', Assign)
+    def infer_assign(self, expr: Assign) -> Ty:
+        self.assert_mutable(expr.left)
+        ty = self.infer(expr.left)
+        self.check(expr.init, ty)
+        return Ty(TypeKind.Void)
+
+    @handles('infer_expr', Int)
+    def infer_int(self, expr: Int) -> Ty:
+        return Ty(TypeKind.Int)
+
+    @handles('infer_expr', Float)
+    def infer_float(self, expr: Float) -> Ty:
+        return Ty(TypeKind.Float)
+
+    @handles('infer_expr', Ident)
+    def infer_ident(self, expr: Ident) -> Ty:
+        return self.find_var(expr)
+
+    @handles('infer_expr', Binary)
+    def infer_binary(self, expr: Binary) -> Ty:
+        left_ty = self.infer(expr.left)
+        right_ty = self.infer(expr.right)
+        if left_ty.is_vector() and right_ty.is_vector():
+            assert left_ty == right_ty, f"`{expr.op}` is not implemented for `{left_ty.display_name()}` and `{right_ty.display_name()}`"
+        if left_ty.is_vector():
+            return left_ty
+        else:
+            return right_ty
+
+    @handles('infer_expr', Call)
+    def infer_call(self, expr: Call) -> Ty:
+        name = expr.name
+        if name in builtins:
+            match resolve(name, [self.infer(arg) for arg in expr.args]):
+                case (i, ret_ty):
+                    expr.sig = i
+                    return ret_ty
+                case _:
+                    assert False, f"no matching function call for `{name}`"
+
+        elif name in self.ty_env.fns:
+            return self.check_user_call(expr)
+        else:
+            assert False, f"`{name}` is not defined"
+
+    @handles('infer_expr', Field)
+    def infer_field(self, expr: Field) -> Ty:
+        var = self.find_var(expr.name)
+        field = expr.field.name
+        match var.kind:
+            case TypeKind.Int | TypeKind.Float:
+                assert False, f"`{var.kind.name.lower()}` has no field `{field}`"
+            case TypeKind.Vec2:
+                if field not in {'x', 'y'}:
+                    assert False, f"`vec2` has no field `{field}`"
+                return Tfloat
+            case TypeKind.Vec3:
+                if field not in {'x', 'y', 'z'}:
+                    assert False, f"`vec3` has no field `{field}`"
+                return Tfloat
+        assert False
+
+    @handles('infer_expr', Unary)
+    def infer_unary(self, expr: Unary) -> Ty:
+        return self.infer(expr.expr)
+
+    @handles('infer_expr', object)
+    def infer_other(self, expr: Expr) -> Ty:
+        assert False, type(expr)
+
+    # `visit_stmt(stmt)` checks the statement `stmt.kind`
 
     def visit_stmt(self, stmt: Stmt):
-        match stmt.kind:
-            case ExprStmt(exprs):
-                for expr in exprs:
-                    self.infer(expr)
-            case Decl(ty, exprs):
-                for expr in exprs.exprs:
-                    match expr.kind:
-                        case Assign(Expr(Ident(name)), init):
-                            self.ty_env.bind(name, ty)
-                            if init:
-                                self.check(init, ty)
-                        case _:
-                            assert False
-            case Return(expr):
-                assert self.fn != None
-                self.check(expr, self.fn.ret_ty)
-            case _:
-                assert False, stmt.kind
+        self.check_stmt(stmt.kind)
+
+    @handles('check_stmt', ExprStmt)
+    def check_expr_stmt(self, stmt: ExprStmt):
+        for expr in stmt.exprs:
+            self.infer(expr)
+
+    @handles('check_stmt', Decl)
+    def check_decl(self, stmt: Decl):
+        for qual in stmt.ty_qualifiers:
+            if not qual.is_const():
+                assert False, "only `const` is allowed on local variables"
+        for expr in stmt.decls.exprs:
+            match expr:
+                case Assign(Ident() as ident, init):
+                    self.bind(ident, stmt.ty, stmt.is_const())
+                    if init:
+                        self.check(init, stmt.ty)
+                case _:
+                    assert False
+
+    @handles('check_stmt', Return)
+    def check_return(self, stmt: Return):
+        assert self.fn != None
+        self.check(stmt.expr, self.fn.ret_ty)
+
+    @handles('check_stmt', object)
+    def check_other_stmt(self, stmt):
+        assert False, stmt
 
     def visit_block(self, block: Block):
-        tmp_env = self.ty_env
-        self.ty_env = TyEnv(tmp_env)
-        if fn := tmp_env.ctx:
-            for arg in fn.args:
-                match arg:
-                    case FnArg(Ident(name), ty, _):
-                        self.ty_env.bind(name, ty)
-        tmp_env.ctx = None
         for stmt in block.stmts:
             self.visit_stmt(stmt)
-        self.ty_env = tmp_env
 
-    def _check(self):
+    def visit_fn(self, fn: Fn):
+        resolve_locals(fn)
+        self.fn = fn.sig
+        self.tys = [None] * len(fn.locals)
+        self.consts = [False] * len(fn.locals)
+        for arg in fn.sig.args:
+            match arg:
+                case FnArg(ident, ty, ty_qualifiers):
+                    self.bind(ident, ty, any(qual.is_const() for qual in ty_qualifiers))
+        self.visit_block(fn.body)
+
+    def _check(self, only: Set[str] | None):
+        # every function is defined before any body is checked, so calls
+        # don't depend on the order of definitions, but only the bodies in
+        # `only` are checked
+        fns: List[Fn] = []
         for deff in self.module.defs:
             match deff.kind:
-                case Fn(Ident(name), sig, body):
-                    self.ty_env.ctx = sig
-                    self.fn = sig
+                case Fn(Ident(name), sig) as fn:
                     self.ty_env.def_fn(name, sig)
-                    self.visit_block(body)
+                    fns.append(fn)
+        for fn in fns:
+            if only is None or fn.name.name in only:
+                self.visit_fn(fn)
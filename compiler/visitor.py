@@ -0,0 +1,68 @@
+from __future__ import annotations
+from typing import Callable, Dict
+
+
+def handles(method: str, *classes: type) -> Callable:
+    """
+    Registers the decorated function as the implementation of the visitor
+    method `method` for nodes of the given classes.
+    """
+    def register(fn: Callable) -> Callable:
+        fn.handles = getattr(fn, 'handles', ()) + ((method, classes), )  # type: ignore
+        return fn
+    return register
+
+
+def dispatcher(method: str, table: Dict[type, Callable]) -> Callable:
+    def dispatch(self, node, *args):
+        try:
+            fn = table[type(node)]
+        except KeyError:
+            # a subclass or a node without a handler, cache what the MRO finds
+            fn = next((table[cls] for cls in type(node).__mro__ if cls in table), None)
+            assert fn, f"`{method}` is not implemented for `{type(node).__name__}`"
+            table[type(node)] = fn
+        return fn(self, node, *args)
+    dispatch.__name__ = method
+    return dispatch
+
+
+class Visitor:
+    """
+    Base class of the compiler passes. Methods registered with `handles`
+    are collected into one dispatch table per visitor method when the
+    subclass is created, calling the method looks up the handler by the
+    exact class of the node instead of trying patterns one by one.
+    Registering a handler for `object` provides a fallback.
+
+    >>> class Size(Visitor):
+    ...     @handles('size', int)
+    ...     def size_int(self, node):
+    ...         return 1
+    ...     @handles('size', list, tuple)
+    ...     def size_seq(self, node):
+    ...         return sum(self.size(item) for item in node)
+    >>> Size().size([1, (2, 3), [4]])
+    4
+    >>> Size().size(True)
+    1
+    >>> Size().size('a')
+    Traceback (most recent call last):
+    ...
+    AssertionError: `size` is not implemented for `str`
+    >>>
+    """
+
+    tables: Dict[str, Dict[type, Callable]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        tables = {method: dict(table) for method, table in cls.tables.items()}
+        for fn in vars(cls).values():
+            for method, classes in getattr(fn, 'handles', ()):
+                table = tables.setdefault(method, {})
+                for node_cls in classes:
+                    table[node_cls] = fn
+        cls.tables = tables
+        for method, table in tables.items():
+            setattr(cls, method, dispatcher(method, table))
@@ -2,6 +2,16 @@ from __future__ import annotations
 import bpy
 from .Ast import TypeKind, Ty
 from enum import Enum, auto
+from typing import Dict, List, Set, Tuple
+
+# marks the node groups generated by the compiler
+owner_prop = 'blsl'
+# cache key of the source a group was last generated from, see `compile_cached`
+source_prop = 'blsl_source'
+# prefix of the names of generated nodes, see `Graph.node_keys`
+key_prefix = 'blsl.'
+# casts are named after the socket they convert
+cast_prefix = key_prefix + 'cast.'
 
 
 class ValueKind(Enum):
@@ -31,70 +41,167 @@ def align(l):
 
 
 class NodeTree:
-    def __init__(self, name: str, ty: str):
-        if tree := bpy.data.node_groups.get(name):
-            bpy.data.node_groups.remove(tree)
+    """
+    A node group generated by the compiler. An existing group of the same
+    name is patched in place: nodes are looked up by the stable names the
+    compiler gives them, links and default values are only written when
+    they differ and `prune` removes what the new graph no longer has. This
+    keeps recompiles from invalidating everything that depends on the group.
+    """
+
+    def __init__(self, name: str, ty: str, keys: Set[str] | None = None):
         self.tree_type = ty
-        self._nt = bpy.data.node_groups.new(type=ty, name=name)
+        self._nt = bpy.data.node_groups.get(name)
+        if self._nt and self._nt.bl_idname != ty:
+            bpy.data.node_groups.remove(self._nt)
+            self._nt = None
+        if not self._nt:
+            self._nt = bpy.data.node_groups.new(type=ty, name=name)
+        elif not self._nt.get(owner_prop):
+            # not generated by the compiler, its nodes can't be matched
+            self._nt.nodes.clear()
+            self._nt.inputs.clear()
+            self._nt.outputs.clear()
+        self._nt[owner_prop] = True
+        self._casts: Dict[Tuple[int, int], bpy.types.NodeSocket] = {}
+        # generated nodes of the previous compile by name, see `add_node`
+        self._old = {node.name: node for node in self._nt.nodes if node.name.startswith(key_prefix)}
+        self._used: Set[str] = set()
+        # old nodes the new graph has no key for, reused by type
+        self._spare: Dict[str, List[bpy.types.Node]] = {}
+        for node_name, node in self._old.items():
+            if (keys is None or node_name not in keys) and not node_name.startswith(cast_prefix):
+                self._spare.setdefault(node.bl_idname, []).append(node)
+        self.stats = {'added': 0, 'reused': 0, 'removed': 0, 'relinked': 0}
         self._ins = NodeTreeInputs(self)
         self._outs = NodeTreeOutputs(self)
 
-    def add_node(self, ty) -> bpy.types.Node:
+    def add_node(self, ty, key: str | None = None) -> bpy.types.Node:
+        """
+        Adds a node of type `ty`. With a `key` the node of the previous
+        compile with that name is returned instead, or else a leftover one
+        of the same type, renamed.
+        """
+        if key:
+            node = self._old.get(key)
+            if node and node.bl_idname == ty and key not in self._used:
+                self._used.add(key)
+                self.stats['reused'] += 1
+                return node
+            if node and node.bl_idname != ty:
+                # free the name for the replacement
+                del self._old[key]
+                self._nt.nodes.remove(node)
+                self.stats['removed'] += 1
+            if self._spare.get(ty):
+                node = self._spare[ty].pop()
+                node.name = key
+                self._used.add(node.name)
+                for inp in node.inputs:
+                    if inp.links:
+                        self._nt.links.remove(inp.links[0])
+                reset_defaults(node)
+                self.stats['reused'] += 1
+                return node
         node = self._nt.nodes.new(type=ty)
-        for inp in node.inputs:
-            if type(inp) == bpy.types.NodeSocketVirtual:
-                continue
-            match inp.default_value:
-                case float():
-                    inp.default_value = 0.0
+        reset_defaults(node)
+        if key:
+            node.name = key
+            self._used.add(node.name)
+        self.stats['added'] += 1
         return node
 
-    def add_group(self) -> bpy.types.Node:
+    def find_node(self, ty: str) -> bpy.types.Node | None:
+        return next((node for node in self._nt.nodes if node.bl_idname == ty), None)
+
+    def prune(self):
+        """Removes the generated nodes and sockets that weren't used again."""
+        for name, node in self._old.items():
+            if name not in self._used and node.name not in self._used:
+                self._nt.nodes.remove(node)
+                self.stats['removed'] += 1
+        self._ins.prune()
+        self._outs.prune()
+
+    def add_group(self, key: str | None = None) -> bpy.types.Node:
         match self.tree_type:
             case 'ShaderNodeTree':
-                return self.add_node('ShaderNodeGroup')
+                return self.add_node('ShaderNodeGroup', key)
             case 'GeometryNodeTree':
-                return self.add_node('GeometryNodeGroup')
+                return self.add_node('GeometryNodeGroup', key)
             case _:
                 assert False, f"{self.tree_type}"
 
-    def add_input(self, name: str, ty: TypeKind) -> bpy.types.NodeSocket:
-        return self._ins.add_sock(name, ty)
+    def add_input(self, name: str, ty: TypeKind, default=None) -> bpy.types.NodeSocket:
+        return self._ins.add_sock(name, ty, default)
 
     def add_output(self, name: str, ty: TypeKind) -> bpy.types.NodeSocket:
         return self._outs.add_sock(name, ty)
 
     def link_to_output(self, name: str, sock: bpy.types.NodeSocket):
-        to = self._outs.get(name)
-        self._nt.links.new(sock, to)
+        self.link(sock, self._outs.get(name))
+
+    def unlink(self, to: bpy.types.NodeSocket):
+        if to.links:
+            self._nt.links.remove(to.links[0])
+            self.stats['relinked'] += 1
+
+    def set_default(self, to: bpy.types.NodeSocket, value):
+        # comparing first, writing an equal value still tags the tree as changed
+        match value:
+            case list():
+                if list(to.default_value) != value:
+                    to.default_value = value
+            case _:
+                if to.default_value != value:
+                    to.default_value = value
 
     def link(self, from_: Value | bpy.types.NodeSocket, to: bpy.types.NodeSocket, ty: Ty | None = None):
         match from_:
             case Value(kind, data):
-                if to.links:
-                    self._nt.links.remove(to.links[0])
+                self.unlink(to)
                 match kind:
                     case ValueKind.Int | ValueKind.Float:
                         if to.type == 'VECTOR':
                             if ty and ty.is_vector():
-                                to.default_value = align(
-                                    [data] * ty.get_size())
+                                self.set_default(to, align([data] * ty.get_size()))
                             else:
-                                to.default_value = [data] * 3
+                                self.set_default(to, [data] * 3)
+                        elif to.type == 'INT':
+                            self.set_default(to, int(data))
+                        else:
+                            self.set_default(to, data)
+                    case ValueKind.Vector2 | ValueKind.Vector3 | ValueKind.Vector4:
+                        if to.type == 'VECTOR':
+                            self.set_default(to, list(data))
                         else:
-                            to.default_value = data
+                            self.set_default(to, sum(data) / 3)
                     case _:
                         assert False, kind
             case sock:
                 match sock.type, to.type:
                     case 'VALUE', 'VECTOR':
-                        cast = self.add_node('ShaderNodeCombineXYZ')
-                        if ty and ty.is_vector():
-                            for i in range(ty.get_size()):
-                                self._nt.links.new(from_, cast.inputs[i])
-                        from_ = cast.outputs[0]
+                        size = ty.get_size() if ty and ty.is_vector() else 0
+                        key = (sock.as_pointer(), size)
+                        if key not in self._casts:
+                            cast = self.add_node('ShaderNodeCombineXYZ', f"{cast_prefix}{sock.node.name}.{sock.identifier}.{size}")
+                            for i in range(size):
+                                self.link(from_, cast.inputs[i])
+                            self._casts[key] = cast.outputs[0]
+                        from_ = self._casts[key]
+
+                if not (to.links and to.links[0].from_socket == from_):
+                    self._nt.links.new(from_, to)
+                    self.stats['relinked'] += 1
+
 
-                self._nt.links.new(from_, to)
+def reset_defaults(node: bpy.types.Node):
+    for inp in node.inputs:
+        if type(inp) == bpy.types.NodeSocketVirtual:
+            continue
+        match inp.default_value:
+            case float():
+                inp.default_value = 0.0
 
 
 def get_blender_socket_type(ty: TypeKind) -> str:
@@ -109,27 +216,56 @@ def get_blender_socket_type(ty: TypeKind) -> str:
             return "NodeSocketVector"
 
 
-class NodeTreeInputs:
-    def __init__(self, nt: NodeTree):
-        self._grp_in = nt.add_node('NodeGroupInput')
-        self._in = nt._nt.inputs
+class NodeTreeSockets:
+    """The inputs or outputs of a group, kept in the order they are added."""
+    node_type = ''
+
+    def __init__(self, nt: NodeTree, socks: bpy.types.bpy_prop_collection):
+        self._node = nt.find_node(self.node_type) or nt.add_node(self.node_type)
+        self._socks = socks
+        self._names: List[str] = []
 
-    def add_sock(self, name: str, ty: TypeKind) -> bpy.types.NodeSocket:
-        self._in.new(type=get_blender_socket_type(ty), name=name)
+    def add_sock(self, name: str, ty: TypeKind, default=None) -> bpy.types.NodeSocket:
+        sock_type = get_blender_socket_type(ty)
+        sock = self._socks.get(name)
+        if sock and sock.bl_socket_idname != sock_type:
+            self._socks.remove(sock)
+            sock = None
+        if not sock:
+            sock = self._socks.new(type=sock_type, name=name)
+        if default != None:
+            # group nodes keep the value they were tuned to, new ones start
+            # from the default
+            value = list(default) if isinstance(default, tuple) else default
+            if (list(sock.default_value) if isinstance(value, list) else sock.default_value) != value:
+                sock.default_value = value
+        index = self._socks.find(name)
+        if index != len(self._names):
+            self._socks.move(index, len(self._names))
+        self._names.append(name)
         return self.get(name)
 
-    def get(self, name: str) -> bpy.types.NodeSocket:
-        return self._grp_in.outputs[name]
+    def prune(self):
+        for sock in list(self._socks):
+            if sock.name not in self._names:
+                self._socks.remove(sock)
 
 
-class NodeTreeOutputs:
+class NodeTreeInputs(NodeTreeSockets):
+    node_type = 'NodeGroupInput'
+
     def __init__(self, nt: NodeTree):
-        self._grp_out = nt.add_node('NodeGroupOutput')
-        self._out = nt._nt.outputs
+        super().__init__(nt, nt._nt.inputs)
 
-    def add_sock(self, name: str, ty: TypeKind) -> bpy.types.NodeSocket:
-        self._out.new(type=get_blender_socket_type(ty), name=name)
-        return self.get(name)
+    def get(self, name: str) -> bpy.types.NodeSocket:
+        return self._node.outputs[name]
+
+
+class NodeTreeOutputs(NodeTreeSockets):
+    node_type = 'NodeGroupOutput'
+
+    def __init__(self, nt: NodeTree):
+        super().__init__(nt, nt._nt.outputs)
 
     def get(self, name: str) -> bpy.types.NodeSocket:
-        return self._grp_out.inputs[name]
+        return self._node.inputs[name]
@@ -0,0 +1,19 @@
+"""
+In-memory stand-in for the parts of Blender's `bpy` the compiler uses:
+node groups, nodes with their sockets, links and group interfaces, and
+meshes with their vertices and attributes. Only the node types the
+compiler emits are simulated, see `types.node_classes`; `evaluate`
+computes the values they produce. Put the `fakebpy` directory first on
+`sys.path` to import the compiler's Blender modules without Blender.
+"""
+from . import types
+
+data = types.BlendData()
+context = types.Context()
+
+
+def reset():
+    """Starts over with an empty file."""
+    data.node_groups.clear()
+    data.meshes.clear()
+    context.space_data = None
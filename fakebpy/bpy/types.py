@@ -0,0 +1,681 @@
+from __future__ import annotations
+from typing import Callable, Dict, Iterator, List, Tuple
+
+
+class bpy_prop_collection:
+    """Sequence indexable by position or by name."""
+
+    def __init__(self, items: List | None = None):
+        self._items = items if items is not None else []
+
+    def __iter__(self) -> Iterator:
+        return iter(list(self._items))
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            for item in self._items:
+                if item.name == key:
+                    return item
+            raise KeyError(key)
+        return self._items[key]
+
+    def get(self, name: str, default=None):
+        return next((item for item in self._items if item.name == name), default)
+
+    def find(self, name: str) -> int:
+        return next((i for i, item in enumerate(self._items) if item.name == name), -1)
+
+
+class ID:
+    """Datablock with custom properties."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._props: Dict[str, object] = {}
+
+    def __getitem__(self, key: str):
+        return self._props[key]
+
+    def __setitem__(self, key: str, value):
+        self._props[key] = value
+
+    def get(self, key: str, default=None):
+        return self._props.get(key, default)
+
+
+# sockets
+
+
+socket_types = {
+    'NodeSocketFloat': 'VALUE',
+    'NodeSocketInt': 'INT',
+    'NodeSocketVector': 'VECTOR',
+    'NodeSocketBool': 'BOOLEAN',
+    'NodeSocketVirtual': 'CUSTOM',
+}
+
+
+def default_of(sock_type: str):
+    match sock_type:
+        case 'VECTOR':
+            return [0.0, 0.0, 0.0]
+        case 'INT':
+            return 0
+        case 'BOOLEAN':
+            return False
+        case _:
+            return 0.0
+
+
+class NodeSocket:
+    def __init__(self, node: Node, name: str, type: str, identifier: str, is_output: bool, default=None):
+        self.node = node
+        self.name = name
+        self.type = type
+        self.identifier = identifier
+        self.is_output = is_output
+        self.enabled = True
+        self.default_value = default if default is not None else default_of(type)
+
+    @property
+    def links(self) -> List[NodeLink]:
+        return list(self.node.id_data.links.of(self))
+
+    @property
+    def is_linked(self) -> bool:
+        return bool(self.links)
+
+    def as_pointer(self) -> int:
+        return id(self)
+
+    def __repr__(self) -> str:
+        return f"<{self.node.name}.{'outputs' if self.is_output else 'inputs'}[{self.name!r}]>"
+
+
+class NodeSocketVirtual(NodeSocket):
+    pass
+
+
+class NodeLink:
+    def __init__(self, from_socket: NodeSocket, to_socket: NodeSocket):
+        self.from_socket = from_socket
+        self.to_socket = to_socket
+
+    @property
+    def from_node(self) -> Node:
+        return self.from_socket.node
+
+    @property
+    def to_node(self) -> Node:
+        return self.to_socket.node
+
+
+class NodeLinks(bpy_prop_collection):
+    def __init__(self, tree: NodeTree):
+        super().__init__()
+        self.tree = tree
+        # links by the sockets they connect, both ends
+        self.by_socket: Dict[NodeSocket, Dict[NodeLink, None]] = {}
+
+    @property
+    def _items(self) -> List[NodeLink]:  # type: ignore
+        return list(dict.fromkeys(link for links in self.by_socket.values() for link in links))
+
+    @_items.setter
+    def _items(self, items):
+        pass
+
+    def of(self, sock: NodeSocket) -> Iterator[NodeLink]:
+        return iter(self.by_socket.get(sock, ()))
+
+    def new(self, from_socket: NodeSocket, to_socket: NodeSocket) -> NodeLink:
+        if not from_socket.is_output:
+            from_socket, to_socket = to_socket, from_socket
+        assert from_socket.node.id_data is self.tree and to_socket.node.id_data is self.tree
+        # inputs take a single link
+        for link in list(self.of(to_socket)):
+            self.remove(link)
+        link = NodeLink(from_socket, to_socket)
+        self.by_socket.setdefault(from_socket, {})[link] = None
+        self.by_socket.setdefault(to_socket, {})[link] = None
+        return link
+
+    def remove(self, link: NodeLink):
+        del self.by_socket[link.from_socket][link]
+        del self.by_socket[link.to_socket][link]
+
+    def clear(self):
+        self.by_socket.clear()
+
+
+# group interfaces
+
+
+class NodeSocketInterface:
+    def __init__(self, bl_socket_idname: str, name: str):
+        self.bl_socket_idname = bl_socket_idname
+        self.name = name
+        self.identifier = name
+        self.type = socket_types[bl_socket_idname]
+        self.default_value = default_of(self.type)
+
+
+class NodeTreeInterface(bpy_prop_collection):
+    def __init__(self, tree: NodeTree):
+        super().__init__()
+        self.tree = tree
+
+    def new(self, type: str, name: str) -> NodeSocketInterface:
+        sock = NodeSocketInterface(type, name)
+        self._items.append(sock)
+        return sock
+
+    def remove(self, sock: NodeSocketInterface):
+        self._items.remove(sock)
+
+    def move(self, from_index: int, to_index: int):
+        self._items.insert(to_index, self._items.pop(from_index))
+
+    def clear(self):
+        self._items.clear()
+
+
+class InterfaceSockets(bpy_prop_collection):
+    """
+    Sockets of a group input, output or group node, mirroring a tree's
+    interface. Sockets keep their identity while their interface socket
+    exists, links to removed ones are dropped.
+    """
+
+    def __init__(self, node: Node, interface: Callable[[], NodeTreeInterface | None], is_output: bool):
+        super().__init__()
+        self.node = node
+        self.interface = interface
+        self.is_output = is_output
+        self.socks: Dict[int, NodeSocket] = {}
+
+    @property
+    def _items(self) -> List[NodeSocket]:  # type: ignore
+        interface = self.interface()
+        items = list(interface._items) if interface else []
+        socks = {}
+        for item in items:
+            sock = self.socks.get(id(item))
+            if not sock or sock.type != item.type:
+                sock = NodeSocket(self.node, item.name, item.type, item.identifier, self.is_output,
+                                  list(item.default_value) if item.type == 'VECTOR' else item.default_value)
+            sock.name = item.name
+            socks[id(item)] = sock
+        for key, sock in self.socks.items():
+            if key not in socks:
+                for link in sock.links:
+                    self.node.id_data.links.remove(link)
+        self.socks = socks
+        return list(socks.values())
+
+    @_items.setter
+    def _items(self, items):
+        pass
+
+
+# nodes
+
+
+def arity(operation: str, unary: Tuple[str, ...], ternary: Tuple[str, ...]) -> int:
+    if operation in unary:
+        return 1
+    if operation in ternary:
+        return 3
+    return 2
+
+
+math_unary = ('SQRT', 'INVERSE_SQRT', 'ABSOLUTE', 'EXPONENT', 'SIGN', 'ROUND', 'FLOOR', 'CEIL', 'TRUNC',
+              'FRACT', 'SINE', 'COSINE', 'TANGENT', 'ARCSINE', 'ARCCOSINE', 'ARCTANGENT', 'SINH', 'COSH',
+              'TANH', 'RADIANS', 'DEGREES')
+math_ternary = ('MULTIPLY_ADD', 'COMPARE', 'SMOOTH_MIN', 'SMOOTH_MAX', 'WRAP')
+vector_unary = ('ABSOLUTE', 'NORMALIZE', 'LENGTH', 'FLOOR', 'CEIL', 'FRACTION', 'SINE', 'COSINE', 'TANGENT')
+vector_ternary = ('MULTIPLY_ADD', 'FACEFORWARD', 'WRAP')
+vector_scalar_out = ('DOT_PRODUCT', 'DISTANCE', 'LENGTH')
+
+
+class Node:
+    # (name, socket type) of the inputs and outputs, see `update`
+    input_specs: Tuple[Tuple[str, str], ...] = ()
+    output_specs: Tuple[Tuple[str, str], ...] = ()
+
+    def __init__(self, tree: NodeTree, bl_idname: str):
+        self.id_data = tree
+        self.bl_idname = bl_idname
+        self.name = ''
+        self.label = ''
+        self.location = (0.0, 0.0)
+        self.inputs = bpy_prop_collection(self.make_sockets(self.input_specs, False))
+        self.outputs = bpy_prop_collection(self.make_sockets(self.output_specs, True))
+
+    def make_sockets(self, specs: Tuple[Tuple[str, str], ...], is_output: bool) -> List[NodeSocket]:
+        socks: List[NodeSocket] = []
+        seen: Dict[str, int] = {}
+        for name, type in specs:
+            # identifiers of sockets sharing a name are numbered like Blender's
+            n = seen[name] = seen.get(name, -1) + 1
+            identifier = f"{name}_{n:03}" if n else name
+            socks.append(NodeSocket(self, name, type, identifier, is_output))
+        return socks
+
+    def update(self):
+        """Enables the sockets the node's current settings use."""
+
+
+class OperationNode(Node):
+    default_operation = 'ADD'
+
+    def __init__(self, tree: NodeTree, bl_idname: str):
+        super().__init__(tree, bl_idname)
+        self.operation = self.default_operation
+
+    @property
+    def operation(self) -> str:
+        return self._operation
+
+    @operation.setter
+    def operation(self, operation: str):
+        self._operation = operation
+        self.update()
+
+
+class ShaderNodeMath(OperationNode):
+    input_specs = (('Value', 'VALUE'), ('Value', 'VALUE'), ('Value', 'VALUE'))
+    output_specs = (('Value', 'VALUE'), )
+
+    def __init__(self, tree: NodeTree, bl_idname: str):
+        super().__init__(tree, bl_idname)
+        for inp in self.inputs:
+            inp.default_value = 0.5
+
+    def update(self):
+        n = arity(self.operation, math_unary, math_ternary)
+        for i, inp in enumerate(self.inputs):
+            inp.enabled = i < n
+
+
+class ShaderNodeVectorMath(OperationNode):
+    input_specs = (('Vector', 'VECTOR'), ('Vector', 'VECTOR'), ('Vector', 'VECTOR'), ('Scale', 'VALUE'))
+    output_specs = (('Vector', 'VECTOR'), ('Value', 'VALUE'))
+
+    def update(self):
+        if self.operation == 'SCALE':
+            enabled = (0, 3)
+        else:
+            enabled = tuple(range(arity(self.operation, vector_unary, vector_ternary)))
+        for i, inp in enumerate(self.inputs):
+            inp.enabled = i in enabled
+        scalar = self.operation in vector_scalar_out
+        self.outputs[0].enabled = not scalar
+        self.outputs[1].enabled = scalar
+
+
+class FunctionNodeCompare(OperationNode):
+    default_operation = 'GREATER_THAN'
+    input_specs = (('A', 'VALUE'), ('B', 'VALUE'), ('A', 'INT'), ('B', 'INT'), ('A', 'VECTOR'), ('B', 'VECTOR'),
+                   ('C', 'VALUE'), ('Angle', 'VALUE'), ('Epsilon', 'VALUE'))
+    output_specs = (('Result', 'BOOLEAN'), )
+
+    def __init__(self, tree: NodeTree, bl_idname: str):
+        self.data_type = 'FLOAT'
+        super().__init__(tree, bl_idname)
+
+    def update(self):
+        enabled = (0, 1, 8) if self.operation in ('EQUAL', 'NOT_EQUAL') else (0, 1)
+        for i, inp in enumerate(self.inputs):
+            inp.enabled = i in enabled
+
+
+class ShaderNodeCombineXYZ(Node):
+    input_specs = (('X', 'VALUE'), ('Y', 'VALUE'), ('Z', 'VALUE'))
+    output_specs = (('Vector', 'VECTOR'), )
+
+
+class ShaderNodeSeparateXYZ(Node):
+    input_specs = (('Vector', 'VECTOR'), )
+    output_specs = (('X', 'VALUE'), ('Y', 'VALUE'), ('Z', 'VALUE'))
+
+
+class ShaderNodeClamp(Node):
+    input_specs = (('Value', 'VALUE'), ('Min', 'VALUE'), ('Max', 'VALUE'))
+    output_specs = (('Result', 'VALUE'), )
+
+    def __init__(self, tree: NodeTree, bl_idname: str):
+        super().__init__(tree, bl_idname)
+        self.clamp_type = 'MINMAX'
+        self.inputs[2].default_value = 1.0
+
+
+class ShaderNodeMapRange(Node):
+    input_specs = (('Value', 'VALUE'), ('From Min', 'VALUE'), ('From Max', 'VALUE'), ('To Min', 'VALUE'),
+                   ('To Max', 'VALUE'), ('Steps', 'VALUE'), ('Vector', 'VECTOR'))
+    output_specs = (('Result', 'VALUE'), ('Vector', 'VECTOR'))
+
+    def __init__(self, tree: NodeTree, bl_idname: str):
+        super().__init__(tree, bl_idname)
+        self.data_type = 'FLOAT'
+        self.interpolation_type = 'LINEAR'
+        self.inputs[5].enabled = False
+        self.inputs[6].enabled = False
+        self.outputs[1].enabled = False
+
+
+class NodeGroupInput(Node):
+    def __init__(self, tree: NodeTree, bl_idname: str):
+        super().__init__(tree, bl_idname)
+        self.outputs = InterfaceSockets(self, lambda: self.id_data.inputs, True)
+
+
+class NodeGroupOutput(Node):
+    def __init__(self, tree: NodeTree, bl_idname: str):
+        super().__init__(tree, bl_idname)
+        self.inputs = InterfaceSockets(self, lambda: self.id_data.outputs, False)
+
+
+class NodeGroup(Node):
+    def __init__(self, tree: NodeTree, bl_idname: str):
+        super().__init__(tree, bl_idname)
+        self.node_tree: NodeTree | None = None
+        self.inputs = InterfaceSockets(self, lambda: self.node_tree and self.node_tree.inputs, False)
+        self.outputs = InterfaceSockets(self, lambda: self.node_tree and self.node_tree.outputs, True)
+
+
+class ShaderNodeGroup(NodeGroup):
+    pass
+
+
+class GeometryNodeGroup(NodeGroup):
+    pass
+
+
+node_classes: Dict[str, type] = {
+    cls.__name__: cls for cls in (
+        ShaderNodeMath, ShaderNodeVectorMath, FunctionNodeCompare, ShaderNodeCombineXYZ,
+        ShaderNodeSeparateXYZ, ShaderNodeClamp, ShaderNodeMapRange, NodeGroupInput, NodeGroupOutput,
+        ShaderNodeGroup, GeometryNodeGroup,
+    )
+}
+
+# default names of new nodes
+node_names = {
+    'ShaderNodeMath': 'Math',
+    'ShaderNodeVectorMath': 'Vector Math',
+    'FunctionNodeCompare': 'Compare',
+    'ShaderNodeCombineXYZ': 'Combine XYZ',
+    'ShaderNodeSeparateXYZ': 'Separate XYZ',
+    'ShaderNodeClamp': 'Clamp',
+    'ShaderNodeMapRange': 'Map Range',
+    'NodeGroupInput': 'Group Input',
+    'NodeGroupOutput': 'Group Output',
+    'ShaderNodeGroup': 'Group',
+    'GeometryNodeGroup': 'Group',
+}
+
+
+class Nodes(bpy_prop_collection):
+    def __init__(self, tree: NodeTree):
+        super().__init__()
+        self.tree = tree
+        self.by_name: Dict[str, Node] = {}
+        self.suffixes: Dict[str, int] = {}
+
+    def __getitem__(self, key):
+        return self.by_name[key] if isinstance(key, str) else self._items[key]
+
+    def get(self, name: str, default=None):
+        return self.by_name.get(name, default)
+
+    def new(self, type: str) -> Node:
+        assert type in node_classes, f"node type `{type}` is not simulated"
+        node = node_classes[type](self.tree, type)
+        self._items.append(node)
+        node.name = node_names[type]
+        return node
+
+    def remove(self, node: Node):
+        for sock in list(node.inputs) + list(node.outputs):
+            for link in list(sock.links):
+                self.tree.links.remove(link)
+        self._items.remove(node)
+        del self.by_name[node.name]
+
+    def clear(self):
+        self.tree.links.clear()
+        self._items.clear()
+        self.by_name.clear()
+        self.suffixes.clear()
+
+    def rename(self, node: Node, name: str) -> str:
+        # names are unique within a tree, like in Blender
+        if self.by_name.get(node.name) is node:
+            del self.by_name[node.name]
+        unique, n = name, self.suffixes.get(name, 0)
+        while unique in self.by_name:
+            n += 1
+            unique = f"{name}.{n:03}"
+        # the next free suffix is at least this one
+        self.suffixes[name] = n
+        self.by_name[unique] = node
+        return unique
+
+
+def _node_name_get(self: Node) -> str:
+    return self._name
+
+
+def _node_name_set(self: Node, name: str):
+    self._name = self.id_data.nodes.rename(self, name) if name else name
+
+
+Node.name = property(_node_name_get, _node_name_set)  # type: ignore
+
+
+class NodeTree(ID):
+    def __init__(self, name: str, bl_idname: str):
+        super().__init__(name)
+        self.bl_idname = bl_idname
+        self.nodes = Nodes(self)
+        self.links = NodeLinks(self)
+        self.inputs = NodeTreeInterface(self)
+        self.outputs = NodeTreeInterface(self)
+
+
+class ShaderNodeTree(NodeTree):
+    pass
+
+
+class GeometryNodeTree(NodeTree):
+    pass
+
+
+class BlendDataNodeTrees(bpy_prop_collection):
+    def __init__(self) -> None:
+        super().__init__()
+        self.by_name: Dict[str, NodeTree] = {}
+
+    def __getitem__(self, key):
+        return self.by_name[key] if isinstance(key, str) else self._items[key]
+
+    def get(self, name: str, default=None):
+        return self.by_name.get(name, default)
+
+    def new(self, name: str, type: str) -> NodeTree:
+        tree_cls = {'ShaderNodeTree': ShaderNodeTree, 'GeometryNodeTree': GeometryNodeTree}[type]
+        unique, n = name, 0
+        while unique in self.by_name:
+            n += 1
+            unique = f"{name}.{n:03}"
+        tree = tree_cls(unique, type)
+        self._items.append(tree)
+        self.by_name[unique] = tree
+        return tree
+
+    def remove(self, tree: NodeTree):
+        self._items.remove(tree)
+        del self.by_name[tree.name]
+        # group nodes keep the removed tree like Blender's, but without users
+        for other in self._items:
+            for node in other.nodes:
+                if getattr(node, 'node_tree', None) is tree:
+                    node.node_tree = None
+
+    def clear(self):
+        self._items.clear()
+        self.by_name.clear()
+
+
+# meshes
+
+
+# `foreach_get` property and number of values per element by data type
+attribute_props = {
+    'FLOAT': ('value', 1),
+    'INT': ('value', 1),
+    'BOOLEAN': ('value', 1),
+    'FLOAT_VECTOR': ('vector', 3),
+    'FLOAT_COLOR': ('color', 4),
+}
+
+
+def check_foreach(prop: str, expected: str, seq, values: List) -> None:
+    assert prop == expected, f"no property `{prop}`"
+    assert len(seq) == len(values), f"expected {len(values)} values, found {len(seq)}"
+
+
+class MeshVertices:
+    def __init__(self) -> None:
+        self.co: List[float] = []
+
+    def __len__(self) -> int:
+        return len(self.co) // 3
+
+    def add(self, count: int):
+        self.co += [0.0] * (3 * count)
+
+    def foreach_get(self, prop: str, seq):
+        check_foreach(prop, 'co', seq, self.co)
+        seq[:] = self.co
+
+    def foreach_set(self, prop: str, seq):
+        check_foreach(prop, 'co', seq, self.co)
+        self.co = [float(v) for v in seq]
+
+
+class MeshPolygons:
+    def __init__(self) -> None:
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, count: int):
+        self.count += count
+
+
+class AttributeData:
+    """The values of an attribute, only accessed in bulk."""
+
+    def __init__(self, data_type: str, size: int):
+        self.data_type = data_type
+        self.prop, width = attribute_props[data_type]
+        self.size = size
+        self.values: List = [0] * (size * width)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def foreach_get(self, prop: str, seq):
+        check_foreach(prop, self.prop, seq, self.values)
+        seq[:] = self.values
+
+    def foreach_set(self, prop: str, seq):
+        check_foreach(prop, self.prop, seq, self.values)
+        self.values = [int(v) if self.data_type in ('INT', 'BOOLEAN') else float(v) for v in seq]
+
+
+class Attribute:
+    def __init__(self, name: str, data_type: str, domain: str, size: int):
+        self.name = name
+        self.data_type = data_type
+        self.domain = domain
+        self.data = AttributeData(data_type, size)
+
+
+class AttributeGroup(bpy_prop_collection):
+    def __init__(self, mesh: Mesh):
+        super().__init__()
+        self.mesh = mesh
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def new(self, name: str, type: str, domain: str) -> Attribute:
+        assert name not in self, f"attribute `{name}` already exists"
+        sizes = {'POINT': len(self.mesh.vertices), 'FACE': len(self.mesh.polygons)}
+        assert domain in sizes, f"domain `{domain}` is not simulated"
+        attr = Attribute(name, type, domain, sizes[domain])
+        self._items.append(attr)
+        return attr
+
+    def remove(self, attr: Attribute):
+        self._items.remove(attr)
+
+
+class Mesh(ID):
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.vertices = MeshVertices()
+        self.polygons = MeshPolygons()
+        self.attributes = AttributeGroup(self)
+        # number of `update` calls
+        self.updates = 0
+
+    def update(self):
+        self.updates += 1
+
+
+class BlendDataMeshes(bpy_prop_collection):
+    def new(self, name: str) -> Mesh:
+        mesh = Mesh(name)
+        self._items.append(mesh)
+        return mesh
+
+    def remove(self, mesh: Mesh):
+        self._items.remove(mesh)
+
+    def clear(self):
+        self._items.clear()
+
+
+class BlendData:
+    def __init__(self) -> None:
+        self.node_groups = BlendDataNodeTrees()
+        self.meshes = BlendDataMeshes()
+
+
+# editor
+
+
+class Space:
+    pass
+
+
+class SpaceNodeEditor(Space):
+    def __init__(self, node_tree: NodeTree):
+        self.node_tree = node_tree
+
+    @property
+    def tree_type(self) -> str:
+        return self.node_tree.bl_idname
+
+
+class Context:
+    def __init__(self, space_data: Space | None = None):
+        self.space_data = space_data
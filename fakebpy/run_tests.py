@@ -0,0 +1,141 @@
+"""
+Runs the `tests/*.py` suites against the fake `bpy` instead of a Blender
+session: each test is compiled into a geometry node tree by `NodeGen` and
+the group node's outputs are evaluated in Python, then compared like
+`BLSL_OT_run_tests` compares the attributes Blender computes. With
+`--numpy` the functions are evaluated by `compiler.npeval` instead, without
+generating nodes. When no suite is named, the examples in the docstrings
+of the compiler and of `nodeeval` are run too.
+
+    python fakebpy/run_tests.py [-j JOBS] [--numpy] [SUITE ...]
+"""
+from __future__ import annotations
+import argparse
+import doctest
+import importlib
+import pathlib
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+root = pathlib.Path(__file__).resolve().parent.parent
+sys.path[:0] = [str(root / 'fakebpy'), str(root)]
+
+import bpy  # noqa: E402
+import numpy as np  # noqa: E402
+from compiler.cache import compile_cached  # noqa: E402
+from compiler.nodegen import NodeGen  # noqa: E402
+from compiler.npeval import evaluate  # noqa: E402
+from nodeeval import evaluate_node  # noqa: E402
+
+
+def run_test(test: dict, numpy: bool = False) -> List[Tuple[str, object, object]]:
+    """Returns the mismatching outputs as (name, expected, output)."""
+    if numpy:
+        result = compile_cached(test['src'], 'GeometryNodeTree')
+        outputs = {name: value[0] for name, value in evaluate(result.module, test.get('input', {})).items()}
+        return [(name, np.float32(test['output'][name]), outputs[name])
+                for name in test['output'] if np.any(outputs[name] != np.float32(test['output'][name]))]
+
+    bpy.reset()
+    host = bpy.data.node_groups.new('tests', 'GeometryNodeTree')
+    bpy.context.space_data = bpy.types.SpaceNodeEditor(host)
+    result = compile_cached(test['src'], host.bl_idname)
+    NodeGen(result.module, bpy.context).emit(compiled=result)
+    node = host.nodes[-1]
+    for key, value in test.get('input', {}).items():
+        node.inputs[key].default_value = value
+
+    assert len(test['output']) == len(node.outputs)
+    mismatches = []
+    for name, value in evaluate_node(node).items():
+        expected = np.float32(test['output'][name])
+        # vectors are read back as 3 components, like the attributes
+        data = np.float32(value)
+        if np.any(data != expected):
+            mismatches.append((name, expected, data))
+    return mismatches
+
+
+def run_suite(stem: str, numpy: bool = False) -> Tuple[int, int, int, List[str]]:
+    """Returns the number of passed, failed and skipped outputs and the report."""
+    passed = failed = skipped = 0
+    lines: List[str] = []
+    suite = importlib.import_module(f'tests.{stem}')
+    for test in suite._:
+        if test.get('skip', False):
+            skipped += 1
+            lines.append(f"\x1b[1;33m[WARN]\x1b[0m {stem}.py: \"{test['title']}\" skipped")
+            continue
+        try:
+            mismatches = run_test(test, numpy)
+        except AssertionError as e:
+            failed += 1
+            lines.append(f"\x1b[1;31m[ERR]\x1b[0m {stem}.py: \"{test['title']}\" failed: {e}")
+            continue
+        for name, expected, data in mismatches:
+            lines.append(f"\x1b[1;31m[ERR]\x1b[0m {stem}.py: \"{test['title']}\" failed")
+            lines.append(f"    expected: {expected}")
+            lines.append(f"    output: {data}")
+        failed += len(mismatches)
+        passed += len(test['output']) - len(mismatches)
+    return passed, failed, skipped, lines
+
+
+def run_doctests() -> Tuple[int, int]:
+    """Returns the number of failed and attempted examples, failures are printed."""
+    files = [file for file in sorted((root / 'compiler').iterdir()) if file.suffix == '.py']
+    failed = attempted = 0
+    for file in files + [root / 'fakebpy' / 'nodeeval.py']:
+        text = file.read_text()
+        if '>>>' not in text:
+            continue
+        module = importlib.import_module(f"compiler.{file.stem}" if file.parent.name == 'compiler' else file.stem)
+        if 'doctest.testfile' in text:
+            # examples written for the whole file, like the module runs them on import
+            result = doctest.testfile(str(file), module_relative=False, globs=vars(module))
+        else:
+            result = doctest.testmod(module)
+        failed += result.failed
+        attempted += result.attempted
+    return failed, attempted
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="run the test suites without Blender")
+    parser.add_argument('suites', nargs='*', help="names of files in tests/, all by default")
+    parser.add_argument('-j', '--jobs', type=int, default=1, help="worker processes")
+    parser.add_argument('--numpy', action='store_true', help="evaluate with NumPy instead of nodes")
+    args = parser.parse_args(argv)
+
+    stems = args.suites or sorted(file.stem for file in (root / 'tests').iterdir() if file.suffix == '.py')
+    if args.jobs > 1:
+        with ProcessPoolExecutor(args.jobs) as pool:
+            results = list(pool.map(run_suite, stems, [args.numpy] * len(stems)))
+    else:
+        results = [run_suite(stem, args.numpy) for stem in stems]
+
+    passed = sum(result[0] for result in results)
+    failed = sum(result[1] for result in results)
+    skipped = sum(result[2] for result in results)
+    for result in results:
+        for line in result[3]:
+            print(line)
+    if failed:
+        plural = "s" if failed > 1 else ""
+        print(f"  \x1b[1;31m[ERR]\x1b[0m {failed} test{plural} failed, {passed} passed", end="")
+    else:
+        print(f"  \x1b[1;32m[OK]\x1b[0m {passed} tests passed", end="")
+    print(f", {skipped} skipped" if skipped else "")
+    if not args.suites:
+        doctest_failed, attempted = run_doctests()
+        if doctest_failed:
+            print(f"  \x1b[1;31m[ERR]\x1b[0m {doctest_failed} of {attempted} doctest examples failed")
+        else:
+            print(f"  \x1b[1;32m[OK]\x1b[0m {attempted} doctest examples passed")
+        failed += doctest_failed
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
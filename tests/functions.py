@@ -0,0 +1,38 @@
+_ = [
+    {
+        'title': "helper function",
+        'src': """float square(float v) {
+            return v * v;
+        }
+
+        float test(float x) {
+            return square(x) + square(x + 1.0);
+        }""",
+        'input': {
+            'x': 2.0,
+        },
+        'output': {
+            'ret': 13.0
+        }
+    },
+    {
+        'title': "out arguments",
+        'src': """void bounds(float v, out float lo, out float hi) {
+            lo = v - 1.0;
+            hi = v + 1.0;
+        }
+
+        float test(float x, out float y) {
+            float lo = 0.0;
+            bounds(x, lo, y);
+            return lo * y;
+        }""",
+        'input': {
+            'x': 3.0,
+        },
+        'output': {
+            'ret': 8.0,
+            'y': 4.0
+        }
+    },
+]
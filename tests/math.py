@@ -111,4 +111,30 @@ _ = [
             'ret': [1.5, 2.5, 0.0]
         }
     },
+    {
+        'title': "const locals",
+        'src': """float test(float x) {
+            const float scale = 2.0 * 4.0;
+            const float bias = -scale + sqrt(16.0);
+            return x * scale + bias;
+        }""",
+        'input': {
+            'x': 0.5,
+        },
+        'output': {
+            'ret': 0.0
+        }
+    },
+    {
+        'title': "left associative operators",
+        'src': """float test(float x) {
+            return x - 1.0 - 2.0 + x / 2.0 * 4.0;
+        }""",
+        'input': {
+            'x': 5.0,
+        },
+        'output': {
+            'ret': 12.0
+        }
+    },
 ]